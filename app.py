@@ -1,9 +1,12 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Flask, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask_jwt_extended import JWTManager
+from flask_jwt_extended import JWTManager, jwt_required
 from flask_cors import CORS
 from dotenv import load_dotenv
+from responses import FastJSONProvider, json_response
+import database
+import replicas
 import os
 
 load_dotenv()
@@ -14,6 +17,7 @@ app = Flask(
     static_folder='static',
     template_folder='templates'
 )
+app.json = FastJSONProvider(app)
 
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
 app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'dev-jwt-secret-key')
@@ -27,40 +31,118 @@ if database_url.startswith('postgres://'):
 
 app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Connection pool for Postgres (per process; the sum over all workers must stay under the server's max_connections)
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', '5'))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Pragmas for every SQLite connection (empty = SQLite's default); cache_size < 0 is in KiB
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_MMAP_SIZE'] = os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))
+app.config['SQLITE_CACHE_SIZE'] = os.getenv('SQLITE_CACHE_SIZE', '-65536')
+app.config['SQLITE_BUSY_TIMEOUT'] = os.getenv('SQLITE_BUSY_TIMEOUT', '5000')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database.engine_options(database_url, app.config)
+# Read replicas (comma separated URLs) for the catalog and order reads, see replicas.py
+replica_urls = [
+    url.strip().replace('postgres://', 'postgresql://', 1)
+    for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+app.config['SQLALCHEMY_BINDS'] = replicas.replica_binds(replica_urls, lambda url: database.engine_options(url, app.config))
+# Replicas further behind the primary than this (seconds) are skipped until they catch up
+app.config['REPLICA_MAX_LAG'] = float(os.getenv('REPLICA_MAX_LAG', '5'))
+app.config['REPLICA_CHECK_INTERVAL'] = float(os.getenv('REPLICA_CHECK_INTERVAL', '2'))
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
+# Upload storage - 'local' (UPLOAD_FOLDER) or 's3' (any S3-compatible bucket; AWS_* env vars hold credentials)
+app.config['STORAGE_BACKEND'] = os.getenv('STORAGE_BACKEND', 'local')
+app.config['S3_BUCKET'] = os.getenv('S3_BUCKET')
+app.config['S3_PREFIX'] = os.getenv('S3_PREFIX', '')
+app.config['S3_REGION'] = os.getenv('S3_REGION')
+# Custom endpoint for MinIO/R2 etc.; 'memory://' uses an in-process fake bucket
+app.config['S3_ENDPOINT_URL'] = os.getenv('S3_ENDPOINT_URL')
+# Public/CDN base URL for the bucket; without it downloads redirect to presigned URLs
+app.config['S3_PUBLIC_URL'] = os.getenv('S3_PUBLIC_URL')
+app.config['S3_PRESIGN_TTL'] = int(os.getenv('S3_PRESIGN_TTL', '3600'))
+# Let a front server (Apache mod_xsendfile, lighttpd) send static files and uploads via X-Sendfile
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', 'false').lower() == 'true'
+# Derivative formats generated for uploaded images, best first (JPEG is always added as fallback)
+app.config['IMAGE_FORMATS'] = tuple(os.getenv('IMAGE_FORMATS', 'webp,jpeg').split(','))
+
+# Background jobs - worker threads per app process (0 = only `flask run-worker` processes jobs)
+app.config['TASK_WORKER_THREADS'] = int(os.getenv('TASK_WORKER_THREADS', '2'))
+app.config['TASK_POLL_INTERVAL'] = float(os.getenv('TASK_POLL_INTERVAL', '2'))
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = False  # For dev, set to timedelta in production
+# How long each worker trusts its cached token versions before re-reading revocations
+app.config['JWT_TOKEN_VERSION_TTL'] = int(os.getenv('JWT_TOKEN_VERSION_TTL', '30'))
+
+# How long a cart quote's prices are honoured by POST /api/orders (seconds)
+app.config['QUOTE_TTL'] = int(os.getenv('QUOTE_TTL', '900'))
+
+# Catalog response cache - in-memory LRU tier, plus a shared Redis tier when configured
+app.config['CATALOG_CACHE_ENABLED'] = os.getenv('CATALOG_CACHE_ENABLED', 'true').lower() == 'true'
+app.config['CATALOG_CACHE_SIZE'] = int(os.getenv('CATALOG_CACHE_SIZE', '512'))
+app.config['CATALOG_CACHE_TTL'] = int(os.getenv('CATALOG_CACHE_TTL', '300'))
+# Per-product fragments shared by the product and batch views, in their own LRU
+app.config['CATALOG_FRAGMENT_CACHE_SIZE'] = int(os.getenv('CATALOG_FRAGMENT_CACHE_SIZE', '5000'))
+app.config['CATALOG_CACHE_REDIS_URL'] = os.getenv('CATALOG_CACHE_REDIS_URL')
+
+# Compression of /api JSON responses (br and zstd need the brotli/zstandard packages)
+app.config['COMPRESS_ENABLED'] = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+app.config['COMPRESS_GZIP_LEVEL'] = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+app.config['COMPRESS_BROTLI_QUALITY'] = int(os.getenv('COMPRESS_BROTLI_QUALITY', '4'))
+app.config['COMPRESS_ZSTD_LEVEL'] = int(os.getenv('COMPRESS_ZSTD_LEVEL', '3'))
+# Compressed bodies kept per ETag so cached catalog responses are compressed once
+app.config['COMPRESS_CACHE_SIZE'] = int(os.getenv('COMPRESS_CACHE_SIZE', '256'))
+
+# Request instrumentation - per-endpoint timings and SQL counts at /api/metrics, Server-Timing headers
+app.config['INSTRUMENTATION_ENABLED'] = os.getenv('INSTRUMENTATION_ENABLED', 'false').lower() == 'true'
+app.config['SERVER_TIMING'] = os.getenv('SERVER_TIMING', 'true').lower() == 'true'
+# Bearer token required to scrape /api/metrics (unset = open)
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN')
+# Fraction of requests profiled, and a token that profiles any request sent with `X-Profile: <token>`
+app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+app.config['PROFILE_TOKEN'] = os.getenv('PROFILE_TOKEN')
+# 'cprofile' or 'pyinstrument' (needs the pyinstrument package)
+app.config['PROFILER'] = os.getenv('PROFILER', 'cprofile')
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', 'profiles')
+
+# Query budgets declared with @query_budget(n): 'raise', 'warn' or 'off' (default: raise when TESTING, else off)
+app.config['QUERY_BUDGET_MODE'] = os.getenv('QUERY_BUDGET_MODE')
+# Development aid - log statements repeated within one request (likely N+1s) with their to_dict call site
+app.config['QUERY_DEBUG'] = os.getenv('QUERY_DEBUG', 'false').lower() == 'true'
+app.config['QUERY_REPEAT_THRESHOLD'] = int(os.getenv('QUERY_REPEAT_THRESHOLD', '3'))
+
+# Product search backend - 'auto' uses SQLite FTS5 when available, otherwise an in-memory index
+app.config['SEARCH_BACKEND'] = os.getenv('SEARCH_BACKEND', 'auto')
 
 # Ensure upload folder exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': replicas.RoutingSession})
+database.init_app(app, db)
+if replica_urls:
+    replicas.replica_router.init_app(app, db)
 migrate = Migrate(app, db)
 jwt = JWTManager(app)
 
 # JWT error handlers
 @jwt.expired_token_loader
 def expired_token_callback(jwt_header, jwt_payload):
-    return jsonify({
-        'success': False,
-        'message': 'Token has expired',
-        'errors': ['Your session has expired. Please login again.']
-    }), 401
+    return json_response(False, message='Token has expired', errors=['Your session has expired. Please login again.'], status_code=401)
 
 @jwt.invalid_token_loader
 def invalid_token_callback(error):
-    return jsonify({
-        'success': False,
-        'message': 'Invalid token',
-        'errors': ['Invalid authentication token. Please login again.']
-    }), 401
+    return json_response(False, message='Invalid token', errors=['Invalid authentication token. Please login again.'], status_code=401)
+
+@jwt.revoked_token_loader
+def revoked_token_callback(jwt_header, jwt_payload):
+    return json_response(False, message='Token has been revoked', errors=['Your permissions have changed. Please login again.'], status_code=401)
 
 @jwt.unauthorized_loader
 def missing_token_callback(error):
-    return jsonify({
-        'success': False,
-        'message': 'Authorization required',
-        'errors': ['Authorization token is missing. Please login.']
-    }), 401
+    return json_response(False, message='Authorization required', errors=['Authorization token is missing. Please login.'], status_code=401)
 
 # CORS configuration - allow requests from frontend domains
 cors_origins = [
@@ -71,50 +153,69 @@ cors_origins = [
 CORS(app, origins=cors_origins, supports_credentials=True, methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'], allow_headers=['Content-Type', 'Authorization'])
 
 # Import routes after db is initialized
-from routes.auth import auth_bp
+from routes.auth import auth_bp, admin_required
 from routes.catalog import catalog_bp
 from routes.orders import orders_bp
+from routes.cart import cart_bp
+import search  # registers the `flask search-reindex` command
+from static_files import send_static_asset, index_page
 
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(catalog_bp, url_prefix='/api')
 app.register_blueprint(orders_bp, url_prefix='/api/orders')
+app.register_blueprint(cart_bp, url_prefix='/api/cart')
+
+if app.config['INSTRUMENTATION_ENABLED']:
+    import instrumentation
+    instrumentation.init_app(app)
 
+if app.config['QUERY_DEBUG']:
+    import query_budget
+    query_budget.init_app(app)
+
+if app.config['COMPRESS_ENABLED']:
+    from compression import CompressionMiddleware
+    app.wsgi_app = CompressionMiddleware.from_config(app.wsgi_app, app.config)
+
+# Liveness only, for load balancers and uptime checks; the internals below are for admins
 @app.route('/api/health')
 def health():
     return {'success': True, 'message': 'API is running'}
 
+@app.route('/api/health/details')
+@jwt_required()
+def health_details():
+    if not admin_required():
+        return json_response(False, message='Admin access required', status_code=403)
+    data = {'database': database.all_pool_stats(db)}
+    if replicas.replica_router.enabled:
+        data['replicas'] = replicas.replica_router.status()
+    return json_response(True, data=data)
+
+@app.route('/api/cache/stats')
+@jwt_required()
+def cache_stats():
+    if not admin_required():
+        return json_response(False, message='Admin access required', status_code=403)
+    from cache import catalog_cache
+    return json_response(True, data=catalog_cache.stats())
+
 # Error handlers
 @app.errorhandler(422)
 def handle_422(e):
     """Handle 422 Unprocessable Entity errors"""
-    import traceback
-    print("=== 422 ERROR ===")
-    print(f"Error: {e}")
-    print(f"Error description: {getattr(e, 'description', 'No description')}")
-    print(f"Request method: {request.method}")
-    print(f"Request path: {request.path}")
-    print(f"Request headers: {dict(request.headers)}")
-    print(f"Request data: {request.data}")
-    traceback.print_exc()
+    app.logger.warning(f'422 on {request.method} {request.path}: {getattr(e, "description", e)}')
     
     error_msg = 'The request was well-formed but contains semantic errors.'
     if hasattr(e, 'description'):
         error_msg = str(e.description)
     
-    return jsonify({
-        'success': False,
-        'message': 'Unprocessable Entity',
-        'errors': [error_msg]
-    }), 422
+    return json_response(False, message='Unprocessable Entity', errors=[error_msg], status_code=422)
 
 @app.errorhandler(400)
 def handle_400(e):
     """Handle 400 Bad Request errors"""
-    return jsonify({
-        'success': False,
-        'message': 'Bad Request',
-        'errors': [str(e.description) if hasattr(e, 'description') else 'Invalid request']
-    }), 400
+    return json_response(False, message='Bad Request', errors=[str(e.description) if hasattr(e, 'description') else 'Invalid request'], status_code=400)
 
 # ---------- SPA FRONTEND ROUTES ----------
 # Serve Angular app for all non-API routes
@@ -122,10 +223,15 @@ def handle_400(e):
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def spa(path):
-    # Serve Angular index.html for all non-API routes
+    # Build output (bundles, favicon, assets/) is referenced from the site root
+    if path:
+        response = send_static_asset(path)
+        if response is not None:
+            return response
+    # Serve Angular index.html for all other non-API routes
     # Angular Router will handle client-side routing
     # API routes are already handled above, so this only catches frontend routes
-    return render_template('index.html')
+    return index_page.response()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,98 @@
+"""Benchmark API response compression: bytes on the wire and CPU per request.
+
+Builds a throwaway SQLite database with generated bilingual products and
+requests the product listing (full documents and the card view) through
+`CompressionMiddleware` with each available encoding and a few levels. The
+catalog response cache stays on, so the timings isolate the compression
+cost; the last row of each block shows a repeat request served from the
+middleware's compressed-body cache.
+
+Usage: python -m benchmarks.compression_benchmark [--products 1000] [--repeat 20]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.search_benchmark import generate
+
+SETTINGS = [
+    ('identity', None, None),
+    ('gzip', 'gzip', 1),
+    ('gzip', 'gzip', 6),
+    ('gzip', 'gzip', 9),
+    ('br', 'br', 4),
+    ('br', 'br', 11),
+    ('zstd', 'zstd', 3),
+    ('zstd', 'zstd', 10),
+]
+
+
+def measure(client, url, encoding, repeat):
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    wall = []
+    cpu = []
+    size = 0
+    for _ in range(repeat):
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        response = client.get(url, headers=headers)
+        body = response.get_data()
+        wall.append((time.perf_counter() - start_wall) * 1000)
+        cpu.append((time.process_time() - start_cpu) * 1000)
+        size = len(body)
+        assert response.headers.get('Content-Encoding') == encoding, response.headers
+    return statistics.median(wall), statistics.median(cpu), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--products', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='athar-compression-bench-')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['COMPRESS_ENABLED'] = 'false'
+
+    from werkzeug.test import Client
+    from app import app, db
+    from models import Category, Product
+    from compression import CompressionMiddleware, available_encodings
+
+    with app.app_context():
+        db.create_all()
+        generate(db, Category, Product, args.products)
+
+    encodings = available_encodings()
+    print(f'Products: {args.products}, encodings available: {", ".join(encodings)}\n')
+    header = f'{"response":<22}{"encoding":<10}{"level":>6}{"bytes":>10}{"ratio":>8}{"wall ms":>10}{"cpu ms":>9}'
+    print(header)
+    print('-' * len(header))
+
+    for label, url in [('listing (full)', '/api/products'), ('listing (card view)', '/api/products?view=card')]:
+        identity = None
+        for name, encoding, level in SETTINGS:
+            if encoding and encoding not in encodings:
+                continue
+            levels = {encoding: level} if encoding else None
+            client = Client(CompressionMiddleware(app.wsgi_app, levels=levels, cache_size=0))
+            client.get(url)  # fill the catalog cache
+            wall, cpu, size = measure(client, url, encoding, args.repeat)
+            identity = identity or size
+            print(f'{label:<22}{name:<10}{level or "-":>6}{size:>10}{identity / size:>8.1f}{wall:>10.2f}{cpu:>9.2f}')
+
+        client = Client(CompressionMiddleware(app.wsgi_app))
+        client.get(url, headers={'Accept-Encoding': 'gzip'})
+        wall, cpu, size = measure(client, url, 'gzip', args.repeat)
+        print(f'{label:<22}{"gzip":<10}{"6":>6}{size:>10}{identity / size:>8.1f}{wall:>10.2f}{cpu:>9.2f}  (compressed-body cache)')
+        print()
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
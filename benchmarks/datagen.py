@@ -0,0 +1,225 @@
+"""Generate a large, reproducible benchmark catalog.
+
+Bulk-inserts users, categories, products, product images and historical
+orders with their items through `insert()` executemany batches, so a
+100k-product catalog with a few hundred thousand order lines takes seconds
+rather than the minutes per-row `session.add` would. The same seed always
+produces the same rows, and the layout is predictable so the load test
+(benchmarks/load_test.py) can address it without reading the database:
+
+- ids start at 1 and are contiguous for every table;
+- `bench-admin@athar.com` and `bench-user-<n>@athar.com` (n = 1..users)
+  all use the password `bench123`;
+- every tenth product (id % 10 == 0) is a checkout SKU with effectively
+  unlimited stock, so checkout runs never fail on stock.
+
+After the insert the product summaries and the search index are rebuilt,
+as `flask summaries-rebuild` and `flask search-reindex` would.
+
+Usage: python -m benchmarks.datagen --database-url sqlite:///bench.db [--products 10000] [--users 1000] [--orders 20000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.search_benchmark import AR_WORDS, EN_WORDS, sentence
+
+BATCH_SIZE = 5000
+PASSWORD = 'bench123'
+CHECKOUT_STOCK = 10 ** 9
+ORDER_STATUSES = ['pending', 'paid', 'shipped', 'delivered', 'cancelled']
+
+
+def user_email(n):
+    return f'bench-user-{n}@athar.com'
+
+
+def is_checkout_product(product_id):
+    return product_id % 10 == 0
+
+
+def _insert(db, table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        db.session.execute(db.insert(table), rows[start:start + BATCH_SIZE])
+
+
+def _batched(db, table, rows):
+    """Insert rows from a generator in BATCH_SIZE executemany batches"""
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(db.insert(table), batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(table), batch)
+        count += len(batch)
+    return count
+
+
+def generate_dataset(users=1000, categories=20, products=10000, images_per_product=2, orders=20000,
+                     max_order_lines=4, seed=42):
+    """Fill the (empty) database of the current app with a benchmark catalog.
+
+    Returns the number of rows inserted per table.
+    """
+    from werkzeug.security import generate_password_hash
+    from app import db
+    from models import User, Category, Product, ProductImage, Order, OrderItem
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    # Hashing is deliberately slow; every generated user shares one hash
+    password_hash = generate_password_hash(PASSWORD)
+
+    _insert(db, User, [
+        {'id': 1, 'name': 'Bench Admin', 'email': 'bench-admin@athar.com', 'password_hash': password_hash,
+         'role': 'admin', 'token_version': 0, 'created_at': now - timedelta(days=400)}
+    ] + [
+        {'id': n + 1, 'name': f'Bench User {n}', 'email': user_email(n), 'password_hash': password_hash,
+         'role': 'customer', 'token_version': 0, 'created_at': now - timedelta(minutes=n)}
+        for n in range(1, users + 1)
+    ])
+
+    _insert(db, Category, [
+        {'id': i, 'name_en': f'Category {i}', 'name_ar': f'فئة {i}', 'slug': f'category-{i}'}
+        for i in range(1, categories + 1)
+    ])
+
+    prices = {}
+
+    def product_rows():
+        for i in range(1, products + 1):
+            price = rng.randint(500, 20000) / 100
+            prices[i] = price
+            yield {
+                'id': i,
+                'name_en': sentence(rng, EN_WORDS, 3).title(),
+                'name_ar': sentence(rng, AR_WORDS, 3),
+                'description_en': sentence(rng, EN_WORDS, 25),
+                'description_ar': sentence(rng, AR_WORDS, 25),
+                'price': price,
+                'stock': CHECKOUT_STOCK if is_checkout_product(i) else rng.randint(0, 200),
+                'sku': f'BENCH-{i:07d}',
+                'category_id': rng.randint(1, categories),
+                'ingredients_en': sentence(rng, EN_WORDS, 8),
+                'ingredients_ar': sentence(rng, AR_WORDS, 8),
+                'usage_en': sentence(rng, EN_WORDS, 12),
+                'usage_ar': sentence(rng, AR_WORDS, 12),
+                'is_featured': rng.random() < 0.05,
+                'created_at': now - timedelta(minutes=i)
+            }
+
+    def image_rows():
+        image_id = 0
+        for product_id in range(1, products + 1):
+            for position in range(images_per_product):
+                image_id += 1
+                base = f'/api/uploads/bench/{product_id:07d}-{position}'
+                yield {
+                    'id': image_id,
+                    'product_id': product_id,
+                    'url': f'{base}.jpg',
+                    'alt_text': f'Product {product_id} image {position + 1}',
+                    'width': 1600,
+                    'height': 1600,
+                    'variants': {
+                        'webp': {str(w): f'{base}-{w}w.webp' for w in (320, 640, 1280)},
+                        'jpeg': {str(w): f'{base}-{w}w.jpg' for w in (320, 640, 1280)}
+                    },
+                    'status': 'ready'
+                }
+
+    counts = {
+        'users': users + 1,
+        'categories': categories,
+        'products': _batched(db, Product, product_rows()),
+        'product_images': _batched(db, ProductImage, image_rows()),
+    }
+
+    order_rows = []
+    item_rows = []
+    item_id = 0
+    # Historical orders spread over the last year, oldest first
+    for order_id in range(1, orders + 1):
+        lines = rng.sample(range(1, products + 1), min(products, rng.randint(1, max_order_lines)))
+        total = 0
+        for product_id in lines:
+            item_id += 1
+            quantity = rng.randint(1, 3)
+            line_total = round(prices[product_id] * quantity, 2)
+            total += line_total
+            item_rows.append({'id': item_id, 'order_id': order_id, 'product_id': product_id, 'quantity': quantity,
+                              'unit_price': prices[product_id], 'line_total': line_total})
+        order_rows.append({
+            'id': order_id,
+            'user_id': rng.randint(2, users + 1) if users else 1,
+            'status': rng.choices(ORDER_STATUSES, weights=[10, 15, 15, 55, 5])[0],
+            'total': round(total, 2),
+            'payment_method': 'cash_on_delivery',
+            'shipping_name': 'Bench Customer',
+            'shipping_phone': '000',
+            'shipping_city': rng.choice(['Beirut', 'Tripoli', 'Sidon', 'Tyre', 'Zahle']),
+            'shipping_street': f'Street {rng.randint(1, 500)}',
+            'shipping_notes': '',
+            'created_at': now - timedelta(seconds=(orders - order_id) * 365 * 86400 // max(orders, 1))
+        })
+        if len(item_rows) >= BATCH_SIZE:
+            _insert(db, Order, order_rows)
+            _insert(db, OrderItem, item_rows)
+            order_rows, item_rows = [], []
+    _insert(db, Order, order_rows)
+    _insert(db, OrderItem, item_rows)
+    counts['orders'] = orders
+    counts['order_items'] = item_id
+    if db.engine.dialect.name == 'postgresql':
+        # Explicit ids leave the serial sequences behind
+        for table in (User, Category, Product, ProductImage, Order, OrderItem):
+            name = table.__tablename__
+            db.session.execute(db.text(
+                f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), COALESCE((SELECT MAX(id) FROM {name}), 1))"
+            ))
+    db.session.commit()
+
+    # Read models maintained by ORM events miss bulk inserts
+    from summaries import rebuild
+    from search import search_index
+    rebuild(db.session.connection())
+    db.session.commit()
+    search_index.rebuild()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--images', type=int, default=2, help='images per product')
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url (or DATABASE_URL) is required; the database is dropped and recreated')
+
+    os.environ['DATABASE_URL'] = args.database_url
+    from app import app, db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        start = time.perf_counter()
+        counts = generate_dataset(args.users, args.categories, args.products, args.images, args.orders, seed=args.seed)
+        elapsed = time.perf_counter() - start
+    print(', '.join(f'{count} {table}' for table, count in counts.items()))
+    print(f'Generated in {elapsed:.1f}s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Benchmark facet counts: repeated filtered COUNT queries against the snapshot.
+
+Builds a throwaway SQLite database with generated products and computes
+the sidebar facets (category counts, in-stock and featured counts and a
+price histogram) for a few filter sets, once with the SQL a client would
+otherwise trigger and once from the NumPy snapshot.
+
+Usage: python -m benchmarks.facets_benchmark [--products 100000] [--repeat 20]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.search_benchmark import generate
+
+FILTER_SETS = [
+    {},
+    {'category': '3'},
+    {'minPrice': '20', 'maxPrice': '80', 'inStock': 'true'},
+    {'search': 'scrub', 'featured': 'true'},
+]
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def sql_facets(db, Category, Product, search_index, filters, bins=8):
+    """The same counts with one aggregate query per facet"""
+    def base(*skip):
+        query = db.session.query(Product)
+        if filters.get('search') and 'search' not in skip:
+            query = query.filter(search_index.filter_clause(filters['search']))
+        if filters.get('category') and 'category' not in skip:
+            query = query.filter(Product.category_id == int(filters['category']))
+        if 'price' not in skip:
+            if filters.get('minPrice'):
+                query = query.filter(Product.price >= float(filters['minPrice']))
+            if filters.get('maxPrice'):
+                query = query.filter(Product.price <= float(filters['maxPrice']))
+        if filters.get('featured') == 'true' and 'featured' not in skip:
+            query = query.filter(Product.is_featured == True)
+        if filters.get('inStock') == 'true' and 'in_stock' not in skip:
+            query = query.filter(Product.stock > 0)
+        return query
+
+    total = base().count()
+    categories = dict(base('category').with_entities(Product.category_id, db.func.count()).group_by(Product.category_id).all())
+    in_stock = base('in_stock').filter(Product.stock > 0).count()
+    featured = base('featured').filter(Product.is_featured == True).count()
+    low, high = base('price').with_entities(db.func.min(Product.price), db.func.max(Product.price)).one()
+    histogram = []
+    if low is not None:
+        width = (float(high) - float(low)) / bins or 1
+        for i in range(bins):
+            upper = Product.price <= float(high) if i == bins - 1 else Product.price < float(low) + width * (i + 1)
+            histogram.append(base('price').filter(Product.price >= float(low) + width * i, upper).count())
+    return total, categories, in_stock, featured, histogram
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='athar-facets-bench-')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+
+    from app import app, db
+    from models import Category, Product
+    from facets import CatalogSnapshot, FacetIndex, parse_filters
+    from search import search_index
+
+    with app.app_context():
+        db.create_all()
+        generate(db, Category, Product, args.products)
+        search_index.rebuild()
+
+        ms, snapshot = timed(CatalogSnapshot.load, 3)
+        print(f'Products: {args.products}, snapshot build {ms:.1f} ms\n')
+
+        index = FacetIndex()
+        header = f'{"filters":<48}{"SQL ms":>10}{"snapshot ms":>13}{"total":>8}'
+        print(header)
+        print('-' * len(header))
+        for raw in FILTER_SETS:
+            filters = parse_filters(raw)
+            sql_ms, sql = timed(lambda: sql_facets(db, Category, Product, search_index, raw), max(1, args.repeat // 4))
+            np_ms, facets = timed(lambda: index.facets(filters), args.repeat)
+            assert facets['total'] == sql[0], (facets['total'], sql[0])
+            label = '&'.join(f'{k}={v}' for k, v in raw.items()) or '(none)'
+            print(f'{label:<48}{sql_ms:>10.1f}{np_ms:>13.2f}{facets["total"]:>8}')
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,371 @@
+"""Load test the API through realistic scenarios and keep the results.
+
+Scenarios (each operation is one user action):
+
+- browse: a page of the card listing, with a random sort and category
+- search: a full-text search page
+- detail: a random product's detail document
+- checkout: add a checkout SKU to the cart, quote the cart, order with the quote
+- admin_orders: a page of the admin order listing
+
+Every scenario runs `--requests` operations from `--concurrency` worker
+threads, each with its own account and a seeded random generator, so runs
+are repeatable. Latency percentiles (p50/p95/p99) and throughput are
+printed and written as JSON to `--output`, and `--compare` reports the
+change against an earlier result file, exiting non-zero when a scenario
+regressed by more than `--threshold`.
+
+Transports:
+
+- inprocess: the Flask test client, no network (measures the app alone)
+- server: the app behind werkzeug's threaded WSGI server on a local port
+- --url: an already running server (gunicorn etc.) whose database was
+  filled with `python -m benchmarks.datagen` using the same sizes and seed
+
+Usage: python -m benchmarks.load_test [--transport inprocess|server] [--url http://127.0.0.1:8000]
+           [--products 10000] [--requests 500] [--concurrency 8] [--scenarios browse,search]
+           [--output benchmarks/results] [--compare benchmarks/results/<file>.json]
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote_plus, urlsplit
+
+from benchmarks.datagen import PASSWORD, is_checkout_product, user_email
+from benchmarks.search_benchmark import QUERIES
+
+SCENARIOS = ['browse', 'search', 'detail', 'checkout', 'admin_orders']
+SORTS = ['newest', 'price_asc', 'price_desc']
+SHIPPING = {'name': 'Bench', 'phone': '000', 'city': 'Beirut', 'street': 'Main'}
+
+
+class RequestFailed(Exception):
+    pass
+
+
+# ---------- Transports ----------
+
+class InProcessSession:
+    """One worker's view of the app through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+        self.headers = {}
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body, headers=self.headers)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+
+
+class HTTPSession:
+    """One worker's keep-alive connection to a running server"""
+
+    def __init__(self, base_url):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.connection = None
+        self.headers = {}
+
+    def request(self, method, path, body=None):
+        headers = dict(self.headers)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+            try:
+                self.connection.request(method, path, body=payload, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.connection.close()
+                    self.connection = None
+                return response.status, data
+            except (http.client.HTTPException, ConnectionError):
+                # The server closed an idle keep-alive connection; reconnect once
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+
+
+def expect(response, status=200):
+    code, data = response
+    if code != status:
+        raise RequestFailed(f'{code}: {data[:200]!r}')
+    return json.loads(data) if data else None
+
+
+def login(session, email):
+    token = expect(session.request('POST', '/api/auth/login', {'email': email, 'password': PASSWORD}))['data']['token']
+    session.headers = {'Authorization': f'Bearer {token}'}
+
+
+# ---------- Scenarios ----------
+
+class Scenarios:
+    def __init__(self, products, categories):
+        self.products = products
+        self.categories = categories
+        self.checkout_products = [i for i in range(1, products + 1) if is_checkout_product(i)]
+
+    def browse(self, session, rng):
+        path = f'/api/products?view=card&limit=24&sort={rng.choice(SORTS)}'
+        if rng.random() < 0.5:
+            path += f'&category={rng.randint(1, self.categories)}'
+        expect(session.request('GET', path))
+
+    def search(self, session, rng):
+        query = quote_plus(rng.choice(QUERIES))
+        expect(session.request('GET', f'/api/products?search={query}&view=card&limit=24'))
+
+    def detail(self, session, rng):
+        expect(session.request('GET', f'/api/products/{rng.randint(1, self.products)}'))
+
+    def checkout(self, session, rng):
+        product_id = rng.choice(self.checkout_products)
+        expect(session.request('POST', '/api/cart/items', {'product_id': product_id, 'quantity': 1}), 201)
+        quote = expect(session.request('POST', '/api/cart/quote'))['data']
+        expect(session.request('POST', '/api/orders', {'quote_token': quote['token'], 'shipping': SHIPPING}), 201)
+
+    def admin_orders(self, session, rng):
+        path = '/api/orders?limit=50'
+        if rng.random() < 0.3:
+            path += '&status=' + rng.choice(['pending', 'paid', 'shipped', 'delivered'])
+        expect(session.request('GET', path))
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = (len(ordered) - 1) * p / 100
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def run_scenario(name, operation, sessions, requests, warmup, seed):
+    """Run `requests` operations spread over the sessions; returns the summary"""
+    concurrency = len(sessions)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(index):
+        session = sessions[index]
+        rng = random.Random(f'{seed}-{name}-{index}')
+        share = requests // concurrency + (1 if index < requests % concurrency else 0)
+        for _ in range(warmup // concurrency):
+            try:
+                operation(session, rng)
+            except Exception:
+                pass
+        local, failures = [], []
+        barrier.wait()
+        for _ in range(share):
+            start = time.perf_counter()
+            try:
+                operation(session, rng)
+                local.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                failures.append(str(e))
+        with lock:
+            latencies.extend(local)
+            errors.extend(failures)
+
+    barrier = threading.Barrier(concurrency + 1)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(worker, i) for i in range(concurrency)]
+        barrier.wait()
+        start = time.perf_counter()
+        for future in futures:
+            future.result()
+        elapsed = time.perf_counter() - start
+
+    return {
+        'operations': len(latencies) + len(errors),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:3],
+        'throughput': round((len(latencies) + len(errors)) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(statistics.fmean(latencies), 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 2) if latencies else None,
+        'max_ms': round(max(latencies), 2) if latencies else None,
+    }
+
+
+def run_scenarios(make_session, runner, scenarios, requests, warmup, concurrency, seed):
+    """Run each scenario with fresh, logged-in sessions; returns {scenario: summary}"""
+    results = {}
+    for name in scenarios:
+        sessions = [make_session() for _ in range(concurrency)]
+        for index, session in enumerate(sessions):
+            login(session, 'bench-admin@athar.com' if name == 'admin_orders' else user_email(index + 1))
+        results[name] = run_scenario(name, getattr(runner, name), sessions, requests, warmup, seed)
+    return results
+
+
+# ---------- Reporting ----------
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_results(results):
+    header = f'{"scenario":<14}{"ops":>7}{"errors":>8}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"max ms":>9}'
+    print(header)
+    print('-' * len(header))
+    for name, r in results['scenarios'].items():
+        cells = [r[k] if r[k] is not None else '-' for k in ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+        print(f'{name:<14}{r["operations"]:>7}{r["errors"]:>8}' + ''.join(f'{c:>9}' for c in cells))
+        for sample in r['error_samples']:
+            print(f'    error: {sample}')
+
+
+def compare(results, baseline, threshold):
+    """Print the change against `baseline`; returns the names of regressed scenarios"""
+    print(f'\nCompared with {baseline.get("label") or baseline.get("created_at")} (commit {baseline.get("commit")}):')
+    for key in ('transport', 'concurrency', 'dataset'):
+        if baseline.get(key) != results[key]:
+            print(f'  note: {key} differs ({baseline.get(key)} vs {results[key]}), the numbers are not directly comparable')
+    regressed = []
+    for name, r in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before or not before.get('p95_ms') or not r.get('p95_ms'):
+            continue
+        p95 = r['p95_ms'] / before['p95_ms'] - 1
+        throughput = r['throughput'] / before['throughput'] - 1 if before.get('throughput') else 0
+        flag = ''
+        if p95 > threshold or throughput < -threshold:
+            flag = '  REGRESSION'
+            regressed.append(name)
+        print(f'  {name:<14} p95 {before["p95_ms"]:>8} -> {r["p95_ms"]:>8} ms ({p95:+.0%}), '
+              f'throughput {before["throughput"]:>7} -> {r["throughput"]:>7} req/s ({throughput:+.0%}){flag}')
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--transport', choices=['inprocess', 'server'], default='inprocess')
+    parser.add_argument('--url', help='benchmark an already running server instead')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=500, help='operations per scenario')
+    parser.add_argument('--warmup', type=int, default=50, help='untimed operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--label', help='name stored with the results')
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results'),
+                        help='directory (or .json file) for the results; empty to skip')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative p95/throughput change counted as a regression')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+    if args.concurrency > args.users:
+        parser.error('--concurrency cannot exceed --users (each worker uses its own account)')
+
+    workdir = None
+    server = None
+    if args.url:
+        transport = args.url
+        make_session = lambda: HTTPSession(args.url)
+    else:
+        workdir = tempfile.mkdtemp(prefix='athar-load-test-')
+        os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+        os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        os.environ.setdefault('TASK_WORKER_THREADS', '0')
+        from app import app, db
+        from benchmarks.datagen import generate_dataset
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            generate_dataset(args.users, args.categories, args.products, orders=args.orders, seed=args.seed)
+            print(f'Generated the dataset in {time.perf_counter() - start:.1f}s')
+        transport = args.transport
+        if args.transport == 'server':
+            from werkzeug.serving import make_server
+            server = make_server('127.0.0.1', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f'http://127.0.0.1:{server.server_port}'
+            make_session = lambda: HTTPSession(base_url)
+        else:
+            make_session = lambda: InProcessSession(app)
+
+    print(f'{args.products} products, {args.orders} orders; {args.requests} operations per scenario, '
+          f'concurrency {args.concurrency}, transport {transport}\n')
+
+    runner = Scenarios(args.products, args.categories)
+    results = {
+        'label': args.label,
+        'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'transport': transport,
+        'concurrency': args.concurrency,
+        'requests': args.requests,
+        'dataset': {'users': args.users, 'categories': args.categories, 'products': args.products,
+                    'orders': args.orders, 'seed': args.seed},
+        'scenarios': {}
+    }
+    try:
+        results['scenarios'] = run_scenarios(
+            make_session, runner, scenarios, args.requests, args.warmup, args.concurrency, args.seed
+        )
+    finally:
+        if server is not None:
+            server.shutdown()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_results(results)
+
+    if args.output:
+        path = args.output
+        if not path.endswith('.json'):
+            os.makedirs(path, exist_ok=True)
+            stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+            path = os.path.join(path, f'{stamp}-{args.label or ("url" if args.url else transport)}.json')
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {path}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(results, json.load(f), args.threshold)
+        if regressed:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+"""Benchmark product search: the old ILIKE scan against the search index.
+
+Builds a throwaway SQLite database with generated bilingual products and
+times the same queries through each path.
+
+Usage: python -m benchmarks.search_benchmark [--products 100000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+EN_WORDS = ['hydrating', 'creamy', 'gentle', 'luxury', 'body', 'scrub', 'oil', 'splash', 'rose',
+            'vanilla', 'citrus', 'fresh', 'shea', 'butter', 'coconut', 'almond', 'argan', 'musk',
+            'amber', 'oud', 'lotion', 'serum', 'mist', 'glow', 'silky', 'soft', 'natural', 'skin']
+AR_WORDS = ['مقشر', 'الجسم', 'المرطب', 'الكريمي', 'اللطيف', 'زيت', 'رشاش', 'منعش', 'ورد',
+            'فانيليا', 'حمضيات', 'زبدة', 'الشيا', 'جوز', 'الهند', 'اللوز', 'الأرغان', 'مسك',
+            'عنبر', 'عود', 'لوشن', 'سيروم', 'بشرة', 'ناعمة', 'طبيعي', 'فاخر', 'إشراقة', 'نضارة']
+QUERIES = ['scrub', 'body oil', 'rose glow', 'argan', 'مقشر', 'المقشر الجسم', 'اشراقه', 'zzzz']
+
+
+def sentence(rng, words, n):
+    return ' '.join(rng.choice(words) for _ in range(n))
+
+
+def generate(db, Category, Product, count, seed=42):
+    rng = random.Random(seed)
+    db.session.execute(db.insert(Category), [
+        {'id': i, 'name_en': f'Category {i}', 'name_ar': f'فئة {i}', 'slug': f'category-{i}'}
+        for i in range(1, 21)
+    ])
+    now = datetime.utcnow()
+    batch = []
+    for i in range(1, count + 1):
+        batch.append({
+            'id': i,
+            'name_en': sentence(rng, EN_WORDS, 3).title(),
+            'name_ar': sentence(rng, AR_WORDS, 3),
+            'description_en': sentence(rng, EN_WORDS, 25),
+            'description_ar': sentence(rng, AR_WORDS, 25),
+            'price': rng.randint(500, 20000) / 100,
+            'stock': rng.randint(0, 200),
+            'sku': f'BENCH-{i:07d}',
+            'category_id': rng.randint(1, 20),
+            'is_featured': rng.random() < 0.05,
+            'created_at': now - timedelta(minutes=i)
+        })
+        if len(batch) == 5000:
+            db.session.execute(db.insert(Product), batch)
+            batch = []
+    if batch:
+        db.session.execute(db.insert(Product), batch)
+    db.session.commit()
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--products', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='athar-search-bench-')
+    os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(workdir, "bench.db")}'
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['CATALOG_CACHE_ENABLED'] = 'false'
+
+    from app import app, db
+    from models import Category, Product
+    from search import FTS5SearchIndex, MemorySearchIndex, fts5_available
+
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        generate(db, Category, Product, args.products)
+        print(f'Generated {args.products} products in {time.perf_counter() - start:.1f}s')
+
+        indexes = [MemorySearchIndex()]
+        if fts5_available():
+            indexes.append(FTS5SearchIndex())
+        for index in indexes:
+            start = time.perf_counter()
+            index.rebuild()
+            print(f'Built {index.name} index in {time.perf_counter() - start:.1f}s')
+
+        def ilike(q):
+            return [row.id for row in db.session.query(Product.id).filter(db.or_(
+                Product.name_en.ilike(f'%{q}%'),
+                Product.name_ar.ilike(f'%{q}%'),
+                Product.description_en.ilike(f'%{q}%'),
+                Product.description_ar.ilike(f'%{q}%')
+            ))]
+
+        def ranked(index, q):
+            scores = index.search(q)
+            return sorted(scores, key=scores.get, reverse=True)
+
+        header = f'{"query":<16}{"ilike ms":>10}{"hits":>8}'
+        for index in indexes:
+            header += f'{index.name + " ms":>12}{"hits":>8}'
+        print()
+        print(header)
+        print('-' * len(header))
+        for q in QUERIES:
+            ms, ids = timed(lambda: ilike(q), args.repeat)
+            line = f'{q:<16}{ms:>10.2f}{len(ids):>8}'
+            for index in indexes:
+                ms, ids = timed(lambda: ranked(index, q), args.repeat)
+                line += f'{ms:>12.2f}{len(ids):>8}'
+            print(line)
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""Micro-benchmark for product list serialization.
+
+Compares the previous path (per-field float()/isoformat() conversion and
+Flask's default `jsonify` encoder) against the shared response layer, for
+the full document and the card projection. Products are built in memory,
+so no database is involved.
+
+Usage: python -m benchmarks.serialization_benchmark [--sizes 1000,10000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+
+def build_products(Category, Product, ProductImage, count, seed=7):
+    rng = random.Random(seed)
+    categories = [Category(id=i, name_en=f'Category {i}', name_ar=f'فئة {i}', slug=f'category-{i}')
+                  for i in range(1, 11)]
+    now = datetime.utcnow()
+    products = []
+    for i in range(1, count + 1):
+        product = Product(
+            id=i,
+            name_en=f'Hydrating Body Scrub {i}',
+            name_ar=f'مقشر الجسم المرطب {i}',
+            description_en='A luxurious body scrub enriched with natural ingredients. ' * 3,
+            description_ar='مقشر جسم فاخر غني بالمكونات الطبيعية لتقشير وترطيب بشرتك. ' * 3,
+            price=Decimal(rng.randint(500, 20000)) / 100,
+            stock=rng.randint(0, 200),
+            sku=f'BENCH-{i:07d}',
+            ingredients_en='Sugar, Coconut Oil, Shea Butter, Vitamin E',
+            ingredients_ar='سكر، زيت جوز الهند، زبدة الشيا، فيتامين E',
+            usage_en='Apply to wet skin in circular motions. Rinse thoroughly.',
+            usage_ar='ضع على البشرة الرطبة بحركات دائرية. اشطف جيداً.',
+            is_featured=rng.random() < 0.1,
+            created_at=now - timedelta(minutes=i)
+        )
+        product.category = categories[i % len(categories)]
+        product.category_id = product.category.id
+        product.images = [ProductImage(id=i * 10 + n, product_id=i, url=f'/api/uploads/{i}_{n}.jpg', alt_text='')
+                          for n in range(2)]
+        products.append(product)
+    return products
+
+
+def legacy_product_dict(product, lang='en'):
+    """Product.to_dict as it was before the shared response layer"""
+    category = product.category
+    return {
+        'id': product.id,
+        'name': product.name_en if lang == 'en' else product.name_ar,
+        'name_en': product.name_en,
+        'name_ar': product.name_ar,
+        'description': product.description_en if lang == 'en' else product.description_ar,
+        'description_en': product.description_en,
+        'description_ar': product.description_ar,
+        'price': float(product.price),
+        'stock': product.stock,
+        'sku': product.sku,
+        'category_id': product.category_id,
+        'category': category.to_dict(lang) if category else None,
+        'ingredients': product.ingredients_en if lang == 'en' else product.ingredients_ar,
+        'ingredients_en': product.ingredients_en,
+        'ingredients_ar': product.ingredients_ar,
+        'usage': product.usage_en if lang == 'en' else product.usage_ar,
+        'usage_en': product.usage_en,
+        'usage_ar': product.usage_ar,
+        'is_featured': product.is_featured,
+        'images': [img.to_dict() for img in product.images],
+        'created_at': product.created_at.isoformat() if product.created_at else None
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(fn())
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default='1000,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='athar-serialization-bench-')
+    os.environ.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(workdir, "bench.db")}')
+    os.environ.setdefault('UPLOAD_FOLDER', os.path.join(workdir, 'uploads'))
+
+    from flask.json.provider import DefaultJSONProvider
+    from app import app
+    from models import Category, Product, ProductImage
+    from responses import ENCODER, dumps_bytes
+
+    legacy_provider = DefaultJSONProvider(app)
+    card = Product.resolve_fields(view='card')
+    print(f'Encoder: {ENCODER}\n')
+
+    header = f'{"products":>9}  {"path":<28}{"median ms":>10}{"bytes":>12}'
+    print(header)
+    print('-' * len(header))
+    with app.app_context():
+        for size in [int(n) for n in args.sizes.split(',')]:
+            products = build_products(Category, Product, ProductImage, size)
+            paths = [
+                ('legacy to_dict + jsonify', lambda: legacy_provider.dumps(
+                    {'success': True, 'data': [legacy_product_dict(p) for p in products]}).encode('utf-8')),
+                ('to_dict + fast encoder', lambda: dumps_bytes(
+                    {'success': True, 'data': [p.to_dict() for p in products]})),
+                ('card view + fast encoder', lambda: dumps_bytes(
+                    {'success': True, 'data': [p.to_dict('en', card) for p in products]})),
+            ]
+            for name, fn in paths:
+                ms, nbytes = timed(fn, args.repeat)
+                print(f'{size:>9}  {name:<28}{ms:>10.1f}{nbytes:>12}')
+
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
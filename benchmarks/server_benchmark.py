@@ -0,0 +1,195 @@
+"""Compare the development server with gunicorn under the same load.
+
+Generates one benchmark database (benchmarks/datagen.py), then starts each
+server as a subprocess on a local port against that database and runs the
+load test scenarios (benchmarks/load_test.py) over keep-alive HTTP:
+
+- werkzeug: `flask run` without the debugger or reloader; one process,
+  one thread per connection. `run.py` adds the debugger and the reloader on
+  top, so it is slower still.
+- gunicorn: `gunicorn app:app` with gunicorn.conf.py, sized by
+  `--workers`/`--threads` (WEB_CONCURRENCY/GUNICORN_THREADS). Skipped with a
+  note when gunicorn is not installed.
+
+Both servers see the same data and the same seeded request mix. The default
+scenarios are read-only: SQLite serializes writers across processes, so
+checkout numbers on SQLite say more about the database than the server.
+
+Usage: python -m benchmarks.server_benchmark [--products 5000] [--requests 1000] [--concurrency 16]
+           [--workers 4] [--threads 4] [--scenarios browse,search,detail,admin_orders]
+           [--output benchmarks/results]
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.load_test import (
+    SCENARIOS, HTTPSession, Scenarios, git_commit, print_results, run_scenarios
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = ['werkzeug', 'gunicorn']
+STARTUP_TIMEOUT = 60
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def server_command(name, port):
+    if name == 'werkzeug':
+        return [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--port', str(port),
+                '--no-reload', '--no-debugger', '--with-threads']
+    return [sys.executable, '-m', 'gunicorn', 'app:app', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+            '--bind', f'127.0.0.1:{port}']
+
+
+def wait_until_ready(process, port, log_path):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/health')
+            if connection.getresponse().status == 200:
+                connection.close()
+                return
+            connection.close()
+        except OSError:
+            pass
+        time.sleep(0.2)
+    with open(log_path) as f:
+        tail = f.read()[-2000:]
+    raise RuntimeError(f'server did not start on port {port}:\n{tail}')
+
+
+def stop(process):
+    # SIGTERM is a graceful shutdown for both servers
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--servers', default=','.join(SERVERS))
+    parser.add_argument('--scenarios', default='browse,search,detail,admin_orders')
+    parser.add_argument('--requests', type=int, default=1000, help='operations per scenario')
+    parser.add_argument('--warmup', type=int, default=50, help='untimed operations per scenario')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 4), help='gunicorn processes')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per process')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='', help='directory for one load_test result file per server')
+    args = parser.parse_args()
+
+    servers = [s for s in args.servers.split(',') if s]
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = (set(servers) - set(SERVERS)) | (set(scenarios) - set(SCENARIOS))
+    if unknown:
+        parser.error(f'unknown servers or scenarios: {", ".join(sorted(unknown))}')
+    if args.concurrency > args.users:
+        parser.error('--concurrency cannot exceed --users (each worker uses its own account)')
+    if 'gunicorn' in servers and importlib.util.find_spec('gunicorn') is None:
+        print('gunicorn is not installed (pip install -r requirements.txt); benchmarking werkzeug only\n')
+        servers.remove('gunicorn')
+
+    workdir = tempfile.mkdtemp(prefix='athar-server-benchmark-')
+    env = dict(
+        os.environ,
+        DATABASE_URL=f'sqlite:///{os.path.join(workdir, "bench.db")}',
+        UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+        TASK_WORKER_THREADS='0',
+        WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        GUNICORN_ACCESS_LOG='',
+        GUNICORN_LOG_LEVEL='warning',
+    )
+    env.pop('FLASK_DEBUG', None)
+
+    runner = Scenarios(args.products, args.categories)
+    dataset = {'users': args.users, 'categories': args.categories, 'products': args.products,
+               'orders': args.orders, 'seed': args.seed}
+    all_results = {}
+    try:
+        subprocess.run([sys.executable, '-m', 'benchmarks.datagen', '--users', str(args.users),
+                        '--categories', str(args.categories), '--products', str(args.products),
+                        '--orders', str(args.orders), '--seed', str(args.seed)],
+                       env=env, cwd=ROOT, check=True)
+        print(f'{args.requests} operations per scenario, concurrency {args.concurrency}'
+              + (f'; gunicorn {args.workers} workers x {args.threads} threads' if 'gunicorn' in servers else '') + '\n')
+
+        for name in servers:
+            port = free_port()
+            log_path = os.path.join(workdir, f'{name}.log')
+            with open(log_path, 'w') as log:
+                process = subprocess.Popen(server_command(name, port), env=env, cwd=ROOT,
+                                           stdout=log, stderr=subprocess.STDOUT)
+            try:
+                wait_until_ready(process, port, log_path)
+                base_url = f'http://127.0.0.1:{port}'
+                results = {
+                    'label': name,
+                    'created_at': datetime.utcnow().isoformat(timespec='seconds'),
+                    'commit': git_commit(),
+                    'python': platform.python_version(),
+                    'transport': name,
+                    'concurrency': args.concurrency,
+                    'requests': args.requests,
+                    'dataset': dataset,
+                    'scenarios': run_scenarios(lambda: HTTPSession(base_url), runner, scenarios,
+                                               args.requests, args.warmup, args.concurrency, args.seed)
+                }
+            finally:
+                stop(process)
+            print(f'== {name} ==')
+            print_results(results)
+            print()
+            all_results[name] = results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if len(all_results) == 2:
+        base, other = all_results['werkzeug']['scenarios'], all_results['gunicorn']['scenarios']
+        print('gunicorn vs werkzeug:')
+        for name in scenarios:
+            before, after = base[name], other[name]
+            if not before['throughput'] or not before['p95_ms'] or not after['p95_ms']:
+                continue
+            print(f'  {name:<14} throughput {before["throughput"]:>8} -> {after["throughput"]:>8} req/s '
+                  f'({after["throughput"] / before["throughput"]:.1f}x), '
+                  f'p95 {before["p95_ms"]:>8} -> {after["p95_ms"]:>8} ms')
+
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S')
+        for name, results in all_results.items():
+            path = os.path.join(args.output, f'{stamp}-{name}.json')
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f'Results written to {path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+"""Concurrency check for stock reservation.
+
+Fires many parallel checkouts at a single hot SKU through the Flask app and
+verifies that stock is never oversold: the number of successful orders must
+equal the stock that was taken, and stock must never go negative.
+tests/test_stock_concurrency.py runs a smaller version in the test suite.
+
+Usage: python -m benchmarks.stock_concurrency [--orders 300] [--stock 50] [--threads 32]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--orders', type=int, default=300)
+    parser.add_argument('--stock', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--quantity', type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='athar-stock-bench-')
+    os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', f'sqlite:///{os.path.join(workdir, "bench.db")}')
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+
+    from app import app, db
+    from models import User, Category, Product, Order
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        user = User(name='Bench Customer', email='bench@athar.com', role='customer')
+        user.set_password('bench123')
+        category = Category(name_en='Bench', name_ar='Bench', slug='bench')
+        db.session.add_all([user, category])
+        db.session.flush()
+        product = Product(name_en='Hot SKU', name_ar='Hot SKU', price=10, stock=args.stock,
+                          sku='HOT-001', category_id=category.id)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    client = app.test_client()
+    token = client.post('/api/auth/login', json={'email': 'bench@athar.com', 'password': 'bench123'}).get_json()['data']['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    payload = {
+        'items': [{'product_id': product_id, 'quantity': args.quantity}],
+        'shipping': {'name': 'Bench', 'phone': '000', 'city': 'Beirut', 'street': 'Main'}
+    }
+
+    def checkout(_):
+        return app.test_client().post('/api/orders', json=payload, headers=headers).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        statuses = Counter(pool.map(checkout, range(args.orders)))
+    elapsed = time.perf_counter() - start
+
+    with app.app_context():
+        final_stock = db.session.get(Product, product_id).stock
+        orders = Order.query.count()
+
+    sold = args.stock - final_stock
+    print(f'{args.orders} checkouts in {elapsed:.2f}s with {args.threads} threads')
+    print(f'Responses: {dict(statuses)}')
+    print(f'Orders created: {orders}, units sold: {sold}, stock left: {final_stock}')
+
+    ok = final_stock >= 0 and sold == orders * args.quantity and statuses.get(201, 0) == orders
+    print('OK: no overselling' if ok else 'FAIL: stock and orders disagree')
+    shutil.rmtree(workdir, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,438 @@
+"""Versioned response cache for catalog reads.
+
+Responses are stored in a process-local LRU/TTL tier and, optionally, in a
+shared tier (e.g. Redis) so that every worker benefits from a fill. Every
+key embeds the current catalog version; write endpoints call
+`catalog_cache.bump_version()` after committing, which makes every older
+entry unreachable without having to enumerate and delete it.
+
+The version lives in the single `catalog_version` row on the primary
+database, so a bump by one worker (or the task runner) invalidates the
+entries of every worker at once. Each request reads it once, with a primary
+key lookup, and reuses it for all of its cache lookups. When the row cannot
+be read the cache is bypassed rather than risk serving stale entries.
+
+Cached entries also carry a strong ETag (a hash of the body) and the time of
+the catalog change they were built from (kept in the same row as the
+version), so conditional requests can be answered with a 304 straight from
+the cache.
+
+Stock is the exception: every order changes it, and bumping the version
+for each order would empty the cache at checkout rate. Views instead call
+`depends_on_stock()` with the stock levels they render; the entry records
+them, and a hit is only served after one query confirms they are still
+current. An order therefore only invalidates the entries showing the
+products it bought.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import g, has_request_context, request, Response
+from sqlalchemy import insert, select, update
+
+from app import app, db
+from replicas import replica_router, use_primary
+
+# Stock checks for more products than this read the whole products table instead of an IN list
+STOCK_CHECK_MAX_IDS = 500
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache with a per-entry TTL"""
+
+    def __init__(self, maxsize=512, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                self.evictions += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCacheBackend:
+    """Shared cache tier backed by Redis (requires the `redis` package)"""
+
+    def __init__(self, url, prefix='athar:catalog:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, value, ex=ttl)
+
+
+class CacheEntry:
+    """A cached response body with its validators and the stock levels it shows"""
+
+    __slots__ = ('body', 'etag', 'last_modified', 'stock')
+
+    def __init__(self, body, etag=None, last_modified=None, stock=None):
+        self.body = body
+        self.etag = etag or hashlib.sha1(body).hexdigest()
+        self.last_modified = last_modified
+        self.stock = stock or None  # {product_id: stock}
+
+    def pack(self):
+        header = json.dumps({
+            'etag': self.etag,
+            'last_modified': self.last_modified.isoformat() if self.last_modified else None,
+            'stock': list(self.stock.items()) if self.stock else None
+        }).encode('utf-8')
+        return header + b'\n' + self.body
+
+    @classmethod
+    def unpack(cls, packed):
+        header, body = packed.split(b'\n', 1)
+        header = json.loads(header)
+        last_modified = header['last_modified']
+        if last_modified:
+            last_modified = datetime.fromisoformat(last_modified)
+        stock = dict(header['stock']) if header.get('stock') else None
+        return cls(body, header['etag'], last_modified, stock)
+
+
+class CatalogCache:
+    """Two-tier catalog response cache keyed by catalog version.
+
+    Per-product fragments (see `cached_fragments`) get their own in-memory
+    LRU, so a 500-id batch cannot evict every cached response.
+    """
+
+    def __init__(self, maxsize=512, ttl=300, shared=None, enabled=True, fragment_maxsize=5000):
+        self.memory = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.fragments = LRUCache(maxsize=fragment_maxsize, ttl=ttl)
+        self.shared = shared
+        self.ttl = ttl
+        self.enabled = enabled
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self.version_errors = 0
+        self.stock_invalidations = 0
+
+    @classmethod
+    def from_config(cls, config):
+        shared = None
+        if config.get('CATALOG_CACHE_REDIS_URL'):
+            try:
+                shared = RedisCacheBackend(config['CATALOG_CACHE_REDIS_URL'])
+            except ImportError:
+                app.logger.warning('CATALOG_CACHE_REDIS_URL is set but redis is not installed; '
+                                   'using the in-memory catalog cache only')
+        return cls(
+            maxsize=config.get('CATALOG_CACHE_SIZE', 512),
+            ttl=config.get('CATALOG_CACHE_TTL', 300),
+            shared=shared,
+            enabled=config.get('CATALOG_CACHE_ENABLED', True),
+            fragment_maxsize=config.get('CATALOG_FRAGMENT_CACHE_SIZE', 5000)
+        )
+
+    def _state(self):
+        """(version, changed_at) of the catalog, read once per request; (None, None) when unreadable"""
+        if has_request_context() and 'catalog_state' in g:
+            return g.catalog_state
+        from models import CatalogVersion
+        table = CatalogVersion.__table__
+        try:
+            # db.engine is the primary, whatever replica the request reads from
+            with db.engine.connect() as connection:
+                row = connection.execute(
+                    select(table.c.version, table.c.changed_at).where(table.c.id == 1)
+                ).first()
+            state = (row.version, row.changed_at) if row is not None else (0, None)
+        except Exception as e:
+            self.version_errors += 1
+            app.logger.warning(f'Catalog version unavailable, bypassing the catalog cache: {e}')
+            state = (None, None)
+        if has_request_context():
+            g.catalog_state = state
+        return state
+
+    @property
+    def version(self):
+        """Current catalog version, shared by every worker; None when it cannot be read"""
+        return self._state()[0]
+
+    @property
+    def last_modified(self):
+        """When the catalog last changed (the Last-Modified of cached responses); None when unknown"""
+        changed_at = self._state()[1]
+        return changed_at.replace(microsecond=0, tzinfo=timezone.utc) if changed_at else None
+
+    def changed_within(self, seconds):
+        """Whether the catalog changed in the last `seconds` (or when, is unknown)"""
+        changed_at = self._state()[1]
+        return changed_at is None or datetime.utcnow() - changed_at < timedelta(seconds=seconds)
+
+    def bump_version(self):
+        """Invalidate every cached catalog response. Call after a catalog write commits."""
+        from models import CatalogVersion
+        table = CatalogVersion.__table__
+        now = datetime.utcnow()
+        try:
+            with db.engine.begin() as connection:
+                bumped = connection.execute(
+                    update(table).where(table.c.id == 1).values(version=table.c.version + 1, changed_at=now)
+                ).rowcount
+                if not bumped:
+                    # Databases made with create_all() (seed.py) start without the row
+                    connection.execute(insert(table).values(id=1, version=1, changed_at=now))
+                version = connection.execute(select(table.c.version).where(table.c.id == 1)).scalar()
+            state = (version, now)
+        except Exception as e:
+            self.version_errors += 1
+            app.logger.error(f'Failed to bump the catalog version: {e}')
+            state = (None, None)
+        if has_request_context():
+            # The rest of this request reads its own write
+            g.catalog_state = state
+        # Entries from older versions can no longer be hit, free them now
+        self.memory.clear()
+        self.fragments.clear()
+        return state[0]
+
+    def get(self, key, fragment=False):
+        """Return a cached `CacheEntry` or None"""
+        memory = self.fragments if fragment else self.memory
+        entry = memory.get(key)
+        if entry is not None or self.shared is None:
+            return entry
+        try:
+            packed = self.shared.get(key)
+        except Exception:
+            self.shared_errors += 1
+            return None
+        if packed is None:
+            return None
+        entry = CacheEntry.unpack(packed)
+        self.shared_hits += 1
+        memory.set(key, entry)
+        return entry
+
+    def set(self, key, entry, fragment=False):
+        (self.fragments if fragment else self.memory).set(key, entry)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, entry.pack(), self.ttl)
+            except Exception:
+                self.shared_errors += 1
+
+    def stats(self):
+        lookups = self.memory.hits + self.memory.misses
+        return {
+            'enabled': self.enabled,
+            'version': self.version,
+            'entries': len(self.memory),
+            'hits': self.memory.hits,
+            'misses': self.memory.misses,
+            'evictions': self.memory.evictions,
+            'hit_ratio': round(self.memory.hits / lookups, 4) if lookups else 0.0,
+            'shared': self.shared is not None,
+            'shared_hits': self.shared_hits,
+            'shared_errors': self.shared_errors,
+            'version_errors': self.version_errors,
+            'stock_invalidations': self.stock_invalidations,
+            'fragments': {
+                'entries': len(self.fragments),
+                'hits': self.fragments.hits,
+                'misses': self.fragments.misses,
+                'evictions': self.fragments.evictions
+            }
+        }
+
+
+catalog_cache = CatalogCache.from_config(app.config)
+
+
+def _normalize(name, value):
+    value = value.strip()
+    if name == 'search':
+        return value.lower()
+    return value
+
+
+def _conditional_response(entry):
+    """Build the response for a cache entry, answering 304 when the client's validators match"""
+    response = Response(entry.body, status=200, mimetype='application/json')
+    response.set_etag(entry.etag)
+    if entry.last_modified is not None:
+        response.last_modified = entry.last_modified
+    # Let browsers and the CDN keep a copy but revalidate it on every use
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def read_primary_after_change():
+    """Send a cache fill to the primary while replicas may still lag behind the
+    last catalog change, so no stale replica read is cached under the new version"""
+    if replica_router.enabled and catalog_cache.changed_within(replica_router.stale_window):
+        use_primary()
+
+
+def depends_on_stock(stocks):
+    """Record stock levels ({product_id: stock}) shown by the response being built.
+
+    Its cache entries are only served while every one of them is unchanged.
+    """
+    if has_request_context():
+        g.setdefault('catalog_stock', {}).update(stocks)
+
+
+def skip_cache():
+    """Keep the response being built out of the cache, e.g. when it was answered
+    from an in-memory index still catching up with the catalog version"""
+    if has_request_context():
+        g.catalog_skip_cache = True
+
+
+def _current_stock(ids):
+    """{product_id: stock or None} for `ids`, reusing the levels this request already read"""
+    from models import Product
+    current = g.setdefault('catalog_stock_now', {})
+    unknown = [product_id for product_id in ids if product_id not in current]
+    if unknown:
+        query = select(Product.id, Product.stock)
+        # Large entries (the unpaginated listing) read every product rather than a huge IN list
+        if len(unknown) <= STOCK_CHECK_MAX_IDS:
+            query = query.where(Product.id.in_(unknown))
+        current.update(db.session.execute(query).all())
+        for product_id in unknown:
+            current.setdefault(product_id, None)
+    return current
+
+
+def _with_current_stock(entries):
+    """The entries of {key: CacheEntry} whose stock levels are all still current, checked with one query"""
+    ids = {product_id for entry in entries.values() if entry.stock for product_id in entry.stock}
+    if not ids:
+        return entries
+    current = _current_stock(ids)
+    fresh = {
+        key: entry for key, entry in entries.items()
+        if not entry.stock or all(current[product_id] == stock for product_id, stock in entry.stock.items())
+    }
+    catalog_cache.stock_invalidations += len(entries) - len(fresh)
+    return fresh
+
+
+def cached_fragments(name, ids, params, load):
+    """Encoded JSON per id, cached individually so that views returning one
+    item and views returning many share entries.
+
+    `load(missing_ids)` must return {id: bytes} for the ids it found; ids it
+    does not return are reported missing by leaving them out of the result.
+    Ids are product ids: the stock `load` records with `depends_on_stock()`
+    for an id is kept with that id's fragment.
+    """
+    version = catalog_cache.version if catalog_cache.enabled else None
+    if version is None:
+        return load(list(ids))
+    prefix = f'{name}|{version}|{params}|'
+    cached = {}
+    for item_id in ids:
+        entry = catalog_cache.get(prefix + str(item_id), fragment=True)
+        if entry is not None:
+            cached[item_id] = entry
+    cached = _with_current_stock(cached)
+    found = {}
+    for item_id, entry in cached.items():
+        found[item_id] = entry.body
+        if entry.stock:
+            depends_on_stock(entry.stock)
+    missing = [item_id for item_id in ids if item_id not in cached]
+    if missing:
+        read_primary_after_change()
+        loaded = load(missing)
+        stocks = g.get('catalog_stock') or {}
+        for item_id, body in loaded.items():
+            stock = {item_id: stocks[item_id]} if item_id in stocks else None
+            catalog_cache.set(prefix + str(item_id), CacheEntry(body, stock=stock), fragment=True)
+        found.update(loaded)
+    return found
+
+
+def cached_catalog_view(name, args=(), defaults=None):
+    """Cache successful JSON responses of a catalog GET view.
+
+    The key is built from the view name, its URL parameters and the
+    normalized values of the query args listed in `args`, so that e.g.
+    `?lang=en` and no `lang` at all share one entry. Responses carry an ETag
+    and, unless they show stock, a Last-Modified; matching If-None-Match /
+    If-Modified-Since requests that hit the cache get a 304 without running
+    the view.
+    """
+    defaults = defaults or {}
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*view_args, **view_kwargs):
+            key = None
+            version = catalog_cache.version if catalog_cache.enabled else None
+            last_modified = catalog_cache.last_modified if version is not None else None
+            if version is not None:
+                parts = [name, str(version)]
+                parts += [f'{k}={v}' for k, v in sorted(view_kwargs.items())]
+                for arg in args:
+                    value = _normalize(arg, request.args.get(arg, defaults.get(arg, '')))
+                    parts.append(f'{arg}={value}')
+                key = '|'.join(parts)
+
+                entry = catalog_cache.get(key)
+                if entry is not None and _with_current_stock({key: entry}):
+                    return _conditional_response(entry)
+
+            read_primary_after_change()
+            g.catalog_stock = {}
+            response = app.make_response(view(*view_args, **view_kwargs))
+            if response.status_code != 200:
+                return response
+
+            stock = g.pop('catalog_stock', None)
+            # Stock changes are not dated, so responses showing stock are validated by ETag only
+            entry = CacheEntry(response.get_data(), last_modified=None if stock else last_modified, stock=stock)
+            if key is not None and not g.pop('catalog_skip_cache', False):
+                catalog_cache.set(key, entry)
+            return _conditional_response(entry)
+        return wrapper
+    return decorator
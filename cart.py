@@ -0,0 +1,232 @@
+"""Server-side carts and checkout quotes.
+
+A customer's cart is a set of `cart_items` rows. A quote prices the whole
+cart and checks its stock with a single query (cart lines outer-joined to
+their products), so totals and stock problems show up before checkout
+rather than at `create_order`.
+
+A quote whose every line is available comes with a signed token holding the
+priced lines. The token pins those prices for QUOTE_TTL seconds: an order
+placed with it takes its prices from the token instead of re-reading every
+product, and only the conditional stock UPDATEs touch the products table
+(see `inventory.reserve_quoted_stock`). Tokens are stateless, so any worker
+can verify a quote issued by another. Each token carries a random nonce
+that the order records in `used_quotes` in its own transaction
+(`redeem_quote`); the nonce is the table's primary key, so a token places
+at most one order even if the same lines are added to the cart again. The
+order also deletes the quoted cart lines, and refuses a token whose lines
+are gone or changed.
+"""
+import secrets
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+from sqlalchemy import and_, delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import app, db
+from models import CartItem, Product, UsedQuote
+
+# Generous bounds that keep a cart (and its token) small
+MAX_CART_LINES = 100
+MAX_LINE_QUANTITY = 999
+
+
+class CartError(Exception):
+    def __init__(self, message, errors=None, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors or []
+        self.status_code = status_code
+
+
+class QuoteError(Exception):
+    """The quote token is invalid, expired, or does not match the order"""
+
+
+def parse_quantity(value, allow_zero=False):
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        raise CartError('Invalid quantity', ['quantity must be an integer'])
+    if quantity < 0 or (quantity == 0 and not allow_zero):
+        raise CartError('Invalid quantity', ['quantity must be greater than 0'])
+    if quantity > MAX_LINE_QUANTITY:
+        raise CartError('Invalid quantity', [f'quantity must be at most {MAX_LINE_QUANTITY}'])
+    return quantity
+
+
+def _check_product(product_id):
+    if db.session.get(Product, product_id) is None:
+        raise CartError('Product not found', status_code=404)
+
+
+def _check_size(user_id, adding=1):
+    lines = CartItem.query.filter_by(user_id=user_id).count()
+    if lines + adding > MAX_CART_LINES:
+        raise CartError('Cart is full', [f'A cart can hold at most {MAX_CART_LINES} products'])
+
+
+def add_item(user_id, product_id, quantity):
+    """Add `quantity` of a product, merging with an existing line"""
+    _check_product(product_id)
+    item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
+    if item is None:
+        _check_size(user_id)
+        try:
+            with db.session.begin_nested():
+                db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=quantity))
+            return
+        except IntegrityError:
+            # A concurrent request added the line first
+            item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).one()
+    item.quantity = min(item.quantity + quantity, MAX_LINE_QUANTITY)
+
+
+def set_quantity(user_id, product_id, quantity):
+    """Set a line's quantity; 0 removes it. Returns False if the product is not in the cart."""
+    if quantity == 0:
+        return remove_item(user_id, product_id)
+    result = db.session.execute(
+        update(CartItem)
+        .where(CartItem.user_id == user_id, CartItem.product_id == product_id)
+        .values(quantity=quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def remove_item(user_id, product_id):
+    result = db.session.execute(
+        delete(CartItem).where(CartItem.user_id == user_id, CartItem.product_id == product_id)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def replace_items(user_id, quantities):
+    """Replace the whole cart with {product_id: quantity} (e.g. a guest cart after login)"""
+    if len(quantities) > MAX_CART_LINES:
+        raise CartError('Cart is full', [f'A cart can hold at most {MAX_CART_LINES} products'])
+    known = {row.id for row in db.session.execute(select(Product.id).where(Product.id.in_(quantities)))}
+    unknown = sorted(set(quantities) - known)
+    if unknown:
+        raise CartError('Product not found', [f'Product {product_id} not found' for product_id in unknown], 404)
+    clear(user_id)
+    db.session.add_all([
+        CartItem(user_id=user_id, product_id=product_id, quantity=quantity)
+        for product_id, quantity in quantities.items()
+    ])
+
+
+def clear(user_id, product_ids=None):
+    statement = delete(CartItem).where(CartItem.user_id == user_id)
+    if product_ids is not None:
+        statement = statement.where(CartItem.product_id.in_(product_ids))
+    db.session.execute(statement.execution_options(synchronize_session=False))
+
+
+def price_cart(user_id, lang='en'):
+    """Price every line of the cart and check its stock in one query"""
+    rows = db.session.execute(
+        select(CartItem.product_id, CartItem.quantity, Product.id.label('found'),
+               Product.name_en, Product.name_ar, Product.price, Product.stock)
+        .outerjoin(Product, Product.id == CartItem.product_id)
+        .where(CartItem.user_id == user_id)
+        .order_by(CartItem.added_at, CartItem.id)
+    ).all()
+
+    lines = []
+    errors = []
+    subtotal = Decimal('0.00')
+    for row in rows:
+        if row.found is None:
+            errors.append(f'Product {row.product_id} is no longer available')
+            lines.append({'product_id': row.product_id, 'name': None, 'quantity': row.quantity,
+                          'unit_price': None, 'line_total': None, 'stock': 0, 'available': False})
+            continue
+        unit_price = Decimal(str(row.price))
+        line_total = unit_price * row.quantity
+        available = row.stock >= row.quantity
+        if not available:
+            errors.append(f'Insufficient stock for {row.name_en}')
+        subtotal += line_total
+        lines.append({
+            'product_id': row.product_id,
+            'name': row.name_en if lang == 'en' else row.name_ar,
+            'quantity': row.quantity,
+            'unit_price': unit_price,
+            'line_total': line_total,
+            'stock': row.stock,
+            'available': available
+        })
+
+    return {
+        'lines': lines,
+        'item_count': sum(line['quantity'] for line in lines),
+        'subtotal': subtotal,
+        'total': subtotal,
+        'valid': bool(lines) and not errors,
+        'errors': errors
+    }
+
+
+# ---------- Quote tokens ----------
+
+def _serializer():
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt='cart-quote')
+
+
+def issue_quote(user_id, lang='en'):
+    """Price the cart; a fully available cart also gets a token for create_order"""
+    quote = price_cart(user_id, lang)
+    quote['token'] = None
+    quote['expires_at'] = None
+    if quote['valid']:
+        ttl = app.config['QUOTE_TTL']
+        quote['token'] = _serializer().dumps({
+            'u': user_id,
+            'n': secrets.token_hex(16),
+            'l': [[line['product_id'], line['quantity'], str(line['unit_price'])] for line in quote['lines']]
+        })
+        quote['expires_at'] = datetime.utcnow() + timedelta(seconds=ttl)
+    return quote
+
+
+def verify_quote(token, user_id):
+    """Nonce and priced lines of a quote token: (nonce, {product_id: (quantity, unit_price)})"""
+    try:
+        payload = _serializer().loads(token, max_age=app.config['QUOTE_TTL'])
+    except SignatureExpired:
+        raise QuoteError('The quote has expired')
+    except BadSignature:
+        raise QuoteError('Invalid quote token')
+    # Tokens issued before nonces were added cannot be redeemed
+    if payload.get('u') != user_id or not payload.get('n'):
+        raise QuoteError('Invalid quote token')
+    return payload['n'], {product_id: (quantity, Decimal(price)) for product_id, quantity, price in payload['l']}
+
+
+def redeem_quote(user_id, nonce, quantities):
+    """Mark the token used and delete the quoted cart lines, in the order's transaction.
+
+    A nonce that is already in `used_quotes` raises QuoteError, as does a
+    cart whose quoted lines are gone or changed; the caller rolls back.
+    """
+    now = datetime.utcnow()
+    db.session.execute(delete(UsedQuote).where(UsedQuote.used_at < now - timedelta(seconds=app.config['QUOTE_TTL'])))
+    try:
+        db.session.execute(insert(UsedQuote).values(nonce=nonce, used_at=now))
+    except IntegrityError:
+        raise QuoteError('The quote has already been used')
+    result = db.session.execute(
+        delete(CartItem)
+        .where(CartItem.user_id == user_id, or_(*[
+            and_(CartItem.product_id == product_id, CartItem.quantity == quantity)
+            for product_id, quantity in quantities.items()
+        ]))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(quantities):
+        raise QuoteError('The quote has already been used or the cart has changed')
@@ -0,0 +1,206 @@
+"""WSGI middleware compressing JSON API responses.
+
+Product listings and order payloads are large, repetitive bilingual JSON
+that typically shrinks 5-10x. Responses under /api/ are compressed when:
+
+- the client accepts zstd, br or gzip (zstd and br need the `zstandard`
+  and `brotli` packages; gzip is always available), preferring them in
+  that order;
+- the content type is JSON, so images and other already-compressed
+  uploads pass through untouched;
+- the response has no Content-Encoding yet and is at least
+  COMPRESS_MIN_SIZE bytes.
+
+Streamed responses (e.g. `json_stream` order exports) have no length and
+are compressed chunk by chunk, flushing after each chunk so the client keeps
+receiving data. Bodies with an ETag are compressed once and kept in a small
+LRU, so cached catalog responses are not recompressed on every hit. ETags are
+weakened (W/"...") on compressed responses, as the bytes differ from the
+identity representation; If-None-Match uses weak comparison, so 304s still
+work.
+"""
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - depends on the environment
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ('application/json',)
+
+
+class _Gzip:
+    def __init__(self, level):
+        self._c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._c.flush(zlib.Z_FINISH)
+
+
+class _Brotli:
+    def __init__(self, level):
+        self._c = brotli.Compressor(quality=level)
+
+    def compress(self, data):
+        return self._c.process(data)
+
+    def flush(self):
+        return self._c.flush()
+
+    def finish(self):
+        return self._c.finish()
+
+
+class _Zstd:
+    def __init__(self, level):
+        self._c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data):
+        return self._c.compress(data)
+
+    def flush(self):
+        return self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self):
+        return self._c.flush()
+
+
+def available_encodings():
+    """Supported encodings, in order of preference"""
+    encodings = []
+    if zstandard is not None:
+        encodings.append('zstd')
+    if brotli is not None:
+        encodings.append('br')
+    encodings.append('gzip')
+    return encodings
+
+
+def negotiate(accept_encoding, encodings):
+    """Best encoding from `encodings` that the Accept-Encoding header allows, or None"""
+    if not accept_encoding:
+        return None
+    accept = parse_accept_header(accept_encoding)
+    for encoding in encodings:
+        if accept[encoding] > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """Compress /api/ JSON responses; see the module docstring"""
+
+    def __init__(self, wsgi_app, min_size=1024, levels=None, path_prefix='/api/',
+                 mimetypes=COMPRESSIBLE_TYPES, cache_size=256, encodings=None):
+        self.wsgi_app = wsgi_app
+        self.min_size = min_size
+        self.levels = {'gzip': 6, 'br': 4, 'zstd': 3, **(levels or {})}
+        self.path_prefix = path_prefix
+        self.mimetypes = mimetypes
+        self.encodings = encodings or available_encodings()
+        self._compressors = {'gzip': _Gzip, 'br': _Brotli, 'zstd': _Zstd}
+        self.cache = LRUCache(maxsize=cache_size, ttl=3600) if cache_size else None
+
+    @classmethod
+    def from_config(cls, wsgi_app, config):
+        return cls(
+            wsgi_app,
+            min_size=config.get('COMPRESS_MIN_SIZE', 1024),
+            levels={
+                'gzip': config.get('COMPRESS_GZIP_LEVEL', 6),
+                'br': config.get('COMPRESS_BROTLI_QUALITY', 4),
+                'zstd': config.get('COMPRESS_ZSTD_LEVEL', 3),
+            },
+            cache_size=config.get('COMPRESS_CACHE_SIZE', 256)
+        )
+
+    def compressor(self, encoding):
+        return self._compressors[encoding](self.levels[encoding])
+
+    def __call__(self, environ, start_response):
+        if not environ.get('PATH_INFO', '').startswith(self.path_prefix) or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.wsgi_app(environ, start_response)
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING'), self.encodings)
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        captured = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None  # the legacy write() callable is not used by Flask
+
+        app_iter = self.wsgi_app(environ, capture)
+        status, headers, exc_info = captured
+        headers = Headers(headers)
+        if not self._should_compress(status, headers):
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return app_iter
+
+        headers['Content-Encoding'] = encoding
+        vary = headers.get('Vary')
+        headers['Vary'] = f'{vary}, Accept-Encoding' if vary else 'Accept-Encoding'
+        etag = headers.get('ETag')
+        if etag and not etag.startswith('W/'):
+            headers['ETag'] = 'W/' + etag
+
+        if headers.get('Content-Length') is not None:
+            body = self._compress_body(app_iter, encoding, etag)
+            headers['Content-Length'] = str(len(body))
+            start_response(status, headers.to_wsgi_list(), exc_info)
+            return [body]
+
+        start_response(status, headers.to_wsgi_list(), exc_info)
+        return self._compress_stream(app_iter, encoding)
+
+    def _should_compress(self, status, headers):
+        if status[:3] in ('204', '206', '304') or 'Content-Encoding' in headers:
+            return False
+        if headers.get('Content-Type', '').split(';')[0].strip() not in self.mimetypes:
+            return False
+        length = headers.get('Content-Length')
+        return length is None or int(length) >= self.min_size
+
+    def _compress_body(self, app_iter, encoding, etag):
+        key = f'{encoding}:{self.levels[encoding]}:{etag}' if etag and self.cache is not None else None
+        try:
+            if key is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached
+            compressor = self.compressor(encoding)
+            body = b''.join(compressor.compress(chunk) for chunk in app_iter) + compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+        if key is not None:
+            self.cache.set(key, body)
+        return body
+
+    def _compress_stream(self, app_iter, encoding):
+        compressor = self.compressor(encoding)
+        try:
+            for chunk in app_iter:
+                data = compressor.compress(chunk) + compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
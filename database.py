@@ -0,0 +1,157 @@
+"""Engine configuration per database backend, and connection pool statistics.
+
+`engine_options()` builds SQLALCHEMY_ENGINE_OPTIONS for the configured URL:
+
+- Postgres (and any other client/server database): a QueuePool of
+  DB_POOL_SIZE connections plus DB_MAX_OVERFLOW temporary ones, waiting at
+  most DB_POOL_TIMEOUT seconds for a free connection. Connections are
+  replaced after DB_POOL_RECYCLE seconds, before Render's proxy or the
+  server drops them, and `pool_pre_ping` tests each one on checkout so a
+  dropped connection costs a reconnect instead of a failed request.
+- SQLite files: SQLAlchemy's default QueuePool. `init_app()` sets the
+  SQLITE_* pragmas on every new connection: WAL lets readers run alongside
+  the single writer, synchronous=NORMAL only syncs at checkpoints (safe in
+  WAL mode), mmap_size and cache_size keep hot pages in memory, and
+  busy_timeout makes a writer wait for the lock instead of failing with
+  "database is locked". An empty setting leaves that pragma alone.
+- In-memory SQLite keeps Flask-SQLAlchemy's single shared connection.
+
+The pools time how long every checkout waits for a connection (including
+opening a new one), so `pool_stats()` can report the live pool state next to
+checkout, wait and timeout totals. /api/health/details (admins) and
+/api/metrics show them.
+The totals are per process.
+"""
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+SQLITE_PRAGMAS = (
+    ('journal_mode', 'SQLITE_JOURNAL_MODE'),
+    ('synchronous', 'SQLITE_SYNCHRONOUS'),
+    ('mmap_size', 'SQLITE_MMAP_SIZE'),
+    ('cache_size', 'SQLITE_CACHE_SIZE'),
+    ('busy_timeout', 'SQLITE_BUSY_TIMEOUT'),
+)
+
+
+class PoolStats:
+    """Checkout totals of one pool"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds_total': round(self.wait_total, 6),
+                'wait_seconds_max': round(self.wait_max, 6),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # recreate() (engine.dispose(), e.g. after a fork) starts a fresh pool with fresh stats
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+def is_memory_sqlite(url):
+    url = make_url(url)
+    return url.get_backend_name() == 'sqlite' and (
+        url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+    )
+
+
+def engine_options(url, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the database at `url`"""
+    if is_memory_sqlite(url):
+        return {}
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {'poolclass': TimedQueuePool}
+    return {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def sqlite_pragmas(config):
+    return [(pragma, config[key]) for pragma, key in SQLITE_PRAGMAS if config.get(key) not in (None, '')]
+
+
+def configure_sqlite(engine, pragmas):
+    """Run the pragmas on every new connection of a SQLite engine"""
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas:
+            cursor.execute(f'PRAGMA {pragma}={value}')
+        cursor.close()
+
+
+def pool_stats(engine):
+    """Live state and checkout totals of the engine's pool"""
+    pool = engine.pool
+    stats = {'backend': engine.dialect.name, 'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            # Connections open beyond `size` (the overflow counter is negative while the pool is not full)
+            'overflow': max(pool.overflow(), 0),
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.stats.as_dict())
+    return stats
+
+
+def all_pool_stats(db):
+    """pool_stats() of every engine, keyed by bind ('default' for the primary database)"""
+    return {key or 'default': pool_stats(engine) for key, engine in db.engines.items()}
+
+
+def init_app(app, db):
+    """Install the SQLite pragmas on the app's SQLite engines; call before the first connection"""
+    pragmas = sqlite_pragmas(app.config)
+    if not pragmas:
+        return
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                configure_sqlite(engine, pragmas)
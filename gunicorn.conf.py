@@ -0,0 +1,80 @@
+"""Production server settings: `gunicorn app:app` (gunicorn reads this file from the working directory).
+
+`run.py` and `python app.py` start the Werkzeug development server, which
+is single-process, reloads code and must not face real traffic.
+
+- Workers and threads come from the environment, defaulting to
+  2 x CPUs + 1 processes of 4 threads each (the gthread worker). Most request
+  time is spent waiting on the database, so threads add concurrency cheaply
+  while processes spread the Python work over the cores.
+- The app is imported once in the master (`preload_app`) and forked, so
+  modules, model metadata, the compiled templates and the in-memory search
+  indexes (built before forking) are shared copy-on-write. `gc.freeze()` moves everything loaded so far out of the
+  collector's reach, so collections in the workers do not touch (and so
+  copy) those pages.
+- Database connections must not cross a fork: every worker disposes the
+  inherited engine pools (primary and replicas), leaving the parent's
+  connections alone, and opens its own. The background job threads restart
+  themselves after a fork (see tasks.TaskWorker).
+- Workers are recycled after `max_requests` (with jitter, so they do not
+  all restart at once) to cap slow memory growth; recycling is graceful,
+  in-flight requests finish first.
+- Several workers, each forked with a copy of the preloaded state, are
+  only correct because no catalog state is trusted per process: the cache
+  version and its change time live in the catalog_version row (cache.py),
+  the in-memory search and suggest indexes rebuild when that version moves
+  (search.py), and cached entries and fragments are keyed by it and
+  re-check stock on every hit. Anything new
+  that a worker keeps in memory has to follow the same version.
+- X-Forwarded-* headers (the client's scheme and address) are trusted from
+  FORWARDED_ALLOW_IPS. On Render (RENDER is set) only the platform proxy can
+  reach the app, so it defaults to '*'; elsewhere to 127.0.0.1, a proxy on
+  the same host. Set it to the proxy's addresses behind any other proxy.
+
+Benchmark against the development server: python -m benchmarks.server_benchmark
+"""
+import gc
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', f'0.0.0.0:{os.getenv("PORT", "5000")}')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+# Seconds an idle keep-alive connection is held open; keep it above a fronting proxy's idle timeout
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', '5'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '200'))
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+# Heartbeat files in memory instead of a possibly slow or full disk
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Empty disables the access log
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+# Render and most platforms terminate TLS in front of the app
+forwarded_allow_ips = os.getenv('FORWARDED_ALLOW_IPS', '*' if os.getenv('RENDER') else '127.0.0.1')
+
+
+def when_ready(server):
+    if preload_app:
+        # Built once here, the in-memory indexes are shared copy-on-write by every worker
+        from search import warm_indexes
+        warm_indexes()
+        gc.freeze()
+    server.log.info(f'{workers} workers x {threads} threads ({worker_class}), preload={preload_app}')
+
+
+def post_fork(server, worker):
+    # close=False: the connections belong to the parent, only drop our references
+    from app import app, db
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+        if not preload_app:
+            from search import suggest_index
+            suggest_index.ensure_built()
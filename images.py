@@ -0,0 +1,190 @@
+"""Image derivative pipeline for product uploads.
+
+Each upload is decoded once, rotated according to its EXIF orientation and
+re-encoded at a few fixed widths as WebP (plus AVIF when Pillow supports it)
+with a JPEG fallback. Derivatives carry no EXIF metadata, so phone photos
+stop leaking camera and location data and product cards download a few KB
+instead of several MB. The original, which stays reachable at the image's
+`url`, is re-encoded without its metadata when it is uploaded
+(`strip_metadata`), before it is hashed and stored.
+
+Images over Pillow's MAX_IMAGE_PIXELS are rejected as decompression bombs.
+
+Pillow is optional: without it uploads are stored and served unchanged.
+"""
+import os
+import tempfile
+
+from app import app
+
+try:
+    from PIL import Image, ImageOps, JpegImagePlugin, features
+except ImportError:  # pragma: no cover - depends on the environment
+    Image = None
+
+UPLOAD_URL_PREFIX = '/api/uploads/'
+
+DERIVATIVE_WIDTHS = (160, 480, 1200)
+# Width used for the `thumbnail` field of product cards and order items
+THUMBNAIL_WIDTH = 480
+
+QUALITY = {'webp': 80, 'avif': 60, 'jpeg': 82}
+EXTENSIONS = {'webp': 'webp', 'avif': 'avif', 'jpeg': 'jpg'}
+PIL_FORMATS = {'webp': 'WEBP', 'avif': 'AVIF', 'jpeg': 'JPEG'}
+
+
+def available():
+    return Image is not None
+
+
+def output_formats():
+    """Formats to generate, best first. JPEG is always last as the universal fallback."""
+    formats = [fmt for fmt in app.config.get('IMAGE_FORMATS', ('webp', 'jpeg')) if fmt != 'jpeg']
+    if Image is None:
+        return []
+    formats = [fmt for fmt in formats if features.check(fmt)]
+    return formats + ['jpeg']
+
+
+def probe(path):
+    """Validate an image from its header alone and return its (width, height).
+
+    Raises OSError for files Pillow cannot identify. Returns (None, None)
+    when Pillow is not installed.
+    """
+    if Image is None:
+        return None, None
+    try:
+        with Image.open(path) as image:
+            width, height = image.size
+            if image.getexif().get(0x0112) in (5, 6, 7, 8):  # EXIF orientation rotates by 90/270 degrees
+                width, height = height, width
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e))
+    # Pillow only warns between the limit and twice the limit
+    if Image.MAX_IMAGE_PIXELS and width * height > Image.MAX_IMAGE_PIXELS:
+        raise ValueError(f'Image is too large ({width}x{height} pixels)')
+    return width, height
+
+
+def strip_metadata(path):
+    """Re-encode the image at `path` in place without EXIF, XMP or comments.
+
+    The EXIF orientation is applied to the pixels first, so the image still
+    displays upright, and the ICC profile is kept. JPEGs are re-encoded
+    with their own quantization tables and subsampling, which costs almost
+    no quality; animated images keep their frames. Call `probe()` first.
+    """
+    if Image is None:
+        return
+    with Image.open(path) as source:
+        fmt = source.format
+        options = {}
+        if getattr(source, 'n_frames', 1) > 1:
+            image = source
+            options['save_all'] = True
+        else:
+            image = ImageOps.exif_transpose(source)
+        if fmt == 'JPEG':
+            options['qtables'] = source.quantization
+            options['subsampling'] = JpegImagePlugin.get_sampling(source)
+        elif fmt == 'WEBP':
+            options['quality'] = 90
+        if source.info.get('icc_profile'):
+            options['icc_profile'] = source.info['icc_profile']
+        # Savers fall back to .info for some metadata (e.g. GIF comments)
+        image.info = {key: value for key, value in image.info.items()
+                      if key in ('duration', 'loop', 'transparency', 'background', 'disposal')}
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        os.close(fd)
+        try:
+            image.save(tmp_path, fmt, **options)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+
+def derivative_name(filename, width, fmt):
+    stem = filename.rsplit('.', 1)[0]
+    return f'{stem}_{width}w.{EXTENSIONS[fmt]}'
+
+
+def _flatten(image):
+    """JPEG has no alpha channel; composite transparent images onto white"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def generate_derivatives(folder, filename, url_prefix=UPLOAD_URL_PREFIX):
+    """Create the resized, EXIF-free variants of `folder/filename`.
+
+    Returns `(width, height, variants)` where `variants` maps format ->
+    {width: url}. Widths larger than the original are skipped, except that
+    the smallest size is always produced so every image has a thumbnail.
+    """
+    if Image is None:
+        return None, None, {}
+
+    path = os.path.join(folder, filename)
+    width, height = probe(path)
+    with Image.open(path) as source:
+        # Let the JPEG decoder downscale while decoding; far cheaper than a full decode
+        largest = max(DERIVATIVE_WIDTHS)
+        source.draft('RGB', (largest, largest))
+        image = _flatten(ImageOps.exif_transpose(source))
+
+    formats = output_formats()
+    variants = {fmt: {} for fmt in formats}
+    widths = [w for w in DERIVATIVE_WIDTHS if w < width] or [min(DERIVATIVE_WIDTHS)]
+    # Largest first, so each size is resized from the previous, smaller one
+    for target in sorted(widths, reverse=True):
+        if image.width > target:
+            image = image.resize((target, max(1, round(image.height * target / image.width))), Image.LANCZOS)
+        for fmt in formats:
+            name = derivative_name(filename, target, fmt)
+            image.save(os.path.join(folder, name), PIL_FORMATS[fmt], quality=QUALITY[fmt], optimize=fmt == 'jpeg')
+            variants[fmt][str(target)] = url_prefix + name
+
+    for fmt in formats:
+        variants[fmt] = dict(sorted(variants[fmt].items(), key=lambda item: int(item[0])))
+    return width, height, variants
+
+
+def path_from_url(url):
+    """Path relative to the upload folder of an /api/uploads/ URL"""
+    if url.startswith(UPLOAD_URL_PREFIX):
+        return url[len(UPLOAD_URL_PREFIX):]
+    return url.rsplit('/', 1)[-1]
+
+
+def derivative_files(variants):
+    """Upload folder paths of every derivative listed in `variants`"""
+    return [path_from_url(url) for urls in (variants or {}).values() for url in urls.values()]
+
+
+@app.cli.command('generate-derivatives')
+def generate_missing_derivatives():
+    """Create derivatives for product images uploaded before the pipeline existed"""
+    from app import db
+    from models import ProductImage
+    from storage import upload_storage
+    done = 0
+    for image in ProductImage.query.filter(ProductImage.variants.is_(None)):
+        path = path_from_url(image.url)
+        if not upload_storage.exists(path):
+            continue
+        try:
+            with upload_storage.local_folder(path) as folder:
+                image.width, image.height, image.variants = generate_derivatives(folder, path)
+                upload_storage.upload_local(folder, derivative_files(image.variants))
+        except (OSError, ValueError) as e:
+            print(f'Skipping {path}: {e}')
+            continue
+        done += 1
+    db.session.commit()
+    print(f'Generated derivatives for {done} images')
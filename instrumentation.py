@@ -0,0 +1,371 @@
+"""Opt-in request instrumentation: per-endpoint timings, SQL counts and profiles.
+
+With INSTRUMENTATION_ENABLED every request records:
+
+- wall time, from `before_request` until the response is closed (so
+  streamed responses include the time spent streaming);
+- the number of SQL statements and the time spent in them, from
+  `before_cursor_execute`/`after_cursor_execute` on every engine;
+- the time spent encoding the JSON body (see `responses.on_serialize`);
+- the response size in bytes, before compression (not for streamed
+  responses, whose length is unknown up front).
+
+/api/metrics also reports the database connection pools (see database.py)
+and the lag of the read replicas (see replicas.py).
+
+They are kept per process as Prometheus histograms labelled by Flask
+endpoint and served in the text exposition format at /api/metrics
+(protected by METRICS_TOKEN when it is set). Each gunicorn worker keeps its
+own series, so scrape the workers individually or aggregate by instance.
+Responses also carry a `Server-Timing` header that browser dev tools show
+next to the request; for streamed responses it covers the time until the
+first byte.
+
+Profiles: PROFILE_SAMPLE_RATE profiles that fraction of requests, and a
+request with `X-Profile: <PROFILE_TOKEN>` is always profiled. cProfile output
+(`.prof`, open with `python -m pstats` or snakeviz) or, with PROFILER=
+pyinstrument and the package installed, an HTML report is written to
+PROFILE_DIR.
+"""
+import bisect
+import cProfile
+import hmac
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import database
+import replicas
+import responses
+
+try:
+    import pyinstrument
+except ImportError:  # pragma: no cover - depends on the environment
+    pyinstrument = None
+
+# Upper bounds; every histogram also has the implicit +Inf bucket
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (not cumulative, +Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else _number(bound)
+                    lines.append(f'{self.name}_bucket{_labels(self.labelnames, labels, [("le", le)])} {cumulative}')
+                lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}')
+                lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+class Metrics:
+    """The per-endpoint request metrics"""
+
+    def __init__(self):
+        self.requests = Counter('athar_http_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+        self.duration = Histogram('athar_http_request_duration_seconds', 'Wall time per request.', ('endpoint', 'method'))
+        self.sql_queries = Histogram('athar_http_request_sql_queries', 'SQL statements per request.', ('endpoint',), COUNT_BUCKETS)
+        self.sql_duration = Histogram('athar_http_request_sql_duration_seconds', 'Time spent in SQL per request.', ('endpoint',), SQL_DURATION_BUCKETS)
+        self.serialize_duration = Histogram('athar_http_request_serialize_duration_seconds', 'Time spent encoding JSON per request.', ('endpoint',), SQL_DURATION_BUCKETS)
+        self.response_size = Histogram('athar_http_response_size_bytes', 'Response body size before compression.', ('endpoint',), SIZE_BUCKETS)
+
+    def record(self, stats, status):
+        endpoint = stats.endpoint
+        self.requests.inc(endpoint, stats.method, str(status))
+        self.duration.observe(stats.elapsed(), endpoint, stats.method)
+        self.sql_queries.observe(stats.sql_count, endpoint)
+        self.sql_duration.observe(stats.sql_time, endpoint)
+        self.serialize_duration.observe(stats.serialize_time, endpoint)
+        if stats.size is not None:
+            self.response_size.observe(stats.size, endpoint)
+
+    def render(self):
+        lines = []
+        for metric in (self.requests, self.duration, self.sql_queries, self.sql_duration,
+                       self.serialize_duration, self.response_size):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Pool series rendered at scrape time from database.pool_stats(): stats key -> (name, type, help)
+POOL_SERIES = (
+    ('size', 'athar_db_pool_size', 'gauge', 'Connections the pool keeps open.'),
+    ('checked_out', 'athar_db_pool_checked_out', 'gauge', 'Connections in use.'),
+    ('overflow', 'athar_db_pool_overflow', 'gauge', 'Connections open beyond the pool size.'),
+    ('checkouts', 'athar_db_pool_checkouts_total', 'counter', 'Connections handed out by the pool.'),
+    ('timeouts', 'athar_db_pool_timeouts_total', 'counter', 'Checkouts that gave up waiting for a connection.'),
+    ('wait_seconds_total', 'athar_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection.'),
+    ('wait_seconds_max', 'athar_db_pool_wait_seconds_max', 'gauge', 'Longest wait for a connection.'),
+)
+
+
+def render_pool_stats(stats_by_engine):
+    lines = []
+    for key, name, kind, documentation in POOL_SERIES:
+        values = [(engine, stats[key]) for engine, stats in sorted(stats_by_engine.items()) if key in stats]
+        if not values:
+            continue
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{_labels(("engine",), (engine,))} {_number(value)}' for engine, value in values]
+    return '\n'.join(lines) + '\n' if lines else ''
+
+
+def render_replica_status(status):
+    if not status:
+        return ''
+    lines = ['# HELP athar_db_replica_lag_seconds Replication lag at the last check (NaN when unknown).',
+             '# TYPE athar_db_replica_lag_seconds gauge']
+    for replica, state in sorted(status.items()):
+        lag = state['lag_seconds']
+        lines.append(f'athar_db_replica_lag_seconds{_labels(("replica",), (replica,))} {"NaN" if lag is None else _number(float(lag))}')
+    lines += ['# HELP athar_db_replica_healthy Whether reads are sent to the replica.',
+              '# TYPE athar_db_replica_healthy gauge']
+    for replica, state in sorted(status.items()):
+        lines.append(f'athar_db_replica_healthy{_labels(("replica",), (replica,))} {int(state["healthy"])}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    """What one request spent its time on"""
+
+    def __init__(self, endpoint, method):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.perf_counter()
+        self.finished = None
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+        self.size = None
+
+    def record_query(self, statement, duration):
+        self.sql_count += 1
+        self.sql_time += duration
+
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def server_timing(self):
+        return ', '.join([
+            f'app;dur={self.elapsed() * 1000:.1f}',
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+        ])
+
+
+def current_stats():
+    """Stats of the request being handled, or None outside a request or when disabled"""
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+# ---------- SQL timing ----------
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.record_query(statement, time.perf_counter() - started)
+
+
+def _cursor_error(context):
+    # after_cursor_execute does not run for a failed statement
+    if context.connection is not None:
+        started = context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+
+def _serialized(seconds):
+    stats = current_stats()
+    if stats is not None:
+        stats.serialize_time += seconds
+
+
+# ---------- Profiling ----------
+
+class RequestProfiler:
+    """Profiles sampled or explicitly requested requests into PROFILE_DIR"""
+
+    def __init__(self, directory, sample_rate=0.0, token=None, backend='cprofile'):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.token = token
+        self.backend = 'pyinstrument' if backend == 'pyinstrument' and pyinstrument is not None else 'cprofile'
+
+    def wanted(self):
+        header = request.headers.get('X-Profile')
+        if header and self.token and hmac.compare_digest(header, self.token):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        if self.backend == 'pyinstrument':
+            profiler = pyinstrument.Profiler(async_mode='disabled')
+            profiler.start()
+            return profiler
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return None
+        return profiler
+
+    def stop(self, profiler, stats):
+        if self.backend == 'pyinstrument':
+            profiler.stop()
+        else:
+            profiler.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        name = (f'{datetime.utcnow():%Y%m%dT%H%M%S%f}-{stats.endpoint.replace(".", "-")}'
+                f'-{stats.elapsed() * 1000:.0f}ms')
+        if self.backend == 'pyinstrument':
+            path = os.path.join(self.directory, name + '.html')
+            with open(path, 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            path = os.path.join(self.directory, name + '.prof')
+            profiler.dump_stats(path)
+        return path
+
+
+# ---------- Flask wiring ----------
+
+def _authorized(token):
+    if not token:
+        return True
+    header = request.headers.get('Authorization', '')
+    return hmac.compare_digest(header, f'Bearer {token}')
+
+
+def init_app(app):
+    """Install the request hooks, SQL listeners and /api/metrics on `app`"""
+    metrics = Metrics()
+    profiler = RequestProfiler(
+        app.config['PROFILE_DIR'], app.config['PROFILE_SAMPLE_RATE'],
+        app.config['PROFILE_TOKEN'], app.config['PROFILER']
+    )
+    server_timing = app.config['SERVER_TIMING']
+
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Engine, 'handle_error', _cursor_error)
+    responses.on_serialize = _serialized
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = RequestStats(request.endpoint or 'unmatched', request.method)
+        if profiler.wanted():
+            g.request_profiler = profiler.start()
+
+    @app.after_request
+    def finish_request_stats(response):
+        stats = g.get('request_stats')
+        if stats is None:
+            return response
+        if not response.is_streamed:
+            stats.size = response.calculate_content_length()
+        if server_timing:
+            response.headers['Server-Timing'] = stats.server_timing()
+        active_profiler = g.pop('request_profiler', None)
+        status = response.status_code
+
+        def finish():
+            stats.finished = time.perf_counter()
+            metrics.record(stats, status)
+            if active_profiler is not None:
+                path = profiler.stop(active_profiler, stats)
+                app.logger.info(f'Profiled {stats.method} {stats.endpoint} ({stats.elapsed() * 1000:.0f} ms): {path}')
+
+        response.call_on_close(finish)
+        return response
+
+    @app.teardown_request
+    def stop_abandoned_profiler(exc):
+        # Set only when the request failed before after_request ran
+        active_profiler = g.pop('request_profiler', None)
+        if active_profiler is not None:
+            active_profiler.stop() if profiler.backend == 'pyinstrument' else active_profiler.disable()
+
+    @app.route('/api/metrics')
+    def metrics_endpoint():
+        if not _authorized(app.config['METRICS_TOKEN']):
+            return app.response_class('Unauthorized\n', status=401, mimetype='text/plain')
+        body = metrics.render() + render_pool_stats(database.all_pool_stats(app.extensions['sqlalchemy']))
+        body += render_replica_status(replicas.replica_router.status())
+        return app.response_class(body, mimetype='text/plain; version=0.0.4')
+
+    app.extensions['instrumentation'] = metrics
+    return metrics
@@ -0,0 +1,134 @@
+"""Stock reservation for checkout.
+
+All products of an order are fetched with one IN query and stock is taken
+with conditional `UPDATE ... WHERE stock >= :quantity` statements (or row
+locks on Postgres) inside the caller's transaction, so concurrent checkouts
+can never take the same unit twice. Lines are processed in product id order
+so two orders touching the same products cannot deadlock each other.
+Orders placed from a cart quote skip the product read, see cart.py.
+"""
+from sqlalchemy import select, update
+from sqlalchemy.orm import load_only
+
+from app import db
+from models import Product
+
+
+class ReservationError(Exception):
+    """Raised when an order cannot be reserved. `errors` lists every failing line."""
+
+    def __init__(self, message, errors, lines=None, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.errors = errors
+        self.lines = lines or []
+        self.status_code = status_code
+
+
+def normalize_items(items):
+    """Validate order lines and merge repeated products. Returns {product_id: quantity}."""
+    quantities = {}
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            product_id = int(item['product_id'])
+            quantity = int(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            errors.append(f'Item {index + 1} must have a numeric product_id and quantity')
+            continue
+        if quantity <= 0:
+            errors.append(f'Quantity for product {product_id} must be greater than 0')
+            continue
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    if errors:
+        raise ReservationError('Invalid order items', errors)
+    return quantities
+
+
+def reserve_stock(quantities):
+    """Take stock for every line of an order in the current transaction.
+
+    Returns {product_id: Product} with the products' prices. On failure the
+    caller must roll back; the raised ReservationError lists every missing
+    product and every line without enough stock, not just the first one.
+    """
+    product_ids = sorted(quantities)
+    query = Product.query.options(load_only(Product.id, Product.name_en, Product.price, Product.stock)) \
+        .filter(Product.id.in_(product_ids)).order_by(Product.id)
+    locking = db.engine.dialect.name == 'postgresql'
+    if locking:
+        query = query.with_for_update()
+    products = {product.id: product for product in query}
+
+    errors = []
+    lines = []
+    for product_id in product_ids:
+        if product_id not in products:
+            errors.append(f'Product {product_id} not found')
+            lines.append({'product_id': product_id, 'requested': quantities[product_id], 'available': 0})
+
+    for product_id in product_ids:
+        product = products.get(product_id)
+        if product is None:
+            continue
+        quantity = quantities[product_id]
+        if locking:
+            # Rows are locked, so the stock we read is the stock we update
+            reserved = product.stock >= quantity
+            if reserved:
+                product.stock -= quantity
+        else:
+            result = db.session.execute(
+                update(Product)
+                .where(Product.id == product_id, Product.stock >= quantity)
+                .values(stock=Product.stock - quantity)
+                .execution_options(synchronize_session=False)
+            )
+            reserved = result.rowcount == 1
+            # The loaded value is stale now; reload it if anything reads it
+            db.session.expire(product, ['stock'])
+        if not reserved:
+            available = product.stock
+            errors.append(f'Insufficient stock for {product.name_en}')
+            lines.append({'product_id': product_id, 'requested': quantity, 'available': available})
+
+    if errors:
+        raise ReservationError('Some items are unavailable', errors, lines)
+    return products
+
+
+def reserve_quoted_stock(quantities):
+    """Take stock for a quoted order without reading the products first.
+
+    The quote already carries the prices, so only the conditional UPDATEs
+    run (on every backend; they are atomic without row locks). When a line
+    fails, the current stock of the failing lines is read once to build the
+    same ReservationError as `reserve_stock`.
+    """
+    failed = []
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id == product_id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            failed.append(product_id)
+    if not failed:
+        return
+
+    current = {row.id: row for row in db.session.execute(
+        select(Product.id, Product.name_en, Product.stock).where(Product.id.in_(failed))
+    )}
+    errors = []
+    lines = []
+    for product_id in failed:
+        row = current.get(product_id)
+        if row is None:
+            errors.append(f'Product {product_id} not found')
+        else:
+            errors.append(f'Insufficient stock for {row.name_en}')
+        lines.append({'product_id': product_id, 'requested': quantities[product_id], 'available': row.stock if row else 0})
+    raise ReservationError('Some items are unavailable', errors, lines)
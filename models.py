@@ -1,6 +1,8 @@
 from app import db
+from sqlalchemy.orm import load_only, selectinload, joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from images import THUMBNAIL_WIDTH
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -10,6 +12,8 @@ class User(db.Model):
     email = db.Column(db.String(120), unique=True, nullable=False, index=True)
     password_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), default='customer', nullable=False)
+    # Bumped to revoke every token issued so far; tokens carry it as the `ver` claim
+    token_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     orders = db.relationship('Order', backref='user', lazy=True)
@@ -26,7 +30,7 @@ class User(db.Model):
             'name': self.name,
             'email': self.email,
             'role': self.role,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at
         }
 
 class Category(db.Model):
@@ -69,7 +73,112 @@ class Product(db.Model):
     
     images = db.relationship('ProductImage', backref='product', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self, lang='en'):
+    # Composite indexes backing keyset pagination for each sort mode
+    __table_args__ = (
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+        db.Index('ix_products_price_id', 'price', 'id'),
+    )
+    
+    # Projected fields, with the columns each one needs ('*' = per-language pair)
+    PROJECTION_COLUMNS = {
+        'id': (),
+        'name': ('name_*',),
+        'description': ('description_*',),
+        'price': ('price',),
+        'stock': ('stock',),
+        'sku': ('sku',),
+        'category_id': ('category_id',),
+        'category': ('category_id',),
+        'ingredients': ('ingredients_*',),
+        'usage': ('usage_*',),
+        'is_featured': ('is_featured',),
+        'thumbnail': (),
+        'images': (),
+        'created_at': ('created_at',)
+    }
+    
+    VIEWS = {
+        'card': ('id', 'name', 'price', 'stock', 'category_id', 'category', 'is_featured', 'thumbnail'),
+        'detail': ('id', 'name', 'description', 'price', 'stock', 'sku', 'category_id', 'category',
+                   'ingredients', 'usage', 'is_featured', 'images', 'created_at')
+    }
+    
+    @classmethod
+    def resolve_fields(cls, view=None, fields=None):
+        """Turn `view=` / `fields=` query args into a tuple of projected fields.
+        
+        Returns None when neither is given (legacy full document). Raises
+        ValueError for unknown views or fields.
+        """
+        if fields:
+            requested = tuple(dict.fromkeys(f.strip() for f in fields.split(',') if f.strip()))
+            unknown = [f for f in requested if f not in cls.PROJECTION_COLUMNS]
+            if unknown:
+                raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+            return ('id',) + tuple(f for f in requested if f != 'id')
+        if view:
+            if view not in cls.VIEWS:
+                raise ValueError(f'view must be one of: {", ".join(cls.VIEWS)}')
+            return cls.VIEWS[view]
+        return None
+    
+    @classmethod
+    def load_options(cls, fields, lang='en'):
+        """Loader options that fetch only the columns a projection needs"""
+        if fields is None:
+            return [selectinload(cls.images), joinedload(cls.category)]
+        suffix = 'en' if lang == 'en' else 'ar'
+        # Sort keys are always loaded so keyset pagination never triggers a lazy load
+        columns = {'id', 'price', 'created_at'}
+        for field in fields:
+            for column in cls.PROJECTION_COLUMNS[field]:
+                columns.add(column.replace('*', suffix))
+        options = [load_only(*[getattr(cls, column) for column in sorted(columns)])]
+        if 'images' in fields or 'thumbnail' in fields:
+            options.append(selectinload(cls.images))
+        if 'category' in fields:
+            options.append(joinedload(cls.category))
+        return options
+    
+    def project(self, fields, lang='en'):
+        """Serialize only `fields`, with text in the requested language only"""
+        suffix = 'en' if lang == 'en' else 'ar'
+        data = {}
+        for field in fields:
+            if field in ('name', 'description', 'ingredients', 'usage'):
+                data[field] = getattr(self, f'{field}_{suffix}')
+            elif field == 'category':
+                category = self.category
+                data['category'] = {
+                    'id': category.id,
+                    'name': category.name_en if lang == 'en' else category.name_ar,
+                    'slug': category.slug
+                } if category else None
+            elif field == 'thumbnail':
+                data['thumbnail'] = self.images[0].thumbnail_url if self.images else None
+            elif field == 'images':
+                data['images'] = [img.to_dict() for img in self.images]
+            else:
+                data[field] = getattr(self, field)
+        return data
+    
+    # Columns needed by summary_dict, for load_only()
+    SUMMARY_COLUMNS = ('id', 'name_en', 'name_ar', 'sku')
+    
+    def summary_dict(self):
+        """Slim product reference embedded in order items"""
+        return {
+            'id': self.id,
+            'name': self.name_en,
+            'name_en': self.name_en,
+            'name_ar': self.name_ar,
+            'sku': self.sku,
+            'thumbnail': self.images[0].thumbnail_url if self.images else None
+        }
+    
+    def to_dict(self, lang='en', fields=None):
+        if fields is not None:
+            return self.project(fields, lang)
         return {
             'id': self.id,
             'name': self.name_en if lang == 'en' else self.name_ar,
@@ -78,7 +187,7 @@ class Product(db.Model):
             'description': self.description_en if lang == 'en' else self.description_ar,
             'description_en': self.description_en,
             'description_ar': self.description_ar,
-            'price': float(self.price),
+            'price': self.price,
             'stock': self.stock,
             'sku': self.sku,
             'category_id': self.category_id,
@@ -91,25 +200,80 @@ class Product(db.Model):
             'usage_ar': self.usage_ar,
             'is_featured': self.is_featured,
             'images': [img.to_dict() for img in self.images],
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at
         }
 
+class Blob(db.Model):
+    """An uploaded file stored once under its SHA-256 hash, see storage.py"""
+    __tablename__ = 'blobs'
+    
+    hash = db.Column(db.String(64), primary_key=True)
+    # Path relative to UPLOAD_FOLDER, e.g. ab/cd/abcd....jpg
+    path = db.Column(db.String(300), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    # Number of product images using this blob
+    ref_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class ProductImage(db.Model):
     __tablename__ = 'product_images'
     
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     url = db.Column(db.String(500), nullable=False)
+    # Null for files uploaded before content-addressed storage
+    blob_hash = db.Column(db.String(64), db.ForeignKey('blobs.hash'), index=True)
     alt_text = db.Column(db.String(200))
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    # Resized derivatives: {format: {width: url}}, see images.generate_derivatives
+    variants = db.Column(db.JSON)
+    # Derivative processing state: pending -> ready | failed
+    status = db.Column(db.String(20), default='pending', server_default='ready', nullable=False)
+    
+    @staticmethod
+    def thumbnail_for(url, variants):
+        """Card-sized derivative from `variants`, falling back to the original `url`"""
+        for urls in (variants or {}).values():
+            if urls:
+                widths = sorted(int(w) for w in urls)
+                width = next((w for w in widths if w >= THUMBNAIL_WIDTH), widths[-1])
+                return urls[str(width)]
+        return url
+    
+    @property
+    def thumbnail_url(self):
+        """Card-sized derivative, falling back to the original upload"""
+        return self.thumbnail_for(self.url, self.variants)
     
     def to_dict(self):
+        variants = self.variants or {}
         return {
             'id': self.id,
             'product_id': self.product_id,
             'url': self.url,
-            'alt_text': self.alt_text
+            'alt_text': self.alt_text,
+            'width': self.width,
+            'height': self.height,
+            'status': self.status,
+            'thumbnail': self.thumbnail_url,
+            'variants': variants,
+            'srcset': {fmt: ', '.join(f'{url} {width}w' for width, url in urls.items()) for fmt, urls in variants.items()}
         }
 
+class ProductSummary(db.Model):
+    """Precomputed card-view JSON of a product, see summaries.py.
+    
+    No foreign key: rows are rewritten after the product rows they mirror
+    have been flushed, including deletes.
+    """
+    __tablename__ = 'product_summaries'
+    
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    card_en = db.Column(db.LargeBinary, nullable=False)
+    card_ar = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class Order(db.Model):
     __tablename__ = 'orders'
     
@@ -127,12 +291,27 @@ class Order(db.Model):
     
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade='all, delete-orphan')
     
+    # Composite indexes backing the keyset-paginated order listings
+    __table_args__ = (
+        db.Index('ix_orders_created_at_id', 'created_at', 'id'),
+        db.Index('ix_orders_user_id_created_at_id', 'user_id', 'created_at', 'id'),
+    )
+    
+    @classmethod
+    def listing_options(cls):
+        """Load order -> items -> product summary -> images in a constant number of queries"""
+        product = selectinload(cls.items).selectinload(OrderItem.product)
+        return [
+            product.load_only(*[getattr(Product, column) for column in Product.SUMMARY_COLUMNS]),
+            product.selectinload(Product.images).load_only(ProductImage.id, ProductImage.product_id, ProductImage.url, ProductImage.variants)
+        ]
+    
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'status': self.status,
-            'total': float(self.total),
+            'total': self.total,
             'payment_method': self.payment_method,
             'shipping_name': self.shipping_name,
             'shipping_phone': self.shipping_phone,
@@ -140,14 +319,14 @@ class Order(db.Model):
             'shipping_street': self.shipping_street,
             'shipping_notes': self.shipping_notes,
             'items': [item.to_dict() for item in self.items],
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at
         }
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     unit_price = db.Column(db.Numeric(10, 2), nullable=False)
@@ -160,12 +339,80 @@ class OrderItem(db.Model):
             'id': self.id,
             'order_id': self.order_id,
             'product_id': self.product_id,
-            'product': self.product.to_dict() if self.product else None,
+            'product': self.product.summary_dict() if self.product else None,
             'quantity': self.quantity,
-            'unit_price': float(self.unit_price),
-            'line_total': float(self.line_total)
+            'unit_price': self.unit_price,
+            'line_total': self.line_total
         }
 
+class CartItem(db.Model):
+    """A line of a customer's server-side cart, see routes/cart.py"""
+    __tablename__ = 'cart_items'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    added_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # One line per product; also serves the per-user cart lookup
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', name='uq_cart_items_user_id_product_id'),
+    )
 
+class Job(db.Model):
+    """A background task in the persistent queue, see tasks.py"""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=3, nullable=False)
+    run_after = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_until = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_after', 'status', 'run_after'),
+    )
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'payload': self.payload,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'run_after': self.run_after,
+            'last_error': self.last_error,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
 
+class ReplicaHeartbeat(db.Model):
+    """Single row the primary rewrites every few seconds; its age on a replica is the replication lag (see replicas.py)"""
+    __tablename__ = 'replica_heartbeat'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+class UsedQuote(db.Model):
+    """Nonce of a checkout quote token that placed an order; the primary key makes each token single-use (see cart.py)"""
+    __tablename__ = 'used_quotes'
+    
+    nonce = db.Column(db.String(32), primary_key=True)
+    # Rows older than QUOTE_TTL are purged: their tokens have expired anyway
+    used_at = db.Column(db.DateTime, nullable=False, index=True)
 
+class CatalogVersion(db.Model):
+    """Single row holding the catalog cache version, so every worker invalidates together (see cache.py)"""
+    __tablename__ = 'catalog_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    changed_at = db.Column(db.DateTime, nullable=False)
@@ -0,0 +1,164 @@
+"""Keyset (cursor) pagination helpers shared by the API blueprints"""
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from app import db
+
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+# Longer id lists are bound as one parameter (see in_ids)
+MAX_BOUND_IDS = 500
+# Smallest window of ranked ids checked per query by paginate_ranked
+RANKED_WINDOW = 100
+# paginate_ranked checks the rest of the ranking at once after this many windows
+RANKED_MAX_WINDOWS = 3
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def parse_limit(raw, default=None, maximum=MAX_PAGE_SIZE):
+    """Parse the `limit` query arg. Returns `default` when it is absent."""
+    if raw is None or raw == '':
+        return default
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be a positive integer')
+    if limit <= 0:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, maximum)
+
+
+def encode_cursor(sort, value, row_id):
+    """Build an opaque cursor from the sort mode and the last row's key"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    elif isinstance(value, Decimal):
+        value = str(value)
+    payload = json.dumps([sort, value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, value_type):
+    """Decode a cursor issued by `encode_cursor` for the same sort mode.
+
+    `value_type` (`datetime`, `Decimal` or `int`) is used to restore the sort
+    key to the column's Python type.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_sort, value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        row_id = int(row_id)
+        if value is not None:
+            value = datetime.fromisoformat(value) if value_type is datetime else value_type(value)
+    except (ValueError, TypeError, InvalidOperation):
+        raise InvalidCursor('Malformed cursor')
+    if cursor_sort != sort:
+        raise InvalidCursor('Cursor does not match the requested sort order')
+    return value, row_id
+
+
+def keyset_filter(column, id_column, value, row_id, descending):
+    """Return the WHERE clause that selects rows strictly after (value, row_id)"""
+    if descending:
+        return db.or_(column < value, db.and_(column == value, id_column < row_id))
+    return db.or_(column > value, db.and_(column == value, id_column > row_id))
+
+
+def keyset_order(column, id_column, descending):
+    """ORDER BY clause matching `keyset_filter`, with the id as tie-breaker"""
+    if descending:
+        return column.desc(), id_column.desc()
+    return column.asc(), id_column.asc()
+
+
+def paginate_keyset(query, column, id_column, sort, value_type, descending, limit, cursor=None):
+    """Apply keyset pagination to `query`.
+
+    Fetches one extra row to find out whether there is a next page, so the
+    cost of a page only depends on `limit`, not on the size of the table.
+    Returns `(rows, next_cursor)`.
+    """
+    if cursor:
+        value, row_id = decode_cursor(cursor, sort, value_type)
+        query = query.filter(keyset_filter(column, id_column, value, row_id, descending))
+
+    query = query.order_by(*keyset_order(column, id_column, descending))
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(sort, getattr(last, column.key), getattr(last, id_column.key))
+    return rows, next_cursor
+
+
+def in_ids(column, ids):
+    """`column IN ids`, bound as a single parameter when the list is long.
+
+    SQLite caps the parameters of one statement (999 before 3.32, 32766
+    since), so long lists are passed as one JSON array read back with
+    json_each(); Postgres gets one array parameter.
+    """
+    ids = [int(value) for value in ids]
+    if len(ids) <= MAX_BOUND_IDS:
+        return column.in_(ids)
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        values = db.func.json_each(json.dumps(ids)).table_valued('value')
+        return column.in_(db.select(values.c.value))
+    if dialect == 'postgresql':
+        return column == db.any_(db.literal(ids, db.ARRAY(db.Integer)))
+    return column.in_(ids)
+
+
+def paginate_ranked(query, id_column, rank, sort, limit, cursor=None):
+    """Page through ids ranked outside the database (e.g. by relevance),
+    keeping only those `query` matches.
+
+    `rank(count, offset)` returns `count` ids of the ranking starting at
+    `offset` (all of the rest when `count` is None), so the ranker only
+    has to order the part that is checked. The ranking is checked against
+    `query` a window at a time, starting at the cursor and doubling the
+    window until the page (plus one row, to know whether there is a next
+    page) is full. The last of RANKED_MAX_WINDOWS windows covers the rest
+    of the ranking, so a page costs the same few queries on any catalog
+    size; without filters the first window fills it. The cursor holds the
+    offset into the ranking where the next page starts. Without a limit
+    every match is returned in one query. Returns `(page_ids, next_cursor)`.
+    """
+    if limit is None:
+        ranked_ids = rank(None, 0)
+        matched = {row[0] for row in query.filter(in_ids(id_column, ranked_ids)).with_entities(id_column)}
+        return [pid for pid in ranked_ids if pid in matched], None
+
+    offset = 0
+    if cursor:
+        offset, _ = decode_cursor(cursor, sort, int)
+        if offset < 0:
+            raise InvalidCursor('Malformed cursor')
+
+    found = []  # (offset in the ranking, id)
+    start = offset
+    window = max(4 * (limit + 1), RANKED_WINDOW)
+    for windows in range(1, RANKED_MAX_WINDOWS + 1):
+        count = None if windows == RANKED_MAX_WINDOWS else window
+        chunk = rank(count, start)
+        if chunk:
+            matched = {row[0] for row in query.filter(in_ids(id_column, chunk)).with_entities(id_column)}
+            found.extend((start + i, pid) for i, pid in enumerate(chunk) if pid in matched)
+        start += len(chunk)
+        if len(found) > limit or count is None or len(chunk) < count:
+            break
+        window *= 2
+
+    page = [pid for _, pid in found[:limit]]
+    next_cursor = None
+    if len(found) > limit:
+        next_cursor = encode_cursor(sort, found[limit][0], page[-1])
+    return page, next_cursor
@@ -0,0 +1,217 @@
+"""Query budgets and N+1 detection.
+
+The models use lazy relationships (`Order.items`, `OrderItem.product`,
+`Product.images`, ...) that `to_dict` walks, so a missing eager-load option
+turns one query into one per row without anything failing. This module
+makes the number of statements visible and enforceable:
+
+- `query_budget(n)` is a context manager and a view decorator. As a context
+  manager it records every statement run in its block (on this thread) and
+  raises QueryBudgetExceeded when there were more than `n`. On a view it
+  also declares the endpoint's budget (`view.query_budget`), which the
+  pytest plugin (query_budget_pytest.py) checks for every request a test
+  makes. In the app, QUERY_BUDGET_MODE decides what an overrun does:
+  'raise' (the default under TESTING), 'warn' (log it) or 'off'.
+- With QUERY_DEBUG on, every request is watched for the same SELECT shape
+  (the SQL with its parameters and IN lists collapsed) running repeatedly,
+  the signature of an N+1, and a warning names the `to_dict` (or other app
+  code) call site that triggered the lazy loads.
+
+Statements are counted per thread, so background workers and concurrent
+requests do not leak into each other's counts. Queries run while a
+streamed response is being sent happen after the view returned; only the
+pytest plugin, which reads the whole response, sees them.
+"""
+import os
+import re
+import sys
+import threading
+from collections import Counter
+from functools import wraps
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Shapes run this many times in one request are reported by QUERY_DEBUG
+REPEAT_THRESHOLD = 3
+# Functions that typically trigger lazy loads; reported in preference to their callers
+SERIALIZERS = re.compile(r'(^to_dict$|_dict$|^project$)')
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_local = threading.local()
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, log, budget, label=None):
+        self.log = log
+        self.budget = budget
+        self.label = label
+        super().__init__(f'{label or "Block"} ran {len(log)} queries, budget is {budget}\n{log.report()}')
+
+
+def statement_shape(statement):
+    """SQL with literals and IN lists collapsed, so repeats of one query compare equal"""
+    shape = re.sub(r'\(\s*(?:\?|%\(\w+\)s|%s|:\w+|\d+)(?:\s*,\s*(?:\?|%\(\w+\)s|%s|:\w+|\d+))*\s*\)', '(?)', statement)
+    shape = re.sub(r"'(?:[^']|'')*'", '?', shape)
+    shape = re.sub(r'\b\d+\b', '?', shape)
+    return ' '.join(shape.split())
+
+
+def call_site():
+    """Where the app code that issued the current statement lives.
+
+    The innermost serializer frame (`to_dict`, `summary_dict`, ...) in the
+    app wins, otherwise the innermost app frame outside this module.
+    """
+    frame = sys._getframe(2)
+    fallback = None
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_ROOT) and filename != __file__ and 'site-packages' not in filename:
+            site = f'{os.path.relpath(filename, _ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}'
+            if SERIALIZERS.search(frame.f_code.co_name):
+                return site
+            if fallback is None:
+                fallback = site
+        frame = frame.f_back
+    return fallback
+
+
+class QueryLog:
+    """Statements run while it was active: a list of (statement, call site)"""
+
+    def __init__(self, capture_sites=False):
+        self.capture_sites = capture_sites
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def shapes(self):
+        return Counter(statement_shape(statement) for statement, _ in self.statements)
+
+    def repeated(self, threshold=REPEAT_THRESHOLD):
+        """[(shape, count, call sites)] for SELECT shapes run at least `threshold` times.
+
+        Writes are left out: checkout deliberately runs one conditional
+        UPDATE per order line.
+        """
+        sites = Counter()
+        shapes = Counter()
+        for statement, site in self.statements:
+            if statement.lstrip()[:6].upper() != 'SELECT':
+                continue
+            shape = statement_shape(statement)
+            shapes[shape] += 1
+            sites[shape, site] += 1
+        return [
+            (shape, count, Counter({site: n for (s, site), n in sites.items() if s == shape}))
+            for shape, count in shapes.most_common() if count >= threshold
+        ]
+
+    def report(self):
+        lines = []
+        for shape, count in self.shapes().most_common():
+            lines.append(f'  {count} x {shape[:200]}')
+        return '\n'.join(lines)
+
+
+def _active():
+    stack = getattr(_local, 'logs', None)
+    if stack is None:
+        stack = _local.logs = []
+    return stack
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _record(conn, cursor, statement, parameters, context, executemany):
+    logs = getattr(_local, 'logs', None)
+    if not logs:
+        return
+    site = call_site() if any(log.capture_sites for log in logs) else None
+    for log in logs:
+        log.statements.append((statement, site))
+
+
+def _mode():
+    if not has_app_context():
+        return 'raise'
+    mode = current_app.config.get('QUERY_BUDGET_MODE')
+    if mode:
+        return mode
+    return 'raise' if current_app.testing else 'off'
+
+
+class query_budget:
+    """Count the statements of a block or view and enforce a budget (see the module docstring).
+
+        with query_budget(3) as log:
+            ...
+        print(len(log), log.report())
+
+        @orders_bp.route('/my')
+        @query_budget(6)
+        @jwt_required()
+        def get_my_orders(): ...
+    """
+
+    def __init__(self, limit=None, label=None, capture_sites=False):
+        self.limit = limit
+        self.label = label
+        self.capture_sites = capture_sites
+        self.log = None
+
+    def __enter__(self):
+        self.log = QueryLog(self.capture_sites)
+        _active().append(self.log)
+        return self.log
+
+    def __exit__(self, exc_type, exc, tb):
+        _active().remove(self.log)
+        if exc_type is None and self.limit is not None and len(self.log) > self.limit:
+            raise QueryBudgetExceeded(self.log, self.limit, self.label)
+        return False
+
+    def __call__(self, view):
+        limit = self.limit
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            mode = _mode()
+            if mode == 'off':
+                return view(*args, **kwargs)
+            label = f'{request.method} {request.path}' if has_request_context() else view.__name__
+            with query_budget() as log:
+                result = view(*args, **kwargs)
+            if len(log) > limit:
+                if mode == 'raise':
+                    raise QueryBudgetExceeded(log, limit, label)
+                current_app.logger.warning(f'{label} ran {len(log)} queries, budget is {limit}\n{log.report()}')
+            return result
+
+        wrapper.query_budget = limit
+        return wrapper
+
+
+def init_app(app):
+    """Warn about repeated statement shapes in every request (QUERY_DEBUG)"""
+    threshold = app.config.get('QUERY_REPEAT_THRESHOLD', REPEAT_THRESHOLD)
+
+    @app.before_request
+    def watch_queries():
+        budget = query_budget(capture_sites=True)
+        budget.__enter__()
+        g.query_watch = budget
+
+    @app.teardown_request
+    def report_repeated_queries(exc):
+        budget = g.pop('query_watch', None)
+        if budget is None:
+            return
+        budget.__exit__(None, None, None)
+        for shape, count, sites in budget.log.repeated(threshold):
+            where = ', '.join(f'{site or "?"} ({n}x)' for site, n in sites.most_common(3))
+            app.logger.warning(
+                f'Possible N+1 in {request.method} {request.path}: {count} x {shape[:200]}\n  from {where}'
+            )
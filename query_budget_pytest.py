@@ -0,0 +1,55 @@
+"""pytest plugin enforcing the query budgets declared with `@query_budget(n)`.
+
+Enable it with `pytest -p query_budget_pytest` (or `pytest_plugins =
+['query_budget_pytest']` in a conftest). Fixtures:
+
+- `budget_client`: a Flask test client. Every request it makes is counted,
+  including the queries run while a streamed body is read, and the test
+  fails when the endpoint's declared budget is exceeded. Override the
+  `budget_app` fixture to use a differently configured app.
+- `query_budget`: the context manager, for budgets on arbitrary code.
+
+tests/conftest.py loads it for the test suite (`python -m pytest tests`).
+"""
+import pytest
+from flask.testing import FlaskClient
+from werkzeug.exceptions import HTTPException
+
+from query_budget import QueryBudgetExceeded, query_budget as _query_budget
+
+
+class BudgetClient(FlaskClient):
+    def open(self, *args, **kwargs):
+        with _query_budget() as log:
+            response = super().open(*args, **kwargs)
+            response.get_data()
+        environ = response.request.environ
+        try:
+            endpoint, _ = self.application.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return response
+        budget = getattr(self.application.view_functions.get(endpoint), 'query_budget', None)
+        if budget is not None and len(log) > budget:
+            label = f'{environ["REQUEST_METHOD"]} {environ["PATH_INFO"]}'
+            pytest.fail(str(QueryBudgetExceeded(log, budget, label)), pytrace=False)
+        return response
+
+
+@pytest.fixture
+def budget_app():
+    from app import app
+    return app
+
+
+@pytest.fixture
+def budget_client(budget_app):
+    budget_app.test_client_class = BudgetClient
+    try:
+        yield budget_app.test_client()
+    finally:
+        budget_app.test_client_class = None
+
+
+@pytest.fixture
+def query_budget():
+    return _query_budget
@@ -0,0 +1,307 @@
+"""Read/write splitting across read replicas.
+
+With DATABASE_REPLICA_URLS set (comma separated), every replica becomes a
+Flask-SQLAlchemy bind (`replica_1`, `replica_2`, ...) and the session is a
+RoutingSession, which sends a statement to a replica only when all of these
+hold:
+
+- the view is marked with `@read_replica` (the catalog GET views and the
+  read-only order listings); everything else, the CLI and background jobs
+  use the primary;
+- nothing in the request has written yet: a flush, an INSERT/UPDATE/DELETE
+  or a SELECT ... FOR UPDATE pins the rest of the request to the primary,
+  so a request always reads its own writes. So does a bare
+  `db.session.connection()`: without a statement there is no telling what
+  it will run, so it is treated as a write. `use_primary()` pins a request
+  explicitly, and `with primary():` runs a block on the primary (used for
+  token revocation checks);
+- a replica is healthy: its replication lag is at most REPLICA_MAX_LAG
+  seconds. Otherwise the request falls back to the primary.
+
+One replica is picked per request (round robin), so a request never mixes
+two replicas' views of the data.
+
+Lag is checked every REPLICA_CHECK_INTERVAL seconds per process, in a
+background thread so no request waits on it. Postgres replicas report
+their WAL replay lag. Other backends compare heartbeats: the check rewrites
+the `replica_heartbeat` row on the primary, and a replica's lag is how far
+its copy of the row is behind the primary's. A replica whose check failed,
+that raised a connection error, or whose last check is too old, counts as
+unhealthy until a check succeeds again.
+
+Catalog writes bump the catalog cache version; for `stale_window` seconds
+(REPLICA_MAX_LAG + 2 * REPLICA_CHECK_INTERVAL) after that the cached catalog
+views read the primary, so a stale replica read cannot be cached under the
+new version (see cache.py). The time of the last change is read from the
+shared catalog_version row, so this holds whichever worker made the write.
+
+Locally, two SQLite files can stand in for primary and replica:
+DATABASE_REPLICA_URLS=sqlite:///athar-replica.db, then `flask replica-sync`
+copies the primary into the replica file whenever you want it to catch up.
+"""
+import itertools
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc, insert, select, update
+from sqlalchemy.sql.elements import TextClause
+
+REPLICA_BIND_PREFIX = 'replica_'
+PG_LAG_SQL = (
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+def replica_binds(urls, options_for):
+    """SQLALCHEMY_BINDS entries for the replica URLs; `options_for(url)` gives the engine options"""
+    return {
+        f'{REPLICA_BIND_PREFIX}{n}': {'url': url, **options_for(url)}
+        for n, url in enumerate(urls, start=1)
+    }
+
+
+def _is_write(clause):
+    if clause is None:
+        return False
+    if getattr(clause, 'is_dml', False) or getattr(clause, '_for_update_arg', None) is not None:
+        return True
+    if isinstance(clause, TextClause):
+        return clause.text.lstrip()[:6].upper() not in ('SELECT', 'WITH')
+    return False
+
+
+class ReplicaRouter:
+    """Replica health per process, and the replica chosen for each request"""
+
+    def __init__(self):
+        self.engines = {}
+        self.primary = None
+        self.max_lag = 5.0
+        self.check_interval = 2.0
+        self.logger = None
+        self._lag = {}
+        self._errors = {}
+        self._checked_at = None
+        self._checking = None
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    @property
+    def enabled(self):
+        return bool(self.engines)
+
+    def init_app(self, app, db):
+        self.max_lag = app.config['REPLICA_MAX_LAG']
+        self.check_interval = app.config['REPLICA_CHECK_INTERVAL']
+        self.logger = app.logger
+        with app.app_context():
+            self.primary = db.engines[None]
+            self.engines = {
+                key: engine for key, engine in db.engines.items()
+                if key and key.startswith(REPLICA_BIND_PREFIX)
+            }
+        for key, engine in self.engines.items():
+            event.listen(engine, 'handle_error', self._connection_error(key))
+
+        @app.cli.command('replica-sync')
+        def replica_sync():
+            """Copy the SQLite primary into the SQLite replica files (local testing)"""
+            sync_sqlite_replicas(self.primary, self.engines.values())
+            print(f'Copied the primary into {len(self.engines)} replica(s)')
+
+    def _connection_error(self, key):
+        def mark_unhealthy(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, exc.OperationalError):
+                self._lag[key] = None
+                self._errors[key] = str(context.original_exception)
+        return mark_unhealthy
+
+    # ---------- Health ----------
+
+    def _stale(self):
+        return self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval
+
+    def _maybe_check(self):
+        if not self._stale():
+            return
+        with self._lock:
+            # Compared with the pid, a check running in the parent when a worker forked does not block the worker
+            if self._checking == os.getpid() or not self._stale():
+                return
+            self._checking = os.getpid()
+        threading.Thread(target=self.check, name='replica-check', daemon=True).start()
+
+    def check(self):
+        """Measure the lag of every replica now"""
+        before = {key: self.healthy(key) for key in self.engines}
+        lags, errors = {}, {}
+        try:
+            beat = None
+            if any(engine.dialect.name != 'postgresql' for engine in self.engines.values()):
+                beat = self._beat()
+            for key, engine in self.engines.items():
+                try:
+                    lags[key] = self._measure(engine, beat)
+                except Exception as e:
+                    errors[key] = str(e)
+        except Exception as e:
+            # Without the primary's heartbeat no lag can be measured
+            errors = {key: f'heartbeat failed: {e}' for key in self.engines}
+        finally:
+            self._lag = {key: lags.get(key) for key in self.engines}
+            self._errors = errors
+            self._checked_at = time.monotonic()
+            self._checking = None
+        if self.logger is not None:
+            for key, was_healthy in before.items():
+                if self.healthy(key) != was_healthy:
+                    if self.healthy(key):
+                        self.logger.info(f'Read replica {key} is healthy (lag {self._lag[key]:.1f}s)')
+                    else:
+                        self.logger.warning(f'Read replica {key} is unhealthy (lag {self._lag[key]}, {errors.get(key)})')
+
+    def _beat(self):
+        """Rewrite the primary's heartbeat; returns the previous one, which caught-up replicas have"""
+        from models import ReplicaHeartbeat
+        table = ReplicaHeartbeat.__table__
+        with self.primary.begin() as connection:
+            previous = connection.execute(select(table.c.beat_at).where(table.c.id == 1)).scalar()
+            if previous is None:
+                connection.execute(insert(table).values(id=1, beat_at=datetime.utcnow()))
+            else:
+                connection.execute(update(table).where(table.c.id == 1).values(beat_at=datetime.utcnow()))
+        return previous
+
+    def _measure(self, engine, beat):
+        with engine.connect() as connection:
+            if engine.dialect.name == 'postgresql':
+                return float(connection.exec_driver_sql(PG_LAG_SQL).scalar() or 0)
+            if beat is None:
+                raise LookupError('no primary heartbeat yet')
+            from models import ReplicaHeartbeat
+            table = ReplicaHeartbeat.__table__
+            replica_beat = connection.execute(select(table.c.beat_at).where(table.c.id == 1)).scalar()
+            if replica_beat is None:
+                raise LookupError('the replica has no heartbeat')
+            return max((beat - replica_beat).total_seconds(), 0.0)
+
+    @property
+    def stale_window(self):
+        """How long after a write a replica that counts as healthy may still miss it (seconds).
+
+        A replica is picked on a lag measured up to one check interval ago,
+        and it may fall behind by up to another interval before the next
+        check marks it unhealthy.
+        """
+        return self.max_lag + 2 * self.check_interval
+
+    def healthy(self, key):
+        lag = self._lag.get(key)
+        if lag is None or lag > self.max_lag:
+            return False
+        # A check that stopped reporting (e.g. hangs on a dead replica) is no evidence of health
+        return self._checked_at is not None and time.monotonic() - self._checked_at < self.check_interval + self.max_lag
+
+    def choose(self):
+        """Bind key of a healthy replica for a new request, or None for the primary"""
+        if not self.engines:
+            return None
+        self._maybe_check()
+        healthy = [key for key in self.engines if self.healthy(key)]
+        if not healthy:
+            return None
+        return healthy[next(self._counter) % len(healthy)]
+
+    def status(self):
+        return {
+            key: {'healthy': self.healthy(key), 'lag_seconds': self._lag.get(key), 'error': self._errors.get(key)}
+            for key in self.engines
+        }
+
+    # ---------- Routing ----------
+
+    def engine_for(self, clause=None, flushing=False):
+        """The replica engine the current request reads from, or None for the primary"""
+        if not has_request_context():
+            return None
+        # No clause: session.connection(), whose caller may write through it
+        if flushing or clause is None or _is_write(clause):
+            # Everything after a write reads the primary, so the request sees its own writes
+            g.db_replica_pinned = True
+            return None
+        key = g.get('db_replica')
+        if key is None or g.get('db_replica_pinned'):
+            return None
+        return self.engines[key]
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """Flask-SQLAlchemy session that sends the reads of `@read_replica` views to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and replica_router.enabled:
+            engine = replica_router.engine_for(clause, self._flushing)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    """Let the view's reads go to a healthy replica (see the module docstring)"""
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if replica_router.enabled and 'db_replica' not in g:
+            g.db_replica = replica_router.choose()
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def use_primary():
+    """Send the rest of the current request to the primary"""
+    if has_request_context():
+        g.db_replica_pinned = True
+
+
+@contextmanager
+def primary():
+    """Run a block on the primary, e.g. reads that decide authorization"""
+    if not has_request_context():
+        yield
+        return
+    saved = g.pop('db_replica', None)
+    try:
+        yield
+    finally:
+        if saved is not None:
+            g.db_replica = saved
+
+
+def sync_sqlite_replicas(primary_engine, replica_engines):
+    """Copy a SQLite primary into SQLite replica files with the online backup API"""
+    if primary_engine.dialect.name != 'sqlite':
+        raise RuntimeError('replica-sync only copies SQLite databases; real replicas replicate themselves')
+    source = sqlite3.connect(primary_engine.url.database)
+    try:
+        for engine in replica_engines:
+            if engine.dialect.name != 'sqlite':
+                raise RuntimeError(f'{engine.url} is not a SQLite database')
+            target = sqlite3.connect(engine.url.database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+    finally:
+        source.close()
@@ -0,0 +1,158 @@
+"""Shared JSON response layer for the API blueprints.
+
+Encoding goes through orjson when it is installed and falls back to the
+standard library otherwise. Both handle Decimal and datetime values, so
+models can hand them over as-is instead of converting field by field.
+"""
+import itertools
+import json
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app, stream_with_context
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+JSON_MIMETYPE = 'application/json'
+
+# Lists longer than this are streamed by `json_stream` in chunks of this many items
+STREAM_CHUNK_SIZE = 200
+
+
+def _default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    ENCODER = 'orjson'
+
+    def dumps_bytes(value):
+        # orjson encodes naive datetimes exactly like isoformat(); Decimal goes through _default
+        return orjson.dumps(value, default=_default)
+
+    def loads(value):
+        return orjson.loads(value)
+else:
+    ENCODER = 'json'
+    _encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps_bytes(value):
+        return _encoder.encode(value).encode('utf-8')
+
+    def loads(value):
+        return json.loads(value)
+
+
+# Called with the seconds spent encoding each response body when request
+# instrumentation is enabled (see instrumentation.py)
+on_serialize = None
+
+
+def _encode(value):
+    if on_serialize is None:
+        return dumps_bytes(value)
+    started = time.perf_counter()
+    body = dumps_bytes(value)
+    on_serialize(time.perf_counter() - started)
+    return body
+
+
+def dumps(value):
+    return dumps_bytes(value).decode('utf-8')
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by the fast encoder, so `jsonify` uses it too"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(_encode(obj), mimetype=JSON_MIMETYPE)
+
+
+def json_response(success=True, data=None, message=None, errors=None, status_code=200, meta=None):
+    response = {'success': success}
+    if data is not None:
+        response['data'] = data
+    if meta is not None:
+        response['meta'] = meta
+    if message:
+        response['message'] = message
+    if errors:
+        response['errors'] = errors
+    return current_app.response_class(_encode(response), status=status_code, mimetype=JSON_MIMETYPE)
+
+
+def json_encoded_response(data, meta=None, message=None, status_code=200):
+    """Like `json_response(True, data=...)` for `data` that is already encoded JSON bytes"""
+    parts = [b'{"success":true,"data":', data]
+    if meta is not None:
+        parts.append(b',"meta":' + _encode(meta))
+    if message:
+        parts.append(b',"message":' + _encode(message))
+    parts.append(b'}')
+    return current_app.response_class(b''.join(parts), status=status_code, mimetype=JSON_MIMETYPE)
+
+
+def json_encoded_list_response(items, meta=None, message=None, status_code=200):
+    """Like `json_response(True, data=...)` for a list whose items are already encoded JSON bytes"""
+    return json_encoded_response(b'[' + b','.join(items) + b']', meta, message, status_code)
+
+
+def json_stream(items, serialize, meta=None, message=None, status_code=200):
+    """Stream `{"data": [...], "success": true}` without building the list in memory.
+
+    `items` can be any iterable (e.g. a query with `yield_per`); each item is
+    passed through `serialize` and encoded as it is produced. The first chunk
+    is encoded before the response starts, so a query that fails outright
+    raises in the view and gets its usual error response. A failure after
+    the status went out is logged, and the body still ends as valid JSON,
+    with `"success": false` and the error after the items already sent;
+    that is why "success" comes last here.
+    """
+    items = iter(items)
+    first_chunk = [_encode(serialize(item)) for item in itertools.islice(items, STREAM_CHUNK_SIZE)]
+
+    def generate():
+        yield b'{"data":[' + b','.join(first_chunk)
+        sent = bool(first_chunk)
+        chunk = []
+        try:
+            for item in items:
+                chunk.append(_encode(serialize(item)))
+                if len(chunk) >= STREAM_CHUNK_SIZE:
+                    yield (b',' if sent else b'') + b','.join(chunk)
+                    sent = True
+                    chunk = []
+            if chunk:
+                yield (b',' if sent else b'') + b','.join(chunk)
+        except Exception as e:
+            current_app.logger.exception('Streamed response failed after the body started')
+            if chunk:
+                yield (b',' if sent else b'') + b','.join(chunk)
+            yield b'],"success":false,"message":"Failed to stream the response","errors":' + dumps_bytes([str(e)]) + b'}'
+            return
+        yield b'],"success":true'
+        if meta is not None:
+            yield b',"meta":' + dumps_bytes(meta)
+        if message:
+            yield b',"message":' + dumps_bytes(message)
+        yield b'}'
+
+    return current_app.response_class(stream_with_context(generate()), status=status_code, mimetype=JSON_MIMETYPE)
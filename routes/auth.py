@@ -1,19 +1,79 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from app import db
+from flask import Blueprint, request
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, get_jwt
+from app import app, db, jwt
 from models import User
+from responses import json_response
+import threading
+import time
+import click
+from query_budget import query_budget
+from replicas import primary
 
 auth_bp = Blueprint('auth', __name__)
 
-def json_response(success=True, data=None, message=None, errors=None, status_code=200):
-    response = {'success': success}
-    if data is not None:
-        response['data'] = data
-    if message:
-        response['message'] = message
-    if errors:
-        response['errors'] = errors
-    return jsonify(response), status_code
+class TokenVersionCache:
+    """Per-process cache of the current token version of every user whose tokens were revoked.
+    
+    Users start at version 0 and are only bumped when their role changes or
+    their tokens are revoked, so the whole table of bumped users is small and
+    is reloaded with a single query once per TTL instead of once per request.
+    """
+    
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._versions = {}
+        self._expires_at = 0
+        self._lock = threading.Lock()
+    
+    def _refresh(self):
+        # Revocations are read from the primary, a lagging replica could still accept revoked tokens
+        with primary():
+            rows = db.session.query(User.id, User.token_version).filter(User.token_version > 0).all()
+        self._versions = {user_id: version for user_id, version in rows}
+        self._expires_at = time.monotonic() + self.ttl
+    
+    def get(self, user_id):
+        if time.monotonic() >= self._expires_at:
+            with self._lock:
+                if time.monotonic() >= self._expires_at:
+                    self._refresh()
+        return self._versions.get(user_id, 0)
+    
+    def set(self, user_id, version):
+        self._versions[user_id] = version
+
+token_versions = TokenVersionCache(ttl=app.config.get('JWT_TOKEN_VERSION_TTL', 30))
+
+def create_token(user):
+    """Access token carrying the user's role and token version as claims"""
+    return create_access_token(identity=str(user.id), additional_claims={
+        'role': user.role,
+        'ver': user.token_version or 0
+    })
+
+@jwt.token_in_blocklist_loader
+def is_token_revoked(jwt_header, jwt_payload):
+    # Tokens issued before role claims existed carry no version; admin_required checks those against the DB
+    if 'ver' not in jwt_payload:
+        return False
+    return jwt_payload['ver'] < token_versions.get(int(jwt_payload['sub']))
+
+def admin_required():
+    claims = get_jwt()
+    if 'role' in claims:
+        return claims['role'] == 'admin'
+    user_id = int(get_jwt_identity())
+    with primary():
+        user = User.query.get(user_id)
+    if not user or user.role != 'admin':
+        return False
+    return True
+
+def revoke_user_tokens(user):
+    """Invalidate every token issued to `user` so far (e.g. after a role change)"""
+    user.token_version = (user.token_version or 0) + 1
+    db.session.commit()
+    token_versions.set(user.id, user.token_version)
 
 @auth_bp.route('/register', methods=['POST'])
 def register():
@@ -36,7 +96,7 @@ def register():
         db.session.add(user)
         db.session.commit()
         
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_token(user)
         
         return json_response(True, data={
             'user': user.to_dict(),
@@ -60,7 +120,7 @@ def login():
         if not user or not user.check_password(data['password']):
             return json_response(False, message='Invalid credentials', errors=['Invalid email or password'], status_code=401)
         
-        access_token = create_access_token(identity=str(user.id))
+        access_token = create_token(user)
         
         return json_response(True, data={
             'user': user.to_dict(),
@@ -71,6 +131,7 @@ def login():
         return json_response(False, message='Login failed', errors=[str(e)], status_code=500)
 
 @auth_bp.route('/me', methods=['GET'])
+@query_budget(3)
 @jwt_required()
 def get_current_user():
     try:
@@ -85,3 +146,15 @@ def get_current_user():
     except Exception as e:
         return json_response(False, message='Failed to get user', errors=[str(e)], status_code=500)
 
+
+@auth_bp.cli.command('set-role')
+@click.argument('email')
+@click.argument('role', type=click.Choice(['customer', 'admin']))
+def set_role(email, role):
+    """Change a user's role and revoke their existing tokens"""
+    user = User.query.filter_by(email=email).first()
+    if not user:
+        raise click.ClickException(f'No user with email {email}')
+    user.role = role
+    revoke_user_tokens(user)
+    print(f'{email} is now {role}; existing tokens revoked')
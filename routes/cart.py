@@ -0,0 +1,156 @@
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app import db
+from responses import json_response
+from inventory import normalize_items, ReservationError
+from cart import (
+    add_item, set_quantity, remove_item, replace_items, clear, parse_quantity,
+    price_cart, issue_quote, CartError
+)
+from query_budget import query_budget
+
+cart_bp = Blueprint('cart', __name__)
+
+def cart_response(user_id, message=None, status_code=200):
+    """The priced cart, returned by every cart endpoint"""
+    cart = price_cart(user_id, request.args.get('lang', 'en'))
+    return json_response(True, data=cart, message=message, status_code=status_code)
+
+def cart_error(e):
+    db.session.rollback()
+    return json_response(False, message=e.message, errors=e.errors, status_code=e.status_code)
+
+@cart_bp.route('', methods=['GET'])
+@query_budget(3)
+@jwt_required()
+def get_cart():
+    try:
+        return cart_response(int(get_jwt_identity()))
+    except Exception as e:
+        return json_response(False, message='Failed to fetch cart', errors=[str(e)], status_code=500)
+
+@cart_bp.route('', methods=['PUT'])
+@query_budget(6)
+@jwt_required()
+def replace_cart():
+    """Replace the whole cart, e.g. with the guest cart kept by the frontend before login"""
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json()
+        if not data or not isinstance(data.get('items'), list):
+            return json_response(False, message='Missing required fields', errors=['items is required'], status_code=400)
+
+        try:
+            quantities = normalize_items(data['items'])
+            for quantity in quantities.values():
+                parse_quantity(quantity)
+            replace_items(user_id, quantities)
+        except ReservationError as e:
+            return json_response(False, message=e.message, errors=e.errors, status_code=400)
+        except CartError as e:
+            return cart_error(e)
+
+        db.session.commit()
+        return cart_response(user_id, message='Cart updated')
+
+    except Exception as e:
+        db.session.rollback()
+        return json_response(False, message='Failed to update cart', errors=[str(e)], status_code=500)
+
+@cart_bp.route('', methods=['DELETE'])
+@query_budget(4)
+@jwt_required()
+def clear_cart():
+    try:
+        user_id = int(get_jwt_identity())
+        clear(user_id)
+        db.session.commit()
+        return cart_response(user_id, message='Cart cleared')
+
+    except Exception as e:
+        db.session.rollback()
+        return json_response(False, message='Failed to clear cart', errors=[str(e)], status_code=500)
+
+@cart_bp.route('/items', methods=['POST'])
+@query_budget(8)
+@jwt_required()
+def add_cart_item():
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json()
+        if not data or data.get('product_id') is None:
+            return json_response(False, message='Missing required fields', errors=['product_id is required'], status_code=400)
+
+        try:
+            try:
+                product_id = int(data['product_id'])
+            except (TypeError, ValueError):
+                raise CartError('Invalid product', ['product_id must be an integer'])
+            add_item(user_id, product_id, parse_quantity(data.get('quantity', 1)))
+        except CartError as e:
+            return cart_error(e)
+
+        db.session.commit()
+        return cart_response(user_id, message='Item added', status_code=201)
+
+    except Exception as e:
+        db.session.rollback()
+        return json_response(False, message='Failed to add item', errors=[str(e)], status_code=500)
+
+@cart_bp.route('/items/<int:product_id>', methods=['PUT'])
+@query_budget(4)
+@jwt_required()
+def update_cart_item(product_id):
+    try:
+        user_id = int(get_jwt_identity())
+        data = request.get_json()
+        if not data or 'quantity' not in data:
+            return json_response(False, message='Missing required fields', errors=['quantity is required'], status_code=400)
+
+        try:
+            updated = set_quantity(user_id, product_id, parse_quantity(data['quantity'], allow_zero=True))
+        except CartError as e:
+            return cart_error(e)
+        if not updated:
+            db.session.rollback()
+            return json_response(False, message='Item not in cart', status_code=404)
+
+        db.session.commit()
+        return cart_response(user_id, message='Cart updated')
+
+    except Exception as e:
+        db.session.rollback()
+        return json_response(False, message='Failed to update item', errors=[str(e)], status_code=500)
+
+@cart_bp.route('/items/<int:product_id>', methods=['DELETE'])
+@query_budget(4)
+@jwt_required()
+def remove_cart_item(product_id):
+    try:
+        user_id = int(get_jwt_identity())
+        if not remove_item(user_id, product_id):
+            db.session.rollback()
+            return json_response(False, message='Item not in cart', status_code=404)
+
+        db.session.commit()
+        return cart_response(user_id, message='Item removed')
+
+    except Exception as e:
+        db.session.rollback()
+        return json_response(False, message='Failed to remove item', errors=[str(e)], status_code=500)
+
+@cart_bp.route('/quote', methods=['POST'])
+@query_budget(3)
+@jwt_required()
+def quote_cart():
+    """Price the cart and check stock; an available cart gets a quote_token for POST /api/orders"""
+    try:
+        quote = issue_quote(int(get_jwt_identity()), request.args.get('lang', 'en'))
+        if not quote['lines']:
+            return json_response(False, data=quote, message='Cart is empty', status_code=400)
+        if not quote['valid']:
+            return json_response(False, data=quote, message='Some items are unavailable', errors=quote['errors'], status_code=409)
+        return json_response(True, data=quote)
+
+    except Exception as e:
+        return json_response(False, message='Failed to quote cart', errors=[str(e)], status_code=500)
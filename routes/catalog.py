@@ -1,31 +1,28 @@
-from flask import Blueprint, request, jsonify, send_from_directory
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from werkzeug.utils import secure_filename
+from flask import Blueprint, request
+from flask_jwt_extended import jwt_required
 from app import db, app
-from models import Category, Product, ProductImage, User
-import os
+from models import Category, Product, ProductImage, CartItem
+from responses import json_response, json_encoded_response, json_encoded_list_response, dumps_bytes
+from routes.auth import admin_required
 from decimal import Decimal, InvalidOperation
+from datetime import datetime
+from pagination import parse_limit, paginate_keyset, paginate_ranked, keyset_order, in_ids, InvalidCursor
+from cache import catalog_cache, cached_catalog_view, cached_fragments, depends_on_stock
+from search import search_index, suggest_index
+from images import probe as probe_image, strip_metadata, available as images_available
+from storage import upload_storage, stage_upload, store_upload, reuse_derivatives, release, delete_files, url_for_path
+from tasks import enqueue, task_worker
+from summaries import product_summaries, CARD_FIELDS
+from facets import facet_index, parse_filters as parse_facet_filters, InvalidFacetFilter
+from query_budget import query_budget
+from replicas import read_replica
 
 catalog_bp = Blueprint('catalog', __name__)
 
-def json_response(success=True, data=None, message=None, errors=None, status_code=200):
-    response = {'success': success}
-    if data is not None:
-        response['data'] = data
-    if message:
-        response['message'] = message
-    if errors:
-        response['errors'] = errors
-    return jsonify(response), status_code
-
-def admin_required():
-    user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    if not user or user.role != 'admin':
-        return False
-    return True
-
 @catalog_bp.route('/categories', methods=['GET'])
+@query_budget(2)
+@read_replica
+@cached_catalog_view('categories', args=('lang',), defaults={'lang': 'en'})
 def get_categories():
     try:
         lang = request.args.get('lang', 'en')
@@ -56,6 +53,8 @@ def create_category():
         
         db.session.add(category)
         db.session.commit()
+        catalog_cache.bump_version()
+        suggest_index.index_category(category)
         
         return json_response(True, data=category.to_dict(), message='Category created', status_code=201)
     
@@ -64,6 +63,15 @@ def create_category():
         return json_response(False, message='Failed to create category', errors=[str(e)], status_code=500)
 
 @catalog_bp.route('/products', methods=['GET'])
+# Holds at any catalog size for paginated listings. Unpaged full listings load
+# images with selectinload, one query per 500 products, so they only fit it
+# on catalogs of up to a few thousand products.
+@query_budget(10)
+@read_replica
+@cached_catalog_view('products', args=(
+    'lang', 'search', 'category', 'minPrice', 'maxPrice', 'sort', 'featured', 'limit', 'cursor',
+    'view', 'fields'
+), defaults={'lang': 'en'})
 def get_products():
     try:
         lang = request.args.get('lang', 'en')
@@ -71,20 +79,26 @@ def get_products():
         category_id = request.args.get('category')
         min_price = request.args.get('minPrice')
         max_price = request.args.get('maxPrice')
-        sort = request.args.get('sort', 'newest')
+        # Search results are ranked by relevance unless a sort is requested
+        sort = request.args.get('sort', 'relevance' if search else 'newest')
         featured = request.args.get('featured')
+        cursor = request.args.get('cursor')
+        
+        try:
+            limit = parse_limit(request.args.get('limit'))
+        except ValueError as e:
+            return json_response(False, message='Invalid limit', errors=[str(e)], status_code=400)
+        
+        try:
+            fields = Product.resolve_fields(request.args.get('view'), request.args.get('fields'))
+        except ValueError as e:
+            return json_response(False, message='Invalid projection', errors=[str(e)], status_code=400)
         
         query = Product.query
         
-        if search:
-            query = query.filter(
-                db.or_(
-                    Product.name_en.ilike(f'%{search}%'),
-                    Product.name_ar.ilike(f'%{search}%'),
-                    Product.description_en.ilike(f'%{search}%'),
-                    Product.description_ar.ilike(f'%{search}%')
-                )
-            )
+        # A relevance ranking is filtered by paginate_ranked below, a window of the ranking at a time
+        if search and sort != 'relevance':
+            query = query.filter(search_index.filter_clause(search))
         
         if category_id:
             query = query.filter(Product.category_id == category_id)
@@ -98,52 +112,214 @@ def get_products():
         if featured == 'true':
             query = query.filter(Product.is_featured == True)
         
-        if sort == 'price_asc':
-            query = query.order_by(Product.price.asc())
-        elif sort == 'price_desc':
-            query = query.order_by(Product.price.desc())
-        else:  # newest
-            query = query.order_by(Product.created_at.desc())
+        # Card listings are served from the precomputed summaries, without
+        # hydrating ORM objects
+        use_summaries = fields == CARD_FIELDS and product_summaries.ready()
+        
+        # Otherwise only the columns and relationships the projection needs are loaded.
+        # Collections use selectinload, which keeps LIMIT on the products query.
+        load_options = Product.load_options(fields, lang)
+        
+        if sort == 'relevance' and search:
+            page_ids, next_cursor = paginate_ranked(
+                query, Product.id, lambda count, offset: search_index.ranked(search, count, offset),
+                sort, limit, cursor
+            )
+            page_query = Product.query.filter(in_ids(Product.id, page_ids))
+            if use_summaries:
+                by_id = {row.id: row for row in product_summaries.card_query(page_query, lang)}
+            else:
+                by_id = {p.id: p for p in page_query.options(*load_options)}
+            products = [by_id[pid] for pid in page_ids if pid in by_id]
+        else:
+            if use_summaries:
+                query = product_summaries.card_query(query, lang)
+            else:
+                query = query.options(*load_options)
+            
+            if sort == 'price_asc':
+                sort_column, sort_type, descending = Product.price, Decimal, False
+            elif sort == 'price_desc':
+                sort_column, sort_type, descending = Product.price, Decimal, True
+            else:  # newest
+                sort = 'newest'
+                sort_column, sort_type, descending = Product.created_at, datetime, True
+            
+            if limit is None:
+                products = query.order_by(*keyset_order(sort_column, Product.id, descending)).all()
+            else:
+                products, next_cursor = paginate_keyset(
+                    query, sort_column, Product.id, sort, sort_type, descending, limit, cursor
+                )
+        
+        # Without a limit the full list is returned, as before
+        meta = None if limit is None else {'limit': limit, 'next_cursor': next_cursor}
         
-        # Eager load images to avoid N+1 queries
-        from sqlalchemy.orm import joinedload
-        products = query.options(joinedload(Product.images)).all()
+        if use_summaries:
+            depends_on_stock({row.id: row.stock for row in products})
+            return json_encoded_list_response(product_summaries.render(products, lang), meta=meta)
         
-        return json_response(True, data=[p.to_dict(lang) for p in products])
+        if fields is None or 'stock' in fields:
+            depends_on_stock({p.id: p.stock for p in products})
+        data = [p.to_dict(lang, fields) for p in products]
+        return json_response(True, data=data, meta=meta)
     
+    except InvalidCursor as e:
+        return json_response(False, message='Invalid cursor', errors=[str(e)], status_code=400)
     except Exception as e:
         return json_response(False, message='Failed to fetch products', errors=[str(e)], status_code=500)
 
+@catalog_bp.route('/products/facets', methods=['GET'])
+@query_budget(10)
+@read_replica
+@cached_catalog_view('facets', args=(
+    'lang', 'search', 'category', 'minPrice', 'maxPrice', 'featured', 'inStock', 'bins'
+), defaults={'lang': 'en'})
+def product_facets():
+    try:
+        lang = request.args.get('lang', 'en')
+        try:
+            filters = parse_facet_filters(request.args)
+        except InvalidFacetFilter as e:
+            return json_response(False, message='Invalid filter', errors=[str(e)], status_code=400)
+        
+        return json_response(True, data=facet_index.facets(filters, lang))
+    
+    except Exception as e:
+        return json_response(False, message='Failed to fetch facets', errors=[str(e)], status_code=500)
+
+@catalog_bp.route('/products/suggest', methods=['GET'])
+# Only the catalog version is read; the index is built outside requests
+@query_budget(1)
+@read_replica
+def suggest_products():
+    try:
+        query = request.args.get('q', '')
+        lang = request.args.get('lang', 'en')
+        try:
+            limit = parse_limit(request.args.get('limit'), default=8, maximum=20)
+        except ValueError as e:
+            return json_response(False, message='Invalid limit', errors=[str(e)], status_code=400)
+        
+        return json_response(True, data=suggest_index.suggest(query, lang, limit))
+    
+    except Exception as e:
+        return json_response(False, message='Failed to fetch suggestions', errors=[str(e)], status_code=500)
+
 @catalog_bp.route('/products/<int:product_id>', methods=['GET'])
+@query_budget(4)
+@read_replica
+@cached_catalog_view('product', args=('lang', 'view', 'fields'), defaults={'lang': 'en'})
 def get_product(product_id):
     try:
         lang = request.args.get('lang', 'en')
-        product = Product.query.get(product_id)
+        
+        try:
+            fields = Product.resolve_fields(request.args.get('view'), request.args.get('fields'))
+        except ValueError as e:
+            return json_response(False, message='Invalid projection', errors=[str(e)], status_code=400)
+        
+        product = _product_fragments([product_id], lang, fields).get(product_id)
         
         if not product:
             return json_response(False, message='Product not found', status_code=404)
         
-        return json_response(True, data=product.to_dict(lang))
+        return json_encoded_response(product)
     
     except Exception as e:
         return json_response(False, message='Failed to fetch product', errors=[str(e)], status_code=500)
 
+# Upper bound on ids per batch request
+MAX_BATCH_IDS = 500
+
+def _product_fragments(ids, lang, fields):
+    """Encoded product documents by id, shared through the catalog cache by
+    the single-product and batch endpoints"""
+    def load(missing):
+        products = Product.query.options(*Product.load_options(fields, lang)).filter(Product.id.in_(missing)).all()
+        if fields is None or 'stock' in fields:
+            depends_on_stock({p.id: p.stock for p in products})
+        return {p.id: dumps_bytes(p.to_dict(lang, fields)) for p in products}
+    params = f'lang={lang}|fields={",".join(fields) if fields else ""}'
+    return cached_fragments('product-item', ids, params, load)
+
+def _parse_ids(raw):
+    """Product ids from a comma-separated string or a JSON list, deduplicated in order"""
+    if isinstance(raw, str):
+        raw = [part for part in raw.split(',') if part.strip()]
+    if not isinstance(raw, list):
+        raise ValueError('ids must be a list of product ids')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw))
+    except (TypeError, ValueError):
+        raise ValueError('ids must be integers')
+    if not ids:
+        raise ValueError('ids is required')
+    if len(ids) > MAX_BATCH_IDS:
+        raise ValueError(f'At most {MAX_BATCH_IDS} ids per request')
+    return ids
+
+def _batch_response(raw_ids, options):
+    lang = options.get('lang', 'en')
+    
+    try:
+        ids = _parse_ids(raw_ids)
+    except ValueError as e:
+        return json_response(False, message='Invalid ids', errors=[str(e)], status_code=400)
+    
+    try:
+        fields = Product.resolve_fields(options.get('view'), options.get('fields'))
+    except ValueError as e:
+        return json_response(False, message='Invalid projection', errors=[str(e)], status_code=400)
+    
+    products = _product_fragments(ids, lang, fields)
+    
+    # Requested order; unknown ids are reported rather than failing the request
+    return json_encoded_list_response(
+        [products[pid] for pid in ids if pid in products],
+        meta={'missing': [pid for pid in ids if pid not in products]}
+    )
+
+@catalog_bp.route('/products/batch', methods=['GET'])
+@query_budget(4)
+@read_replica
+@cached_catalog_view('products-batch', args=('ids', 'lang', 'view', 'fields'), defaults={'lang': 'en'})
+def get_products_batch():
+    """Several products in one request: ?ids=1,2,3"""
+    try:
+        return _batch_response(request.args.get('ids', ''), request.args)
+    except Exception as e:
+        return json_response(False, message='Failed to fetch products', errors=[str(e)], status_code=500)
+
+@catalog_bp.route('/products/batch', methods=['POST'])
+@query_budget(4)
+@read_replica
+def post_products_batch():
+    """Same as GET /products/batch for id lists too long for a URL: {"ids": [...], "lang": ..., "view": ...}"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return json_response(False, message='Invalid ids', errors=['Request body must be a JSON object with ids'], status_code=400)
+        options = {**request.args.to_dict(), **data}
+        # JSON bodies may list the fields; the query string form is comma-separated
+        if isinstance(options.get('fields'), list) and all(isinstance(field, str) for field in options['fields']):
+            options['fields'] = ','.join(options['fields'])
+        invalid = [name for name in ('lang', 'view', 'fields') if options.get(name) is not None and not isinstance(options[name], str)]
+        if invalid:
+            return json_response(False, message='Invalid projection', errors=[
+                f'{name} must be a string' + (' or a list of strings' if name == 'fields' else '') for name in invalid
+            ], status_code=400)
+        return _batch_response(data.get('ids'), options)
+    except Exception as e:
+        return json_response(False, message='Failed to fetch products', errors=[str(e)], status_code=500)
+
 @catalog_bp.route('/products', methods=['POST'])
 @jwt_required()
 def create_product():
     try:
-        print("=== PRODUCT CREATION REQUEST ===")
-        print(f"Content-Type: {request.content_type}")
-        print(f"Method: {request.method}")
-        print(f"Has JSON: {request.is_json}")
-        print(f"Raw data length: {len(request.data) if request.data else 0}")
-        
         if not admin_required():
-            print("Admin check failed")
             return json_response(False, message='Admin access required', status_code=403)
         
-        print("Admin check passed")
-        
         # Try to get JSON data with better error handling
         data = None
         try:
@@ -152,35 +328,23 @@ def create_product():
             else:
                 # Try to force parse
                 data = request.get_json(force=True, silent=True)
-            print(f"Parsed JSON: {data}")
         except Exception as json_error:
-            print(f"JSON parsing error: {json_error}")
-            import traceback
-            traceback.print_exc()
+            app.logger.info(f'Create product: invalid JSON ({request.content_type}): {json_error}')
             return json_response(False, message='Invalid JSON format', errors=[str(json_error)], status_code=400)
         
         if not data:
-            print("No data in request")
-            print(f"Request data: {request.data}")
-            print(f"Request form: {request.form}")
+            app.logger.info(f'Create product: no JSON body ({request.content_type}, {request.content_length or 0} bytes)')
             return json_response(False, message='No JSON data provided', errors=['Request body must contain JSON'], status_code=400)
         
-        print(f"Processing data: {data}")
-        print(f"Data type: {type(data)}")
-        print(f"Data keys: {list(data.keys()) if isinstance(data, dict) else 'Not a dict'}")
-        print(f"Data type: {type(data)}")
-        print(f"Data keys: {list(data.keys()) if data else 'None'}")
-        
         required_fields = ['name_en', 'price', 'sku', 'category_id']
         missing_fields = []
         for field in required_fields:
             value = data.get(field)
-            print(f"Field {field}: {value} (type: {type(value)})")
             if value is None or value == '' or (field == 'category_id' and (value == 'null' or str(value).lower() == 'null')):
                 missing_fields.append(field)
         
         if missing_fields:
-            print(f"Missing fields: {missing_fields}")
+            app.logger.info(f'Create product: missing fields {missing_fields}')
             return json_response(False, message='Missing required fields', errors=[f'{field} is required' for field in missing_fields], status_code=400)
         
         # Auto-fill Arabic fields with English values if not provided
@@ -191,28 +355,21 @@ def create_product():
         
         # Validate category_id is not null/empty
         category_id = data.get('category_id')
-        print(f"Category ID raw: {category_id} (type: {type(category_id)})")
         
         if category_id is None or category_id == '' or str(category_id).lower() == 'null':
-            print("Category ID is null or empty")
             return json_response(False, message='Invalid category', errors=['category_id is required and cannot be null'], status_code=400)
         
         # Convert to int if it's a string
         try:
             category_id = int(category_id)
-            print(f"Category ID converted to int: {category_id}")
-        except (ValueError, TypeError) as e:
-            print(f"Category ID conversion error: {e}")
+        except (ValueError, TypeError):
             return json_response(False, message='Invalid category', errors=[f'category_id must be a valid number. Got: {category_id}'], status_code=400)
         
         # Validate category exists
         category = Category.query.get(category_id)
         if not category:
-            print(f"Category {category_id} not found in database")
             return json_response(False, message='Invalid category', errors=[f'Category with id {category_id} does not exist'], status_code=400)
         
-        print(f"Category found: {category.name_en}")
-        
         # Check if SKU already exists
         if Product.query.filter_by(sku=data['sku']).first():
             return json_response(False, message='SKU already exists', errors=[f'Product with SKU {data["sku"]} already exists'], status_code=400)
@@ -252,13 +409,15 @@ def create_product():
         
         db.session.add(product)
         db.session.commit()
+        catalog_cache.bump_version()
+        search_index.index_product(product)
+        suggest_index.index_product(product)
         
         return json_response(True, data=product.to_dict(), message='Product created', status_code=201)
     
     except Exception as e:
         db.session.rollback()
-        import traceback
-        traceback.print_exc()
+        app.logger.exception('Failed to create product')
         return json_response(False, message='Failed to create product', errors=[str(e)], status_code=500)
 
 @catalog_bp.route('/products/<int:product_id>', methods=['PUT'])
@@ -306,6 +465,9 @@ def update_product(product_id):
             product.is_featured = data['is_featured']
         
         db.session.commit()
+        catalog_cache.bump_version()
+        search_index.index_product(product)
+        suggest_index.index_product(product)
         
         return json_response(True, data=product.to_dict(), message='Product updated')
     
@@ -324,8 +486,17 @@ def delete_product(product_id):
         if not product:
             return json_response(False, message='Product not found', status_code=404)
         
+        unused_files = [path for image in list(product.images) for path in release(image)]
+        # release() deleted the images; keep the cascade from deleting them again
+        db.session.flush()
+        db.session.expire(product, ['images'])
+        CartItem.query.filter_by(product_id=product_id).delete(synchronize_session=False)
         db.session.delete(product)
         db.session.commit()
+        delete_files(unused_files)
+        catalog_cache.bump_version()
+        search_index.remove_product(product_id)
+        suggest_index.remove_product(product_id)
         
         return json_response(True, message='Product deleted')
     
@@ -356,24 +527,41 @@ def upload_product_image(product_id):
         if file.filename == '' or not allowed_file(file.filename):
             return json_response(False, message='Invalid file', status_code=400)
         
-        filename = secure_filename(file.filename)
-        # Create unique filename
-        import uuid
-        unique_filename = f"{uuid.uuid4()}_{filename}"
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(filepath)
+        extension = file.filename.rsplit('.', 1)[1].lower()
+        # Streamed to a staging file and hashed in one pass
+        staged = stage_upload(file)
         
-        # Store relative URL
-        image_url = f"/api/uploads/{unique_filename}"
+        # The header is validated first; derivatives are generated by a background job
+        try:
+            width, height = probe_image(staged.path)
+            # The original stays public at image.url, so its EXIF (camera, GPS) data goes now
+            strip_metadata(staged.path)
+        except (OSError, ValueError) as e:
+            staged.discard()
+            return json_response(False, message='Invalid image', errors=[str(e)], status_code=400)
+        staged.rehash()
+        
+        # Identical bytes are stored once
+        blob, created = store_upload(staged, extension)
         
         image = ProductImage(
             product_id=product_id,
-            url=image_url,
-            alt_text=request.form.get('alt_text', product.name_en)
+            url=url_for_path(blob.path),
+            blob_hash=blob.hash,
+            alt_text=request.form.get('alt_text', product.name_en),
+            width=width,
+            height=height,
+            status='pending' if images_available() else 'ready'
         )
         
         db.session.add(image)
+        db.session.flush()
+        if image.status == 'pending' and (created or not reuse_derivatives(image)):
+            enqueue('process_image', image_id=image.id)
         db.session.commit()
+        task_worker.wake()
+        catalog_cache.bump_version()
+        suggest_index.index_product(product)
         
         return json_response(True, data=image.to_dict(), message='Image uploaded', status_code=201)
     
@@ -396,17 +584,12 @@ def delete_product_image(product_id, image_id):
         if not image:
             return json_response(False, message='Image not found', status_code=404)
         
-        # Delete the file from filesystem
-        try:
-            filename = image.url.split('/')[-1]
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if os.path.exists(filepath):
-                os.remove(filepath)
-        except Exception as e:
-            print(f"Warning: Could not delete file {filepath}: {e}")
-        
-        db.session.delete(image)
+        # Files are only removed once no other image shares them
+        unused_files = release(image)
         db.session.commit()
+        delete_files(unused_files)
+        catalog_cache.bump_version()
+        suggest_index.index_product(product)
         
         return json_response(True, message='Image deleted')
     
@@ -414,7 +597,7 @@ def delete_product_image(product_id, image_id):
         db.session.rollback()
         return json_response(False, message='Failed to delete image', errors=[str(e)], status_code=500)
 
-@catalog_bp.route('/uploads/<filename>')
+@catalog_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
-
+    # Local storage sends the file; S3 storage redirects to the bucket
+    return upload_storage.serve(filename)
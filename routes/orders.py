@@ -1,27 +1,73 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app import db
-from models import Order, OrderItem, Product, User
+from models import Order, OrderItem, Product
+from responses import json_response, json_stream
+from routes.auth import admin_required
+from inventory import normalize_items, reserve_stock, reserve_quoted_stock, ReservationError
+from cart import verify_quote, redeem_quote, QuoteError
 from decimal import Decimal
+from datetime import datetime, timedelta
+from cache import catalog_cache
+from pagination import parse_limit, paginate_keyset, keyset_order, InvalidCursor
+from query_budget import query_budget
+from replicas import read_replica
 
 orders_bp = Blueprint('orders', __name__)
 
-def json_response(success=True, data=None, message=None, errors=None, status_code=200):
-    response = {'success': success}
-    if data is not None:
-        response['data'] = data
-    if message:
-        response['message'] = message
-    if errors:
-        response['errors'] = errors
-    return jsonify(response), status_code
+ORDER_STATUSES = ['pending', 'paid', 'shipped', 'delivered', 'cancelled']
 
-def admin_required():
-    user_id = int(get_jwt_identity())
-    user = User.query.get(user_id)
-    if not user or user.role != 'admin':
-        return False
-    return True
+def parse_date_arg(name, end_of_day=False):
+    """Parse an ISO date/datetime query arg; a bare `to` date includes the whole day"""
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        value = datetime.fromisoformat(raw)
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO date or datetime')
+    if end_of_day and len(raw) == 10:
+        value += timedelta(days=1)
+    return value
+
+def list_orders(query):
+    """Apply the shared listing filters and pagination to an Order query"""
+    status = request.args.get('status')
+    if status:
+        if status not in ORDER_STATUSES:
+            return json_response(False, message='Invalid status', errors=[f'Status must be one of: {", ".join(ORDER_STATUSES)}'], status_code=400)
+        query = query.filter(Order.status == status)
+    
+    try:
+        date_from = parse_date_arg('from')
+        date_to = parse_date_arg('to', end_of_day=True)
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return json_response(False, message='Invalid filter', errors=[str(e)], status_code=400)
+    
+    if date_from:
+        query = query.filter(Order.created_at >= date_from)
+    if date_to:
+        query = query.filter(Order.created_at < date_to)
+    
+    query = query.options(*Order.listing_options())
+    
+    # Without a limit the full list is streamed, as before
+    if limit is None:
+        query = query.order_by(*keyset_order(Order.created_at, Order.id, True))
+        return json_stream(query.yield_per(200), Order.to_dict)
+    
+    try:
+        orders, next_cursor = paginate_keyset(
+            query, Order.created_at, Order.id, 'newest', datetime, True, limit, request.args.get('cursor')
+        )
+    except InvalidCursor as e:
+        return json_response(False, message='Invalid cursor', errors=[str(e)], status_code=400)
+    
+    return json_response(True, data=[order.to_dict() for order in orders], meta={
+        'limit': limit,
+        'next_cursor': next_cursor
+    })
 
 @orders_bp.route('', methods=['POST'])
 @jwt_required()
@@ -30,43 +76,51 @@ def create_order():
         user_id = int(get_jwt_identity())
         data = request.get_json()
         
-        if not data or not data.get('items') or not data.get('shipping'):
-            return json_response(False, message='Missing required fields', errors=['items and shipping are required'], status_code=400)
+        quote_token = data.get('quote_token') if data else None
+        if not data or not (data.get('items') or quote_token) or not data.get('shipping'):
+            return json_response(False, message='Missing required fields', errors=['items (or quote_token) and shipping are required'], status_code=400)
         
         shipping = data['shipping']
         required_shipping = ['name', 'phone', 'city', 'street']
         if not all(shipping.get(field) for field in required_shipping):
             return json_response(False, message='Missing shipping fields', errors=[f'{field} is required' for field in required_shipping if not shipping.get(field)], status_code=400)
         
-        items = data['items']
-        if not items:
-            return json_response(False, message='Order must have at least one item', status_code=400)
+        try:
+            if quote_token:
+                # Prices come from the quote; only stock is taken from the products
+                nonce, quoted = verify_quote(quote_token, user_id)
+                quantities = {product_id: quantity for product_id, (quantity, _) in quoted.items()}
+                if data.get('items') and normalize_items(data['items']) != quantities:
+                    raise QuoteError('The order items do not match the quote')
+                # Before any stock is taken, so a reused token changes nothing
+                redeem_quote(user_id, nonce, quantities)
+                reserve_quoted_stock(quantities)
+                prices = {product_id: unit_price for product_id, (_, unit_price) in quoted.items()}
+            else:
+                quantities = normalize_items(data['items'])
+                products = reserve_stock(quantities)
+                prices = {product_id: Decimal(str(product.price)) for product_id, product in products.items()}
+        except QuoteError as e:
+            db.session.rollback()
+            return json_response(False, message='Quote is no longer valid', errors=[str(e), 'Request a new quote from /api/cart/quote'], status_code=409)
+        except ReservationError as e:
+            db.session.rollback()
+            return json_response(False, data={'lines': e.lines} if e.lines else None, message=e.message, errors=e.errors, status_code=e.status_code)
         
         total = Decimal('0.00')
         order_items = []
         
-        for item_data in items:
-            product = Product.query.get(item_data['product_id'])
-            if not product:
-                return json_response(False, message=f'Product {item_data["product_id"]} not found', status_code=400)
-            
-            if product.stock < item_data['quantity']:
-                return json_response(False, message=f'Insufficient stock for {product.name_en}', status_code=400)
-            
-            unit_price = Decimal(str(product.price))
-            line_total = unit_price * item_data['quantity']
+        for product_id, quantity in quantities.items():
+            unit_price = prices[product_id]
+            line_total = unit_price * quantity
             total += line_total
             
-            order_item = OrderItem(
-                product_id=product.id,
-                quantity=item_data['quantity'],
+            order_items.append(OrderItem(
+                product_id=product_id,
+                quantity=quantity,
                 unit_price=unit_price,
                 line_total=line_total
-            )
-            order_items.append(order_item)
-            
-            # Update stock
-            product.stock -= item_data['quantity']
+            ))
         
         order = Order(
             user_id=user_id,
@@ -84,7 +138,14 @@ def create_order():
         
         db.session.add(order)
         db.session.commit()
-        
+        # Cached product documents check their stock when served (see cache.py), but the
+        # in-stock facet counts span every product: only an order that sells a product out
+        # invalidates the catalog
+        if Product.query.filter(Product.id.in_(list(quantities)), Product.stock <= 0).count():
+            catalog_cache.bump_version()
+        
+        # Reload with the listing options so to_dict does not lazy-load each line's product
+        order = Order.query.options(*Order.listing_options()).populate_existing().filter_by(id=order.id).one()
         return json_response(True, data=order.to_dict(), message='Order created', status_code=201)
     
     except Exception as e:
@@ -92,32 +153,41 @@ def create_order():
         return json_response(False, message='Failed to create order', errors=[str(e)], status_code=500)
 
 @orders_bp.route('/my', methods=['GET'])
+@query_budget(6)
+@read_replica
 @jwt_required()
 def get_my_orders():
     try:
         user_id = int(get_jwt_identity())
-        orders = Order.query.filter_by(user_id=user_id).order_by(Order.created_at.desc()).all()
-        
-        return json_response(True, data=[order.to_dict() for order in orders])
+        return list_orders(Order.query.filter_by(user_id=user_id))
     
     except Exception as e:
         return json_response(False, message='Failed to fetch orders', errors=[str(e)], status_code=500)
 
 @orders_bp.route('', methods=['GET'])
+@query_budget(6)
+@read_replica
 @jwt_required()
 def get_all_orders():
     try:
         if not admin_required():
             return json_response(False, message='Admin access required', status_code=403)
         
-        orders = Order.query.order_by(Order.created_at.desc()).all()
+        query = Order.query
+        user_id = request.args.get('user_id')
+        if user_id:
+            try:
+                query = query.filter(Order.user_id == int(user_id))
+            except ValueError:
+                return json_response(False, message='Invalid filter', errors=['user_id must be an integer'], status_code=400)
         
-        return json_response(True, data=[order.to_dict() for order in orders])
+        return list_orders(query)
     
     except Exception as e:
         return json_response(False, message='Failed to fetch orders', errors=[str(e)], status_code=500)
 
 @orders_bp.route('/<int:order_id>/status', methods=['PUT'])
+@query_budget(8)
 @jwt_required()
 def update_order_status(order_id):
     try:
@@ -132,13 +202,13 @@ def update_order_status(order_id):
         if not data or not data.get('status'):
             return json_response(False, message='Status is required', status_code=400)
         
-        valid_statuses = ['pending', 'paid', 'shipped', 'delivered', 'cancelled']
-        if data['status'] not in valid_statuses:
-            return json_response(False, message='Invalid status', errors=[f'Status must be one of: {", ".join(valid_statuses)}'], status_code=400)
+        if data['status'] not in ORDER_STATUSES:
+            return json_response(False, message='Invalid status', errors=[f'Status must be one of: {", ".join(ORDER_STATUSES)}'], status_code=400)
         
         order.status = data['status']
         db.session.commit()
         
+        order = Order.query.options(*Order.listing_options()).populate_existing().filter_by(id=order_id).one()
         return json_response(True, data=order.to_dict(), message='Order status updated')
     
     except Exception as e:
@@ -1,5 +1,8 @@
 #!/usr/bin/env python
-"""Script to run the Flask application"""
+"""Script to run the Flask application with the development server.
+
+In production run gunicorn instead: gunicorn app:app (see gunicorn.conf.py)
+"""
 from app import app
 
 if __name__ == '__main__':
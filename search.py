@@ -0,0 +1,622 @@
+"""Full-text product search.
+
+Product names and descriptions in both languages are normalized, tokenized
+and stored in an inverted index ranked with BM25. On SQLite the index lives
+in an FTS5 virtual table, so every worker shares it; elsewhere (Postgres,
+or SQLite builds without FTS5) a pure-Python in-memory index is used.
+
+Both backends take the text through the same `tokenize()` so that Arabic
+spelling variants (hamza forms on alef, taa marbuta, alef maqsura,
+diacritics, tatweel) and the definite article match each other.
+
+The in-memory structures (the memory backend and `SuggestIndex`) exist
+once per process. Writes update the writer's copy right away; every copy
+also remembers the catalog version it was built from, and once the shared
+version moves on (a write in any process) the next lookup starts a
+rebuild in a background thread, answering from the current copy until the
+new one is swapped in.
+
+`SuggestIndex` is a separate, much smaller structure for type-ahead: sorted
+arrays of name/SKU prefixes searched with bisect. It is built once per
+process outside of any request: `warm_indexes()` builds it in the gunicorn
+master before the workers fork, and a process that starts without it
+builds it in a background thread on first use.
+"""
+import heapq
+import os
+import re
+import threading
+from bisect import bisect_left, insort
+from collections import Counter
+from itertools import chain
+from math import log
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import load_only
+
+from app import app, db
+
+# Harakat, superscript alef and Quranic annotation marks
+_ARABIC_DIACRITICS = re.compile('[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed]')
+_TATWEEL = '\u0640'
+_ARABIC_FOLDS = str.maketrans({
+    '\u0622': '\u0627',  # alef with madda -> alef
+    '\u0623': '\u0627',  # alef with hamza above -> alef
+    '\u0625': '\u0627',  # alef with hamza below -> alef
+    '\u0671': '\u0627',  # alef wasla -> alef
+    '\u0629': '\u0647',  # taa marbuta -> haa
+    '\u0649': '\u064a',  # alef maqsura -> yaa
+    '\u0624': '\u0648',  # waw with hamza -> waw
+    '\u0626': '\u064a',  # yaa with hamza -> yaa
+})
+# Definite article, alone or with an attached conjunction/preposition
+_ARABIC_ARTICLES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Relative weight of each indexed field in the BM25 score
+FIELD_WEIGHTS = {'name': 3.0, 'description': 1.0}
+
+
+def normalize(value):
+    """Lowercase and fold Arabic spelling variants"""
+    if not value:
+        return ''
+    value = _ARABIC_DIACRITICS.sub('', value).replace(_TATWEEL, '')
+    return value.translate(_ARABIC_FOLDS).lower()
+
+
+def _strip_article(token):
+    for article in _ARABIC_ARTICLES:
+        # Keep at least two letters of stem so short words are not mangled
+        if token.startswith(article) and len(token) - len(article) >= 2:
+            return token[len(article):]
+    return token
+
+
+def tokenize(value):
+    """Split text into normalized search terms"""
+    return [_strip_article(token) for token in _TOKEN_RE.findall(normalize(value))]
+
+
+def product_fields(product):
+    """The indexed text of a product, keyed by field name"""
+    return {
+        'name': ' '.join(filter(None, [product.name_en, product.name_ar])),
+        'description': ' '.join(filter(None, [product.description_en, product.description_ar]))
+    }
+
+
+class _VersionedIndex:
+    """Background rebuilds of an in-memory index that follows the catalog version"""
+
+    version = None     # catalog version the index was built from
+    _building = None   # pid of the process whose background rebuild is running
+
+    def _stale(self):
+        from cache import catalog_cache, skip_cache
+        version = catalog_cache.version
+        if version is None or version == self.version:
+            return False
+        # Answers from this copy are behind the catalog; do not cache them under the new version
+        skip_cache()
+        return True
+
+    def refresh(self):
+        """Rebuild in a background thread, unless this process already is"""
+        with self._lock:
+            # Threads do not survive a fork, so a rebuild started by the parent does not count
+            if self._building == os.getpid():
+                return
+            self._building = os.getpid()
+        threading.Thread(target=self._background_rebuild, name=f'{type(self).__name__}-rebuild', daemon=True).start()
+
+    def _background_rebuild(self):
+        try:
+            with app.app_context():
+                self.rebuild()
+        except Exception as e:
+            app.logger.error(f'Failed to rebuild the {type(self).__name__}: {e}')
+        finally:
+            self._building = None
+
+
+def _indexed_products():
+    from models import Product
+    return Product.query.options(load_only(
+        Product.id, Product.name_en, Product.name_ar, Product.description_en, Product.description_ar
+    )).yield_per(1000)
+
+
+class MemorySearchIndex(_VersionedIndex):
+    """Pure-Python inverted index with BM25 ranking.
+
+    Every query term is matched as a prefix (so `scrub` finds `scrubs`, as
+    the old ILIKE search did) and all terms must match.
+
+    Search results have to be complete, so the first build of a process
+    runs in the searching request (or in `warm_indexes()`); only later
+    rebuilds happen in the background.
+    """
+
+    name = 'memory'
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}   # term -> {product_id: weighted term frequency}
+        self.doc_terms = {}  # product_id -> Counter of weighted term frequencies
+        self.doc_lengths = {}
+        self.total_length = 0.0
+        self._vocabulary = None
+        self._lock = threading.RLock()
+        self.built = False
+
+    def rebuild(self):
+        from cache import catalog_cache
+        # Read first: a write during the build leaves the index behind the version, not ahead of it
+        version = catalog_cache.version
+        fresh = MemorySearchIndex(self.k1, self.b)
+        for product in _indexed_products():
+            fresh._add(product.id, product_fields(product))
+        with self._lock:
+            self.postings, self.doc_terms, self.doc_lengths = fresh.postings, fresh.doc_terms, fresh.doc_lengths
+            self.total_length = fresh.total_length
+            self._vocabulary = None
+            self.version = version
+            self.built = True
+
+    def ensure_built(self):
+        if not self.built:
+            with self._lock:
+                if not self.built:
+                    self.rebuild()
+        elif self._stale():
+            self.refresh()
+
+    def index_product(self, product):
+        with self._lock:
+            if not self.built:
+                return
+            self._remove(product.id)
+            self._add(product.id, product_fields(product))
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self.built:
+                self._remove(product_id)
+
+    def _add(self, product_id, fields):
+        terms = Counter()
+        for field, value in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(value):
+                terms[token] += weight
+        if not terms:
+            return
+        for term, tf in terms.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                self._vocabulary = None
+            postings[product_id] = tf
+        length = sum(terms.values())
+        self.doc_terms[product_id] = terms
+        self.doc_lengths[product_id] = length
+        self.total_length += length
+
+    def _remove(self, product_id):
+        terms = self.doc_terms.pop(product_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[term]
+                self._vocabulary = None
+        self.total_length -= self.doc_lengths.pop(product_id)
+
+    def _expand(self, prefix):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        vocabulary = self._vocabulary
+        i = bisect_left(vocabulary, prefix)
+        while i < len(vocabulary) and vocabulary[i].startswith(prefix):
+            yield vocabulary[i]
+            i += 1
+
+    def search(self, query):
+        """Return {product_id: score} for products matching every query term"""
+        self.ensure_built()
+        tokens = tokenize(query)
+        if not tokens:
+            return {}
+        with self._lock:
+            n = len(self.doc_lengths)
+            if not n:
+                return {}
+            avg_length = self.total_length / n
+            scores = None
+            for token in dict.fromkeys(tokens):
+                token_scores = {}
+                for term in self._expand(token):
+                    postings = self.postings[term]
+                    idf = log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for product_id, tf in postings.items():
+                        norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[product_id] / avg_length)
+                        token_scores[product_id] = token_scores.get(product_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: score + token_scores[pid] for pid, score in scores.items() if pid in token_scores}
+                if not scores:
+                    return {}
+            return scores
+
+    def ranked(self, query, limit=None, offset=0):
+        """Ids matching every query term, best first (ties: newest id first).
+
+        With a limit only the top `offset + limit` are ordered, with a heap.
+        """
+        scores = self.search(query)
+        key = lambda pid: (-scores[pid], -pid)
+        if limit is None:
+            return sorted(scores, key=key)[offset:]
+        return heapq.nsmallest(offset + limit, scores, key=key)[offset:]
+
+    def filter_clause(self, query):
+        from models import Product
+        from pagination import in_ids
+        return in_ids(Product.id, self.search(query))
+
+
+class FTS5SearchIndex:
+    """SQLite FTS5 index stored in the `product_search` virtual table.
+
+    Text is run through `tokenize()` before it is stored, so FTS5 only has to
+    split on whitespace and Arabic normalization matches the memory backend.
+    """
+
+    name = 'fts5'
+    table = 'product_search'
+
+    def __init__(self):
+        self.built = False
+        self._lock = threading.Lock()
+
+    def _create(self):
+        db.session.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+            f"USING fts5(name, description, tokenize='unicode61 remove_diacritics 0')"
+        ))
+
+    def rebuild(self):
+        with self._lock:
+            self._create()
+            db.session.execute(text(f'DELETE FROM {self.table}'))
+            rows = []
+            for product in _indexed_products():
+                rows.append(self._row(product))
+                if len(rows) >= 1000:
+                    self._insert(rows)
+                    rows = []
+            if rows:
+                self._insert(rows)
+            db.session.commit()
+            self.built = True
+
+    def ensure_built(self):
+        if self.built:
+            return
+        from models import Product
+        self._create()
+        indexed = db.session.execute(text(f'SELECT count(*) FROM {self.table}')).scalar()
+        # The table survives `db.drop_all()` (e.g. seed.py), so reindex when it is out of step
+        if indexed != Product.query.count():
+            self.rebuild()
+        else:
+            db.session.commit()
+            self.built = True
+
+    @staticmethod
+    def _row(product):
+        fields = product_fields(product)
+        return {
+            'id': product.id,
+            'name': ' '.join(tokenize(fields['name'])),
+            'description': ' '.join(tokenize(fields['description']))
+        }
+
+    def _insert(self, rows):
+        db.session.execute(
+            text(f'INSERT INTO {self.table} (rowid, name, description) VALUES (:id, :name, :description)'),
+            rows
+        )
+
+    def index_product(self, product):
+        self.ensure_built()
+        db.session.execute(text(f'DELETE FROM {self.table} WHERE rowid = :id'), {'id': product.id})
+        self._insert([self._row(product)])
+        db.session.commit()
+
+    def remove_product(self, product_id):
+        self.ensure_built()
+        db.session.execute(text(f'DELETE FROM {self.table} WHERE rowid = :id'), {'id': product_id})
+        db.session.commit()
+
+    @staticmethod
+    def match_expression(query):
+        tokens = dict.fromkeys(tokenize(query))
+        return ' AND '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, query):
+        """Return {product_id: score} for products matching every query term"""
+        self.ensure_built()
+        match = self.match_expression(query)
+        if not match:
+            return {}
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in ('name', 'description'))
+        rows = db.session.execute(text(
+            f'SELECT rowid, bm25({self.table}, {weights}) FROM {self.table} WHERE {self.table} MATCH :q'
+        ), {'q': match})
+        # bm25() is lower-is-better; flip it so both backends rank descending
+        return {row[0]: -row[1] for row in rows}
+
+    def ranked(self, query, limit=None, offset=0):
+        """Ids matching every query term, best first (ties: newest id first).
+
+        FTS5 keeps only the top `offset + limit` while it scores the matches.
+        """
+        self.ensure_built()
+        match = self.match_expression(query)
+        if not match:
+            return []
+        weights = ', '.join(str(FIELD_WEIGHTS[field]) for field in ('name', 'description'))
+        rows = db.session.execute(text(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH :q '
+            f'ORDER BY bm25({self.table}, {weights}), rowid DESC LIMIT :limit OFFSET :offset'
+        ), {'q': match, 'limit': -1 if limit is None else limit, 'offset': offset})
+        return [row[0] for row in rows]
+
+    def filter_clause(self, query):
+        from models import Product
+        self.ensure_built()
+        match = self.match_expression(query) or '""'
+        matches = text(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH :q').bindparams(q=match)
+        return Product.id.in_(matches.columns(db.column('rowid', db.Integer)))
+
+
+def fts5_available():
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    try:
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql('CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)')
+            connection.exec_driver_sql('DROP TABLE temp._fts5_probe')
+        return True
+    except Exception:
+        return False
+
+
+class _LazySearchIndex:
+    """Picks the backend on first use, once an app context and engine exist"""
+
+    def __init__(self):
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _resolve(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    backend = app.config.get('SEARCH_BACKEND', 'auto')
+                    if backend == 'fts5' or (backend == 'auto' and fts5_available()):
+                        self._index = FTS5SearchIndex()
+                    else:
+                        self._index = MemorySearchIndex()
+        return self._index
+
+    def __getattr__(self, name):
+        return getattr(self._resolve(), name)
+
+
+search_index = _LazySearchIndex()
+
+
+class SuggestIndex(_VersionedIndex):
+    """In-memory prefix index for type-ahead suggestions.
+
+    Every word-suffix of each product and category name ("hydrating body
+    scrub", "body scrub", "scrub") and every SKU is stored in one sorted list
+    of `(key, rank, kind, id)` tuples, so a prefix lookup is a bisect plus a
+    short scan. Rank 0 marks a match at the start of the name or SKU.
+
+    A rebuild collects every entry, sorts once and swaps the new list in, so
+    lookups keep using the old one meanwhile. Every build runs in the
+    background; type-ahead is best effort, and until the first build
+    finishes `suggest()` returns no suggestions instead of making the
+    request wait for it.
+    """
+
+    # Upper bound on entries looked at per query, keeps one-letter prefixes cheap
+    MAX_SCAN = 400
+
+    def __init__(self):
+        self.entries = []
+        self.items = {}  # (kind, id) -> display fields
+        self._keys = {}  # (kind, id) -> entries it owns
+        self._lock = threading.RLock()
+        self.built = False
+
+    @staticmethod
+    def _name_keys(*names):
+        keys = set()
+        for name in names:
+            tokens = tokenize(name)
+            for i in range(len(tokens)):
+                keys.add((' '.join(tokens[i:]), 0 if i == 0 else 1))
+        return keys
+
+    def _add(self, kind, item_id, fields, keys):
+        item = (kind, item_id)
+        self.items[item] = fields
+        owned = [(key, rank, kind, item_id) for key, rank in keys if key]
+        for entry in owned:
+            insort(self.entries, entry)
+        self._keys[item] = owned
+
+    def _remove(self, kind, item_id):
+        item = (kind, item_id)
+        self.items.pop(item, None)
+        for entry in self._keys.pop(item, ()):
+            i = bisect_left(self.entries, entry)
+            if i < len(self.entries) and self.entries[i] == entry:
+                del self.entries[i]
+
+    def _product_item(self, product, thumbnail):
+        """(kind, id, display fields, keys) of a product row"""
+        keys = self._name_keys(product.name_en, product.name_ar)
+        keys.add((product.sku.lower(), 0))
+        return 'product', product.id, {
+            'name_en': product.name_en,
+            'name_ar': product.name_ar,
+            'thumbnail': thumbnail,
+            'is_featured': bool(product.is_featured)
+        }, keys
+
+    def _category_item(self, category):
+        return 'category', category.id, {
+            'name_en': category.name_en,
+            'name_ar': category.name_ar,
+            'slug': category.slug
+        }, self._name_keys(category.name_en, category.name_ar)
+
+    def _add_product(self, product):
+        thumbnail = None
+        if product.images:
+            thumbnail = min(product.images, key=lambda img: img.id).thumbnail_url
+        self._add(*self._product_item(product, thumbnail))
+
+    def _add_category(self, category):
+        self._add(*self._category_item(category))
+
+    def rebuild(self):
+        from cache import catalog_cache
+        from models import Category, Product, ProductImage
+        version = catalog_cache.version
+        # Plain rows: hydrating ORM objects would cost more than building the index
+        first_images = select(func.min(ProductImage.id)).group_by(ProductImage.product_id)
+        thumbnails = {
+            image.product_id: ProductImage.thumbnail_for(image.url, image.variants)
+            for image in db.session.execute(
+                select(ProductImage.product_id, ProductImage.url, ProductImage.variants)
+                .where(ProductImage.id.in_(first_images))
+            )
+        }
+        products = db.session.execute(
+            select(Product.id, Product.name_en, Product.name_ar, Product.sku, Product.is_featured)
+        )
+        entries = []
+        items = {}
+        owned_keys = {}
+        for kind, item_id, fields, keys in chain(
+            (self._product_item(product, thumbnails.get(product.id)) for product in products),
+            map(self._category_item, Category.query)
+        ):
+            owned = [(key, rank, kind, item_id) for key, rank in keys if key]
+            items[kind, item_id] = fields
+            owned_keys[kind, item_id] = owned
+            entries.extend(owned)
+        entries.sort()
+        with self._lock:
+            self.entries, self.items, self._keys = entries, items, owned_keys
+            self.version = version
+            self.built = True
+
+    def ensure_built(self):
+        """Start a background build when there is no index yet or it is out of date; returns whether there is one"""
+        if not self.built or self._stale():
+            self.refresh()
+        return self.built
+
+    def index_product(self, product):
+        with self._lock:
+            if self.built:
+                self._remove('product', product.id)
+                self._add_product(product)
+
+    def remove_product(self, product_id):
+        with self._lock:
+            if self.built:
+                self._remove('product', product_id)
+
+    def index_category(self, category):
+        with self._lock:
+            if self.built:
+                self._remove('category', category.id)
+                self._add_category(category)
+
+    def _scan(self, prefix, best):
+        i = bisect_left(self.entries, (prefix,))
+        end = min(len(self.entries), i + self.MAX_SCAN)
+        while i < end:
+            key, rank, kind, item_id = self.entries[i]
+            if not key.startswith(prefix):
+                break
+            item = (kind, item_id)
+            if rank < best.get(item, 2):
+                best[item] = rank
+            i += 1
+
+    def suggest(self, query, lang='en', limit=8):
+        """Return up to `limit` suggestions for the typed prefix"""
+        if not self.ensure_built():
+            return []
+        prefix = ' '.join(tokenize(query))
+        raw = query.strip().lower()
+        if not prefix and not raw:
+            return []
+        with self._lock:
+            best = {}
+            if prefix:
+                self._scan(prefix, best)
+            if raw and raw != prefix:
+                self._scan(raw, best)
+
+            def order(item):
+                fields = self.items[item]
+                name = fields['name_en'] if lang == 'en' else fields['name_ar']
+                # Start-of-name matches first, then categories, featured products, shorter names
+                return (best[item], item[0] != 'category', not fields.get('is_featured'), len(name), item[1])
+
+            results = []
+            for kind, item_id in sorted(best, key=order)[:limit]:
+                fields = self.items[(kind, item_id)]
+                result = {
+                    'type': kind,
+                    'id': item_id,
+                    'name': fields['name_en'] if lang == 'en' else fields['name_ar']
+                }
+                if kind == 'product':
+                    result['thumbnail'] = fields['thumbnail']
+                else:
+                    result['slug'] = fields['slug']
+                results.append(result)
+            return results
+
+
+suggest_index = SuggestIndex()
+
+
+def warm_indexes():
+    """Build the search and suggest indexes now, e.g. before forking workers, so no request waits for them"""
+    with app.app_context():
+        search_index.ensure_built()
+        suggest_index.rebuild()
+
+
+@app.cli.command('search-reindex')
+def search_reindex():
+    """Rebuild the product search index from the products table"""
+    search_index.rebuild()
+    print(f'Search index ({search_index.name}) rebuilt')
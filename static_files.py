@@ -0,0 +1,161 @@
+"""Serving the Angular frontend.
+
+The Angular build references its bundles relative to `<base href="/">`, so
+`/main.<hash>.js` and friends are looked up in `static/` before falling back
+to `index.html` for client-side routes.
+
+- Files with a content hash in their name never change, so they are served
+  with far-future immutable headers. Everything else revalidates.
+- `flask precompress-static` writes `.br` (when the brotli package is
+  installed) and `.gz` siblings at build time. The best one the client
+  accepts is sent as-is, so nothing is compressed per request.
+- `index.html` contains no template logic and is rendered once, then served
+  from memory with an ETag until the template file changes.
+
+Responses are built by `send_file`, which answers Range and conditional
+requests and hands the open file to the server's `wsgi.file_wrapper`, so
+gunicorn can use zero-copy sendfile(). Set USE_X_SENDFILE when a front
+server (Apache mod_xsendfile, lighttpd) should send the files instead.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+import click
+from flask import render_template, request, send_file
+from werkzeug.security import safe_join
+
+from app import app
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# Angular output hashing: main.5f564f76635f9329.js, styles.48ff71eba3c4972d.css
+HASHED_NAME = re.compile(r'\.[0-9a-f]{16,}\.[a-z0-9]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Unhashed files (favicon, assets/) may change on deploy
+STATIC_MAX_AGE = 60 * 60
+
+# Precompressed siblings, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+COMPRESSIBLE = {'.js', '.css', '.html', '.svg', '.txt', '.json', '.ico', '.map', '.xml'}
+# Smaller files gain nothing worth an extra file
+MIN_COMPRESS_SIZE = 1024
+
+
+def _accepts(encoding):
+    return request.accept_encodings[encoding] > 0
+
+
+def send_static_asset(path):
+    """Serve `static/<path>` (or its best precompressed sibling); None if there is no such file"""
+    filepath = safe_join(app.static_folder, path)
+    if filepath is None or not os.path.isfile(filepath):
+        return None
+
+    immutable = HASHED_NAME.search(path) is not None
+    mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if os.path.isfile(filepath + suffix) and _accepts(name):
+            encoding = name
+            filepath += suffix
+            break
+
+    response = send_file(
+        filepath,
+        mimetype=mimetype,
+        max_age=IMMUTABLE_MAX_AGE if immutable else STATIC_MAX_AGE,
+        conditional=True
+    )
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if os.path.splitext(path)[1] in COMPRESSIBLE:
+        response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    if immutable:
+        response.cache_control.immutable = True
+    return response
+
+
+class IndexPage:
+    """The rendered index.html, kept in memory until the template changes"""
+
+    def __init__(self, template='index.html'):
+        self.template = template
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._body = None
+        self._etag = None
+
+    def _template_path(self):
+        return os.path.join(app.root_path, app.template_folder, self.template)
+
+    def body(self):
+        try:
+            mtime = os.stat(self._template_path()).st_mtime
+        except OSError:
+            mtime = None
+        if self._body is None or mtime != self._mtime:
+            with self._lock:
+                if self._body is None or mtime != self._mtime:
+                    self._body = render_template(self.template).encode('utf-8')
+                    self._etag = hashlib.sha1(self._body).hexdigest()
+                    self._mtime = mtime
+        return self._body, self._etag
+
+    def response(self):
+        body, etag = self.body()
+        response = app.response_class(body, mimetype='text/html')
+        response.set_etag(etag)
+        # Always revalidate: a deploy changes which bundles index.html points at
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+index_page = IndexPage()
+
+
+def _precompress(path, data, force):
+    written = []
+    candidates = [('.gz', lambda: gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        candidates.insert(0, ('.br', lambda: brotli.compress(data, quality=11)))
+    for suffix, compress in candidates:
+        target = path + suffix
+        if not force and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+            continue
+        compressed = compress()
+        if len(compressed) >= len(data):
+            continue
+        with open(target, 'wb') as f:
+            f.write(compressed)
+        written.append((target, len(compressed)))
+    return written
+
+
+@app.cli.command('precompress-static')
+@click.option('--force', is_flag=True, help='Recompress files whose siblings are already up to date')
+def precompress_static(force):
+    """Write .br/.gz siblings of the frontend build for send_static_asset"""
+    if brotli is None:
+        print('brotli is not installed; writing .gz files only')
+    original = compressed = files = 0
+    for directory, _, filenames in os.walk(app.static_folder):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            if os.path.splitext(filename)[1] not in COMPRESSIBLE or os.path.getsize(path) < MIN_COMPRESS_SIZE:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            for target, size in _precompress(path, data, force):
+                files += 1
+                original += len(data)
+                compressed += size
+                print(f'{len(data):>10} -> {size:>10}  {os.path.relpath(target, app.static_folder)}')
+    print(f'Wrote {files} precompressed files ({original} -> {compressed} bytes)')
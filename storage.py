@@ -0,0 +1,522 @@
+"""Upload storage.
+
+Files live in a storage backend chosen by STORAGE_BACKEND:
+
+- `local` keeps them under UPLOAD_FOLDER and the app serves them itself.
+- `s3` keeps them in an S3-compatible bucket (AWS S3, MinIO, R2, ...), so
+  app instances need no shared disk. Downloads are redirected to the bucket
+  (S3_PUBLIC_URL, e.g. a CDN, or short-lived presigned URLs) instead of
+  being proxied through the app. `S3_ENDPOINT_URL=memory://` uses an
+  in-process fake bucket for development and tests.
+
+On top of the backend, uploads are content-addressed: they are streamed to
+a staging file and hashed (SHA-256) in the same pass, then stored once under
+a sharded path derived from the hash:
+
+    ab/cd/abcd1234....jpg
+
+Staging files live outside the served tree (next to UPLOAD_FOLDER, or in
+the temp directory for S3), so a partial upload is never downloadable;
+`flask storage-gc` clears the ones a crash leaves behind.
+
+Uploading the same bytes again reuses the existing blob. Each `Blob` row
+counts the product images referencing it, and the file (with its resized
+derivatives) is only removed when the last reference goes away.
+"""
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import quote
+
+import click
+from flask import abort, redirect, send_from_directory
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import safe_join
+
+from app import app, db
+from images import UPLOAD_URL_PREFIX, derivative_files, path_from_url
+from models import Blob, ProductImage
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:  # pragma: no cover - depends on the environment
+    boto3 = None
+
+CHUNK_SIZE = 64 * 1024
+STAGING_PREFIX = '.upload-'
+
+# Files larger than this are sent to S3 as multipart uploads of this part size
+MULTIPART_THRESHOLD = 8 * 1024 * 1024
+
+# Stored files are never rewritten (their names are content hashes, or
+# UUID-prefixed for older uploads), so clients may cache them forever
+SERVE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _content_type(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+class LocalStorage:
+    """Files under a local directory, served by the app itself"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+
+    def _full(self, path):
+        return os.path.join(self.root, path)
+
+    def staging_dir(self):
+        # A sibling of the root: outside the served tree, but on the same
+        # filesystem, so storing a staged upload is a rename
+        path = f'{os.path.abspath(self.root)}.staging'
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def put(self, path, local_path, move=True):
+        target = self._full(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if move:
+            os.replace(local_path, target)
+        else:
+            shutil.copyfile(local_path, target)
+
+    def exists(self, path):
+        return os.path.exists(self._full(path))
+
+    def delete(self, path):
+        full = self._full(path)
+        if os.path.exists(full):
+            os.remove(full)
+        # Prune shard directories left empty
+        directory = os.path.dirname(full)
+        while os.path.abspath(directory) != os.path.abspath(self.root) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+
+    def list(self):
+        """Yield (path, size, modified timestamp) for every stored file"""
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                full = os.path.join(directory, filename)
+                stat = os.stat(full)
+                yield os.path.relpath(full, self.root).replace(os.sep, '/'), stat.st_size, stat.st_mtime
+
+    @contextmanager
+    def local_folder(self, path):
+        """Yield a local directory containing `path`, for tools that need real files"""
+        yield self.root
+
+    def upload_local(self, folder, paths):
+        """Store files written under `folder` by a `local_folder` caller"""
+        if os.path.abspath(folder) != os.path.abspath(self.root):
+            for path in paths:
+                self.put(path, os.path.join(folder, path), move=False)
+
+    def serve(self, path):
+        # send_from_directory sets ETag/Last-Modified and answers conditional requests with 304
+        response = send_from_directory(self.root, path, max_age=SERVE_MAX_AGE)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+class S3Storage:
+    """Files in an S3-compatible bucket; downloads are redirected to the bucket"""
+
+    name = 's3'
+
+    def __init__(self, client, bucket, prefix='', public_url=None, presign_ttl=3600):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.presign_ttl = presign_ttl
+        self.transfer_config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_THRESHOLD
+        ) if boto3 is not None else None
+
+    def _key(self, path):
+        return self.prefix + path
+
+    def staging_dir(self):
+        return tempfile.gettempdir()
+
+    def put(self, path, local_path, move=True):
+        # upload_file streams from disk and switches to multipart above the threshold
+        extra = {
+            'ContentType': _content_type(path),
+            'CacheControl': f'public, max-age={SERVE_MAX_AGE}, immutable'
+        }
+        kwargs = {'ExtraArgs': extra}
+        if self.transfer_config is not None:
+            kwargs['Config'] = self.transfer_config
+        self.client.upload_file(local_path, self.bucket, self._key(path), **kwargs)
+        if move:
+            os.remove(local_path)
+
+    def exists(self, path):
+        key = self._key(path)
+        page = self.client.list_objects_v2(Bucket=self.bucket, Prefix=key, MaxKeys=1)
+        return any(obj['Key'] == key for obj in page.get('Contents', []))
+
+    def delete(self, path):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(path))
+
+    def list(self):
+        kwargs = {'Bucket': self.bucket, 'Prefix': self.prefix}
+        while True:
+            page = self.client.list_objects_v2(**kwargs)
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):], obj['Size'], obj['LastModified'].timestamp()
+            if not page.get('IsTruncated'):
+                break
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    @contextmanager
+    def local_folder(self, path):
+        folder = tempfile.mkdtemp(prefix='athar-storage-')
+        try:
+            target = os.path.join(folder, path)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            self.client.download_file(self.bucket, self._key(path), target)
+            yield folder
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def upload_local(self, folder, paths):
+        for path in paths:
+            self.put(path, os.path.join(folder, path), move=False)
+
+    def url(self, path):
+        if self.public_url:
+            return f'{self.public_url}/{quote(self._key(path))}'
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._key(path)}, ExpiresIn=self.presign_ttl
+        )
+
+    def serve(self, path):
+        if safe_join('/', path) is None:
+            abort(404)
+        response = redirect(self.url(path), code=302)
+        # Browsers may reuse the redirect, but never past a presigned URL's expiry
+        response.cache_control.public = True
+        response.cache_control.max_age = SERVE_MAX_AGE if self.public_url else self.presign_ttl // 2
+        return response
+
+
+class MemoryS3Client:
+    """In-process stand-in for the subset of the boto3 S3 client used above"""
+
+    endpoint = 'http://s3.memory.local'
+
+    def __init__(self):
+        self.objects = {}
+        self.multipart_uploads = 0
+        self._lock = threading.Lock()
+        self._secret = os.urandom(16)
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Config=None):
+        part_size = getattr(Config, 'multipart_chunksize', MULTIPART_THRESHOLD)
+        with open(Filename, 'rb') as f:
+            parts = list(iter(lambda: f.read(part_size), b''))
+        with self._lock:
+            if len(parts) > 1:
+                self.multipart_uploads += 1
+            self.objects[(Bucket, Key)] = (b''.join(parts), dict(ExtraArgs or {}), datetime.now(timezone.utc))
+
+    def download_file(self, Bucket, Key, Filename):
+        with self._lock:
+            body = self.objects[(Bucket, Key)][0]
+        with open(Filename, 'wb') as f:
+            f.write(body)
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None):
+        with self._lock:
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+            if ContinuationToken:
+                keys = [key for key in keys if key > ContinuationToken]
+            page = keys[:MaxKeys]
+            contents = [{
+                'Key': key,
+                'Size': len(self.objects[(Bucket, key)][0]),
+                'LastModified': self.objects[(Bucket, key)][2]
+            } for key in page]
+        result = {'Contents': contents, 'IsTruncated': len(keys) > MaxKeys}
+        if result['IsTruncated']:
+            result['NextContinuationToken'] = page[-1]
+        return result
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn=3600):
+        key = f"{Params['Bucket']}/{quote(Params['Key'])}"
+        signature = hmac.new(self._secret, f'{key}:{ExpiresIn}'.encode(), hashlib.sha256).hexdigest()
+        return f'{self.endpoint}/{key}?X-Amz-Expires={ExpiresIn}&X-Amz-Signature={signature}'
+
+
+def create_storage(config):
+    backend = config.get('STORAGE_BACKEND', 'local')
+    if backend == 'local':
+        return LocalStorage(config['UPLOAD_FOLDER'])
+    if backend == 's3':
+        endpoint = config.get('S3_ENDPOINT_URL')
+        if endpoint == 'memory://':
+            client = MemoryS3Client()
+        elif boto3 is None:
+            raise RuntimeError('STORAGE_BACKEND=s3 requires the boto3 package')
+        else:
+            # Credentials come from the usual AWS_* environment variables
+            client = boto3.client('s3', endpoint_url=endpoint or None, region_name=config.get('S3_REGION') or None)
+        return S3Storage(
+            client,
+            config['S3_BUCKET'],
+            prefix=config.get('S3_PREFIX', ''),
+            public_url=config.get('S3_PUBLIC_URL'),
+            presign_ttl=config.get('S3_PRESIGN_TTL', 3600)
+        )
+    raise ValueError(f'Unknown STORAGE_BACKEND {backend}')
+
+
+upload_storage = create_storage(app.config)
+
+
+def url_for_path(path):
+    return UPLOAD_URL_PREFIX + path
+
+
+def blob_path(digest, extension):
+    return f'{digest[:2]}/{digest[2:4]}/{digest}.{extension}'
+
+
+class StagedUpload:
+    """An upload written to a local staging file, with its hash and size"""
+
+    def __init__(self, path, digest, size):
+        self.path = path
+        self.digest = digest
+        self.size = size
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def rehash(self):
+        """Refresh the hash and size after the staging file was rewritten in place"""
+        self.digest = _hash_file(self.path)
+        self.size = os.path.getsize(self.path)
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_upload(file):
+    """Copy an uploaded file to a staging file, hashing it as it streams"""
+    digest = hashlib.sha256()
+    size = 0
+    path = os.path.join(upload_storage.staging_dir(), f'{STAGING_PREFIX}{uuid.uuid4().hex}.tmp')
+    with open(path, 'wb') as out:
+        for chunk in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            out.write(chunk)
+            size += len(chunk)
+    return StagedUpload(path, digest.hexdigest(), size)
+
+
+def store_upload(staged, extension):
+    """Store a staged upload, deduplicated by content.
+
+    Adds a reference to the matching `Blob` (creating it if needed) in the
+    current transaction and returns `(blob, created)`. `created` is False
+    when identical bytes were already stored. The staging file is consumed.
+    """
+    path = blob_path(staged.digest, extension.lower())
+    blob = db.session.get(Blob, staged.digest)
+    created = blob is None
+    if created:
+        blob = Blob(hash=staged.digest, path=path, size=staged.size, ref_count=1)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            # A concurrent upload of the same bytes created it first
+            created = False
+            blob = db.session.get(Blob, staged.digest)
+
+    if created or not upload_storage.exists(blob.path):
+        upload_storage.put(blob.path, staged.path)
+    else:
+        staged.discard()
+
+    if not created:
+        db.session.execute(
+            update(Blob).where(Blob.hash == staged.digest).values(ref_count=Blob.ref_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.expire(blob, ['ref_count'])
+    return blob, created
+
+
+def reuse_derivatives(image):
+    """Copy the derivatives of another ready image of the same blob onto `image`.
+
+    Returns False when there are none yet and the image needs processing.
+    """
+    other = ProductImage.query.filter(
+        ProductImage.blob_hash == image.blob_hash,
+        ProductImage.status == 'ready',
+        ProductImage.variants.isnot(None),
+        ProductImage.id != image.id
+    ).first()
+    if other is None:
+        return False
+    image.width, image.height, image.variants = other.width, other.height, other.variants
+    image.status = 'ready'
+    return True
+
+
+def release(image):
+    """Delete `image` and drop the reference it holds on its file in the current transaction.
+
+    Returns the storage paths to delete once the caller has committed: the
+    original and its derivatives when this was the last reference, nothing
+    while other images still use the blob. Images uploaded before the blob
+    store own their files outright.
+    """
+    db.session.delete(image)
+    if image.blob_hash is None:
+        return [path_from_url(image.url)] + derivative_files(image.variants)
+    # The image row references the blob, so it has to be gone before the blob row
+    db.session.flush()
+    db.session.execute(
+        update(Blob).where(Blob.hash == image.blob_hash).values(ref_count=Blob.ref_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    blob = db.session.get(Blob, image.blob_hash, populate_existing=True)
+    if blob is None or blob.ref_count > 0:
+        return []
+    db.session.delete(blob)
+    return [blob.path] + derivative_files(image.variants)
+
+
+def delete_files(paths):
+    for path in paths:
+        try:
+            upload_storage.delete(path)
+        except Exception as e:
+            print(f"Warning: Could not delete file {path}: {e}")
+
+
+def referenced_paths():
+    """Every storage path referenced by a product image or blob row"""
+    paths = set()
+    for url, variants in db.session.query(ProductImage.url, ProductImage.variants):
+        paths.add(path_from_url(url))
+        paths.update(derivative_files(variants))
+    paths.update(path for (path,) in db.session.query(Blob.path))
+    return paths
+
+
+@app.cli.command('storage-gc')
+@click.option('--delete', is_flag=True, help='Remove the orphaned files instead of only listing them')
+def storage_gc(delete):
+    """Find uploaded files that no product image references"""
+    referenced = referenced_paths()
+    orphans = [(path, size) for path, size, _ in upload_storage.list() if path not in referenced]
+
+    for path, size in orphans:
+        print(f'{size:>12}  {path}')
+    total = sum(size for _, size in orphans)
+    print(f'{len(orphans)} orphaned files, {total} bytes')
+
+    unreferenced = Blob.query.filter(Blob.ref_count <= 0).all()
+    if delete:
+        delete_files(path for path, _ in orphans)
+        for blob in unreferenced:
+            db.session.delete(blob)
+        db.session.commit()
+        print(f'Deleted {len(orphans)} files and {len(unreferenced)} unreferenced blob rows')
+    elif unreferenced:
+        print(f'{len(unreferenced)} blob rows have no references')
+
+    # Staging files an interrupted upload left behind; in-flight ones are younger
+    cutoff = (datetime.now() - timedelta(hours=1)).timestamp()
+    staging = upload_storage.staging_dir()
+    stale = [
+        entry.path for entry in os.scandir(staging)
+        if entry.name.startswith(STAGING_PREFIX) and entry.stat().st_mtime < cutoff
+    ]
+    if delete:
+        for path in stale:
+            os.remove(path)
+        print(f'Deleted {len(stale)} stale staging files from {staging}')
+    elif stale:
+        print(f'{len(stale)} stale staging files in {staging}')
+
+
+@app.cli.command('storage-import')
+def storage_import():
+    """Move images uploaded before the blob store into it, merging duplicates"""
+    moved = merged = 0
+    for image in ProductImage.query.filter(ProductImage.blob_hash.is_(None)).order_by(ProductImage.id):
+        path = path_from_url(image.url)
+        if not upload_storage.exists(path):
+            continue
+        extension = path.rsplit('.', 1)[-1] if '.' in path.rsplit('/', 1)[-1] else 'bin'
+        with upload_storage.local_folder(path) as folder:
+            source = os.path.join(folder, path)
+            staged = StagedUpload(source, _hash_file(source), os.path.getsize(source))
+            blob, created = store_upload(staged, extension)
+        image.blob_hash = blob.hash
+        image.url = url_for_path(blob.path)
+        db.session.flush()
+        if created:
+            moved += 1
+        else:
+            merged += 1
+            # Use the surviving copy's derivatives; ours become orphans for storage-gc
+            reuse_derivatives(image)
+    db.session.commit()
+    print(f'Moved {moved} files into the blob store and merged {merged} duplicates')
+    print('Run `flask storage-gc --delete` to remove the files they replaced')
+
+
+@app.cli.command('storage-migrate')
+@click.option('--source', default=None, help='Local directory to copy from (default: UPLOAD_FOLDER)')
+@click.option('--delete-local', is_flag=True, help='Remove each local file once it is stored')
+def storage_migrate(source, delete_local):
+    """Copy existing local uploads into the configured storage backend"""
+    source = LocalStorage(source or app.config['UPLOAD_FOLDER'])
+    if isinstance(upload_storage, LocalStorage) and os.path.abspath(source.root) == os.path.abspath(upload_storage.root):
+        print('STORAGE_BACKEND is local and already uses this folder; nothing to migrate')
+        return
+    copied = skipped = 0
+    for path, size, _ in list(source.list()):
+        if path.rsplit('/', 1)[-1].startswith(STAGING_PREFIX):
+            continue
+        if upload_storage.exists(path):
+            skipped += 1
+        else:
+            upload_storage.put(path, os.path.join(source.root, path), move=False)
+            copied += 1
+        if delete_local:
+            source.delete(path)
+    print(f'Copied {copied} files to {upload_storage.name} storage, {skipped} were already there')
@@ -0,0 +1,229 @@
+"""Denormalized product summaries backing card-view listings.
+
+`product_summaries` holds each product's card JSON, pre-encoded per
+language with the category and primary thumbnail already joined in, so
+`/api/products?view=card` is answered by concatenating stored bytes instead
+of hydrating Product, Category and ProductImage objects.
+
+Rows are maintained incrementally: `after_insert`/`after_update`/
+`after_delete` mapper events on Product, ProductImage and Category record
+which products changed, and the affected summaries are rewritten at the end
+of the flush, inside the same transaction. Writes that bypass the ORM (bulk
+inserts, `flask seed`) are caught by `ProductSummaries.ready()`, which
+rebuilds the table when its row count drifts, and by the listing itself,
+which renders products without a summary through the ORM.
+
+Stock changes with every order (through bulk UPDATEs that fire no events),
+so it is not stored: it is read live from `products` and appended to the
+stored card when the listing is rendered.
+"""
+import threading
+import time
+
+from sqlalchemy import delete, event, func, insert, inspect, select
+from sqlalchemy.orm import Session, object_session
+
+from app import app, db
+from models import Category, Product, ProductImage, ProductSummary
+from responses import dumps_bytes
+
+CARD_FIELDS = Product.VIEWS['card']
+# Product columns rendered into the stored card
+CARD_COLUMNS = ('name_en', 'name_ar', 'price', 'category_id', 'is_featured')
+BATCH_SIZE = 500
+# A failed sync check is retried after this many seconds; listings use the ORM meanwhile
+READY_RETRY_SECONDS = 30
+
+
+def _card(product, category, thumbnail, lang):
+    """Card view of a product without stock, matching Product.project(CARD_FIELDS)"""
+    return {
+        'id': product.id,
+        'name': product.name_en if lang == 'en' else product.name_ar,
+        'price': product.price,
+        'category_id': product.category_id,
+        'category': {
+            'id': category.id,
+            'name': category.name_en if lang == 'en' else category.name_ar,
+            'slug': category.slug
+        } if category is not None else None,
+        'is_featured': product.is_featured,
+        'thumbnail': thumbnail
+    }
+
+
+def render_card(card, stock):
+    """Append the live stock to a stored card"""
+    return card[:-1] + b',"stock":' + str(stock).encode() + b'}'
+
+
+def _rebuild_batch(connection, product_ids):
+    products = connection.execute(
+        select(Product.id, Product.name_en, Product.name_ar, Product.price, Product.category_id, Product.is_featured)
+        .where(Product.id.in_(product_ids))
+    ).all()
+    category_ids = {p.category_id for p in products}
+    categories = {c.id: c for c in connection.execute(
+        select(Category.id, Category.name_en, Category.name_ar, Category.slug).where(Category.id.in_(category_ids))
+    )} if category_ids else {}
+    thumbnails = {}
+    for image in connection.execute(
+        select(ProductImage.product_id, ProductImage.url, ProductImage.variants)
+        .where(ProductImage.product_id.in_(product_ids))
+        .order_by(ProductImage.product_id, ProductImage.id)
+    ):
+        if image.product_id not in thumbnails:
+            thumbnails[image.product_id] = ProductImage.thumbnail_for(image.url, image.variants)
+
+    connection.execute(delete(ProductSummary).where(ProductSummary.product_id.in_(product_ids)))
+    rows = [{
+        'product_id': p.id,
+        'card_en': dumps_bytes(_card(p, categories.get(p.category_id), thumbnails.get(p.id), 'en')),
+        'card_ar': dumps_bytes(_card(p, categories.get(p.category_id), thumbnails.get(p.id), 'ar')),
+    } for p in products]
+    if rows:
+        connection.execute(insert(ProductSummary), rows)
+
+
+def rebuild(connection, product_ids=None):
+    """Rewrite the summaries of `product_ids` (all products when None).
+
+    Ids of deleted products just lose their summary row.
+    """
+    if product_ids is None:
+        connection.execute(delete(ProductSummary))
+        product_ids = [row.id for row in connection.execute(select(Product.id))]
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), BATCH_SIZE):
+        _rebuild_batch(connection, product_ids[start:start + BATCH_SIZE])
+
+
+# ---------- Incremental maintenance ----------
+
+def _dirty(target, key):
+    session = object_session(target)
+    if session is None:
+        return set()
+    return session.info.setdefault(key, set())
+
+
+def _card_changed(target):
+    state = inspect(target)
+    return any(state.attrs[column].history.has_changes() for column in CARD_COLUMNS)
+
+
+@event.listens_for(Product, 'after_insert')
+@event.listens_for(Product, 'after_delete')
+def _product_written(mapper, connection, target):
+    _dirty(target, 'summary_products').add(target.id)
+
+
+@event.listens_for(Product, 'after_update')
+def _product_updated(mapper, connection, target):
+    # Stock-only updates (checkout) leave the stored card unchanged
+    if _card_changed(target):
+        _dirty(target, 'summary_products').add(target.id)
+
+
+@event.listens_for(ProductImage, 'after_insert')
+@event.listens_for(ProductImage, 'after_update')
+@event.listens_for(ProductImage, 'after_delete')
+def _image_written(mapper, connection, target):
+    _dirty(target, 'summary_products').add(target.product_id)
+
+
+# A new category has no products yet, so only updates and deletes matter
+@event.listens_for(Category, 'after_update')
+@event.listens_for(Category, 'after_delete')
+def _category_written(mapper, connection, target):
+    _dirty(target, 'summary_categories').add(target.id)
+
+
+@event.listens_for(Session, 'after_flush_postexec')
+def _refresh_summaries(session, flush_context):
+    product_ids = session.info.pop('summary_products', set())
+    category_ids = session.info.pop('summary_categories', set())
+    if not product_ids and not category_ids:
+        return
+    connection = session.connection()
+    if category_ids:
+        product_ids |= {row.id for row in connection.execute(
+            select(Product.id).where(Product.category_id.in_(category_ids))
+        )}
+    product_ids.discard(None)
+    rebuild(connection, product_ids)
+
+
+# ---------- Serving ----------
+
+class ProductSummaries:
+    """Read side of the summaries table"""
+
+    def __init__(self):
+        self._ready = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def _due(self):
+        return self._ready is None or (not self._ready and time.monotonic() >= self._retry_at)
+
+    def ready(self):
+        """True once the table is known to be in sync (checked once per process,
+        and again every READY_RETRY_SECONDS while the check fails)"""
+        if self._due():
+            with self._lock:
+                if self._due():
+                    self._ready = self._check()
+        return self._ready
+
+    def _check(self):
+        try:
+            products = db.session.query(func.count(Product.id)).scalar()
+            summaries = db.session.query(func.count(ProductSummary.product_id)).scalar()
+            if products != summaries:
+                rebuild(db.session.connection())
+                db.session.commit()
+            return True
+        except Exception:
+            db.session.rollback()
+            self._retry_at = time.monotonic() + READY_RETRY_SECONDS
+            app.logger.exception(f'Product summaries unavailable, listing through the ORM; retrying in {READY_RETRY_SECONDS}s')
+            return False
+
+    def card_query(self, query, lang='en'):
+        """Turn a filtered Product query into rows of (id, price, created_at, stock, card)"""
+        card = ProductSummary.card_en if lang == 'en' else ProductSummary.card_ar
+        return query.outerjoin(ProductSummary, ProductSummary.product_id == Product.id) \
+            .with_entities(Product.id, Product.price, Product.created_at, Product.stock, card.label('card'))
+
+    def render(self, rows, lang='en'):
+        """Encoded cards for `rows` of card_query, in order.
+
+        Products written behind the ORM's back have no summary yet; they are
+        rendered through the ORM and their summaries written for next time.
+        """
+        missing = [row.id for row in rows if row.card is None]
+        fallback = {}
+        if missing:
+            options = Product.load_options(CARD_FIELDS, lang)
+            for product in Product.query.options(*options).filter(Product.id.in_(missing)):
+                fallback[product.id] = dumps_bytes(product.to_dict(lang, CARD_FIELDS))
+            try:
+                rebuild(db.session.connection(), missing)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception(f'Failed to write the summaries of products {missing}')
+        return [render_card(row.card, row.stock) if row.card is not None else fallback[row.id]
+                for row in rows if row.card is not None or row.id in fallback]
+
+
+product_summaries = ProductSummaries()
+
+
+@app.cli.command('summaries-rebuild')
+def summaries_rebuild():
+    """Rebuild the product summaries table from scratch"""
+    rebuild(db.session.connection())
+    db.session.commit()
+    print(f'Rebuilt {db.session.query(func.count(ProductSummary.product_id)).scalar()} product summaries')
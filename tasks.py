@@ -0,0 +1,225 @@
+"""Lightweight background jobs without an external broker.
+
+Jobs are rows in the `jobs` table, so the queue survives restarts and is
+shared by every app process. A small pool of worker threads runs inside each
+app process (or in a dedicated `flask run-worker` process). Workers claim a
+job with a conditional UPDATE, so two workers never run the same job, and
+failed jobs are retried with exponential backoff up to `max_attempts`.
+
+    @task('send_email', max_attempts=5)
+    def send_email(user_id):
+        ...
+
+    enqueue('send_email', user_id=1)
+    db.session.commit()
+    task_worker.wake()
+"""
+import os
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+from sqlalchemy import update, or_, and_
+
+from app import app, db
+from models import Job
+
+# Registered handlers: name -> (function, on_failure, max_attempts)
+TASKS = {}
+
+# How long a claimed job may run before another worker may take it over
+LEASE_SECONDS = 300
+
+
+def task(name, max_attempts=3, on_failure=None):
+    """Register a function as a background task.
+
+    `on_failure(**payload)` is called once the job has used up its attempts.
+    """
+    def decorator(fn):
+        TASKS[name] = (fn, on_failure, max_attempts)
+        return fn
+    return decorator
+
+
+def enqueue(name, **payload):
+    """Add a job to the current transaction; it becomes visible on commit"""
+    if name not in TASKS:
+        raise KeyError(f'Unknown task {name}')
+    job = Job(name=name, payload=payload, max_attempts=TASKS[name][2], run_after=datetime.utcnow())
+    db.session.add(job)
+    return job
+
+
+def _claim():
+    """Atomically take the next runnable job, or return None"""
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(or_(
+        and_(Job.status == 'queued', Job.run_after <= now),
+        and_(Job.status == 'running', Job.locked_until < now)  # abandoned by a dead worker
+    )).order_by(Job.run_after, Job.id).limit(5).all()
+    for (job_id,) in candidates:
+        result = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, or_(
+                and_(Job.status == 'queued', Job.run_after <= now),
+                and_(Job.status == 'running', Job.locked_until < now)
+            ))
+            .values(status='running', attempts=Job.attempts + 1,
+                    locked_until=now + timedelta(seconds=LEASE_SECONDS))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def run_job(job):
+    """Run one claimed job and record the outcome"""
+    fn, on_failure, _ = TASKS.get(job.name, (None, None, 0))
+    try:
+        if fn is None:
+            raise KeyError(f'Unknown task {job.name}')
+        fn(**job.payload)
+        job.status = 'done'
+        job.last_error = None
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return True
+    except Exception:
+        db.session.rollback()
+        job = db.session.get(Job, job.id)
+        job.last_error = traceback.format_exc()[-2000:]
+        if job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+        else:
+            job.status = 'queued'
+            job.run_after = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+        job.locked_until = None
+        db.session.commit()
+        if job.status == 'failed' and on_failure is not None:
+            try:
+                on_failure(**job.payload)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                traceback.print_exc()
+        return False
+
+
+def run_pending(limit=None):
+    """Run runnable jobs in the calling thread. Returns the number of jobs run."""
+    count = 0
+    while limit is None or count < limit:
+        job = _claim()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+class TaskWorker:
+    """Pool of daemon threads draining the job queue in this process.
+
+    Threads do not survive `fork()`, so the pool remembers the pid it was
+    started in and `ensure_started()` starts a fresh pool in each worker
+    process (e.g. after gunicorn forks a preloaded app).
+    """
+
+    def __init__(self, threads=2, poll_interval=2.0):
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self._pid = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or self.threads <= 0:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            self._stop = threading.Event()
+            for i in range(self.threads):
+                threading.Thread(target=self._loop, name=f'task-worker-{i}', daemon=True).start()
+
+    def wake(self):
+        self.ensure_started()
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            ran = 0
+            try:
+                with app.app_context():
+                    ran = run_pending(limit=10)
+            except Exception:
+                traceback.print_exc()
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+
+task_worker = TaskWorker(
+    threads=app.config.get('TASK_WORKER_THREADS', 2),
+    poll_interval=app.config.get('TASK_POLL_INTERVAL', 2.0)
+)
+
+
+@app.before_request
+def _start_task_worker():
+    task_worker.ensure_started()
+
+
+@app.cli.command('run-worker')
+def run_worker():
+    """Process background jobs in the foreground until interrupted"""
+    print(f'Processing jobs: {", ".join(sorted(TASKS))}')
+    try:
+        while True:
+            if not run_pending():
+                time.sleep(task_worker.poll_interval)
+    except KeyboardInterrupt:
+        pass
+
+
+# ---------- Task definitions ----------
+
+def _mark_image_failed(image_id):
+    from models import ProductImage
+    image = db.session.get(ProductImage, image_id)
+    if image is not None:
+        image.status = 'failed'
+
+
+@task('process_image', max_attempts=3, on_failure=_mark_image_failed)
+def process_image(image_id):
+    """Generate the derivatives of an uploaded product image"""
+    from models import ProductImage
+    from images import generate_derivatives, derivative_files, path_from_url
+    from storage import upload_storage
+    from cache import catalog_cache
+    from search import suggest_index
+
+    image = db.session.get(ProductImage, image_id)
+    if image is None:
+        return
+    path = path_from_url(image.url)
+    with upload_storage.local_folder(path) as folder:
+        image.width, image.height, image.variants = generate_derivatives(folder, path)
+        upload_storage.upload_local(folder, derivative_files(image.variants))
+    image.status = 'ready'
+    db.session.commit()
+    catalog_cache.bump_version()
+    suggest_index.index_product(image.product)
@@ -0,0 +1,69 @@
+"""Runs the app against a freshly seeded SQLite database in a temporary directory.
+
+Run from the repository root: `python -m pytest tests`.
+"""
+import os
+import tempfile
+
+_workdir = tempfile.mkdtemp(prefix='athar-tests-')
+# Read when app.py is imported, so they are set before any test imports it
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_workdir, "athar.db")}'
+os.environ['UPLOAD_FOLDER'] = os.path.join(_workdir, 'uploads')
+os.environ['TASK_WORKER_THREADS'] = '0'
+
+import pytest
+
+# The models module imports app, not the other way round
+from app import app
+
+pytest_plugins = ['query_budget_pytest']
+
+
+@pytest.fixture(scope='session', autouse=True)
+def seeded_database():
+    from cache import catalog_cache
+    from search import warm_indexes
+    from seed import seed_database
+    seed_database()
+    with app.app_context():
+        # create_all() leaves the catalog_version row to the first bump
+        catalog_cache.bump_version()
+    # Requests never build the indexes themselves; an unbuilt suggest index answers []
+    warm_indexes()
+
+
+SHIPPING = {'name': 'Test Customer', 'phone': '0100000000', 'city': 'Cairo', 'street': '1 Nile St'}
+
+
+def _login(email, password):
+    response = app.test_client().post('/api/auth/login', json={'email': email, 'password': password})
+    return {'Authorization': f'Bearer {response.get_json()["data"]["token"]}'}
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def customer():
+    """Auth headers of the seeded customer"""
+    return _login('customer@athar.com', 'customer123')
+
+
+@pytest.fixture
+def admin():
+    """Auth headers of the seeded admin"""
+    return _login('admin@athar.com', 'admin123')
+
+
+@pytest.fixture
+def checkout():
+    """checkout(client, headers, {product_id: quantity}) fills the cart, quotes it and returns (token, order response)"""
+    def place(client, headers, quantities):
+        client.put('/api/cart', json={'items': [
+            {'product_id': product_id, 'quantity': quantity} for product_id, quantity in quantities.items()
+        ]}, headers=headers)
+        token = client.post('/api/cart/quote', headers=headers).get_json()['data']['token']
+        return token, client.post('/api/orders', json={'quote_token': token, 'shipping': SHIPPING}, headers=headers)
+    return place
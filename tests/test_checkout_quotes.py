@@ -0,0 +1,20 @@
+"""Checkout quote tokens (cart.py)"""
+from conftest import SHIPPING
+
+
+def test_quote_token_places_one_order(client, customer, admin, checkout):
+    token, response = checkout(client, customer, {5: 1})
+    assert response.status_code == 201
+    quoted_total = response.get_json()['data']['total']
+
+    # The same line back in the cart, and a new price the old token must not keep
+    assert client.put('/api/products/5', json={'price': 999}, headers=admin).status_code == 200
+    client.put('/api/cart', json={'items': [{'product_id': 5, 'quantity': 1}]}, headers=customer)
+    response = client.post('/api/orders', json={'quote_token': token, 'shipping': SHIPPING}, headers=customer)
+    assert response.status_code == 409
+
+    # The refused order left the cart alone, and a new quote has the new price
+    _, response = checkout(client, customer, {5: 1})
+    assert response.status_code == 201
+    assert response.get_json()['data']['total'] == 999
+    assert quoted_total != 999
@@ -0,0 +1,33 @@
+"""The query_budget_pytest plugin, run against the seeded catalog (see conftest.py)"""
+import pytest
+from sqlalchemy.orm import lazyload
+
+from models import Order, Product
+
+
+def test_catalog_reads_within_budget(budget_client):
+    assert budget_client.get('/api/products?limit=5').status_code == 200
+    response = budget_client.get('/api/products/suggest?q=sc')
+    assert response.status_code == 200
+    assert response.get_json()['data']
+
+
+def test_overrun_fails_the_test(budget_client, monkeypatch):
+    # Without eager loading every product lazy-loads its images and category
+    monkeypatch.setattr(Product, 'load_options', classmethod(lambda cls, fields, lang='en': [lazyload('*')]))
+    with pytest.raises(pytest.fail.Exception, match=r'GET /api/products ran \d+ queries, budget is 10'):
+        budget_client.get('/api/products?sort=price_desc')
+
+
+def test_streamed_response_is_counted(budget_client, customer, admin, checkout, monkeypatch):
+    for product_id in (1, 2, 3):
+        assert checkout(budget_client, customer, {product_id: 1})[1].status_code == 201
+
+    # Without a limit the listing is streamed; its queries run after the view returned
+    response = budget_client.get('/api/orders', headers=admin)
+    assert response.status_code == 200
+    assert len(response.get_json()['data']) >= 3
+
+    monkeypatch.setattr(Order, 'listing_options', classmethod(lambda cls: [lazyload('*')]))
+    with pytest.raises(pytest.fail.Exception, match=r'GET /api/orders ran \d+ queries, budget is 6'):
+        budget_client.get('/api/orders', headers=admin)
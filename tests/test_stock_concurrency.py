@@ -0,0 +1,39 @@
+"""Parallel checkouts of one SKU never oversell it (the CI version of benchmarks/stock_concurrency.py)"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app, db
+from conftest import SHIPPING
+from models import Category, OrderItem, Product
+
+STOCK = 20
+CHECKOUTS = 80
+THREADS = 16
+
+
+def test_parallel_orders_never_oversell(customer):
+    with app.app_context():
+        category = Category.query.first()
+        product = Product(name_en='Hot SKU', name_ar='Hot SKU', price=10, stock=STOCK,
+                          sku='HOT-CONCURRENCY', category_id=category.id)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+
+    payload = {'items': [{'product_id': product_id, 'quantity': 1}], 'shipping': SHIPPING}
+
+    def checkout(_):
+        return app.test_client().post('/api/orders', json=payload, headers=customer).status_code
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        statuses = Counter(pool.map(checkout, range(CHECKOUTS)))
+
+    with app.app_context():
+        final_stock = db.session.get(Product, product_id).stock
+        ordered = OrderItem.query.filter_by(product_id=product_id).count()
+
+    assert statuses[201] == STOCK, statuses
+    # The rest are refused for insufficient stock, none fail on a lock
+    assert set(statuses) == {201, 400}, statuses
+    assert ordered == STOCK
+    assert final_stock == 0